@@ -0,0 +1,197 @@
+"""Just enough of the S3 REST API, path style, to benchmark the uploaders.
+
+Bodies are read and counted but not stored. The server records when each
+object was completed, which is what the benchmark measures latency against.
+
+Supported: PutObject, HeadObject, CreateMultipartUpload, UploadPart,
+CompleteMultipartUpload and AbortMultipartUpload.
+"""
+
+import hashlib
+import http.server
+import itertools
+import threading
+import time
+from urllib.parse import parse_qs, urlsplit, unquote
+
+
+class ObjectStore:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.objects = {}  # (bucket, key) -> {"size", "metadata", "etag"}
+        self.arrivals = {}  # (bucket, key) -> time.time() of last completion
+        self.uploads = {}  # upload id -> {part number: size}
+        self.requests = 0
+        self.bytes_received = 0
+        self.upload_ids = itertools.count(1)
+
+    def completed(self, bucket, key, size, metadata):
+        etag = '"' + hashlib.md5(f"{key}{size}".encode()).hexdigest() + '"'
+        with self.lock:
+            self.objects[(bucket, key)] = {
+                "size": size,
+                "metadata": metadata,
+                "etag": etag,
+            }
+            self.arrivals[(bucket, key)] = time.time()
+        return etag
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, like the real thing
+
+    def log_message(self, format, *args):
+        pass
+
+    @property
+    def store(self):
+        return self.server.store
+
+    def _target(self):
+        parts = urlsplit(self.path)
+        bucket, _, key = parts.path.lstrip("/").partition("/")
+        query = parse_qs(parts.query, keep_blank_values=True)
+        return bucket, unquote(key), query
+
+    def _read_body(self):
+        """Read and count the request body; returns its decoded length."""
+
+        if self.headers.get("Transfer-Encoding", "").lower() == "chunked":
+            raw = bytearray()
+            while True:
+                size = int(self.rfile.readline().split(b";")[0], 16)
+                if size == 0:
+                    while self.rfile.readline() not in (b"\r\n", b"\n", b""):
+                        pass
+                    break
+                raw += self.rfile.read(size)
+                self.rfile.readline()
+        else:
+            raw = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+
+        with self.store.lock:
+            self.store.requests += 1
+            self.store.bytes_received += len(raw)
+
+        if "aws-chunked" in self.headers.get("Content-Encoding", ""):
+            return self._aws_chunked_length(raw)
+        return len(raw)
+
+    @staticmethod
+    def _aws_chunked_length(raw):
+        # <hex size>[;chunk-signature=...]\r\n<data>\r\n ... 0\r\n<trailers>
+        length = 0
+        offset = 0
+        while True:
+            end = raw.index(b"\r\n", offset)
+            size = int(raw[offset:end].split(b";")[0], 16)
+            if size == 0:
+                return length
+            length += size
+            offset = end + 2 + size + 2
+
+    def _metadata(self):
+        return {
+            name[len("x-amz-meta-") :]: value
+            for name, value in self.headers.items()
+            if name.lower().startswith("x-amz-meta-")
+        }
+
+    def _reply(self, status, body=b"", headers=None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if body and self.command != "HEAD":
+            self.wfile.write(body)
+
+    def do_PUT(self):
+        bucket, key, query = self._target()
+        size = self._read_body()
+
+        if "uploadId" in query:  # UploadPart
+            upload_id = query["uploadId"][0]
+            part_number = int(query["partNumber"][0])
+            with self.store.lock:
+                self.store.uploads[upload_id]["parts"][part_number] = size
+            etag = (
+                '"'
+                + hashlib.md5(f"{upload_id}{part_number}".encode()).hexdigest()
+                + '"'
+            )
+            self._reply(200, headers={"ETag": etag})
+            return
+
+        etag = self.store.completed(bucket, key, size, self._metadata())
+        self._reply(200, headers={"ETag": etag})
+
+    def do_HEAD(self):
+        bucket, key, _ = self._target()
+        with self.store.lock:
+            found = self.store.objects.get((bucket, key))
+        if not found:
+            self._reply(404)
+            return
+        headers = {f"x-amz-meta-{k}": v for k, v in found["metadata"].items()}
+        headers["ETag"] = found["etag"]
+        self.send_response(200)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(found["size"]))
+        self.end_headers()
+
+    def do_POST(self):
+        bucket, key, query = self._target()
+        self._read_body()
+
+        if "uploads" in query:  # CreateMultipartUpload
+            upload_id = str(next(self.store.upload_ids))
+            with self.store.lock:
+                self.store.uploads[upload_id] = {
+                    "parts": {},
+                    "metadata": self._metadata(),
+                }
+            body = (
+                "<InitiateMultipartUploadResult>"
+                f"<Bucket>{bucket}</Bucket><Key>{key}</Key>"
+                f"<UploadId>{upload_id}</UploadId>"
+                "</InitiateMultipartUploadResult>"
+            )
+            self._reply(200, body.encode())
+            return
+
+        if "uploadId" in query:  # CompleteMultipartUpload
+            with self.store.lock:
+                upload = self.store.uploads.pop(query["uploadId"][0])
+            size = sum(upload["parts"].values())
+            etag = self.store.completed(bucket, key, size, upload["metadata"])
+            body = (
+                "<CompleteMultipartUploadResult>"
+                f"<Bucket>{bucket}</Bucket><Key>{key}</Key><ETag>{etag}</ETag>"
+                "</CompleteMultipartUploadResult>"
+            )
+            self._reply(200, body.encode())
+            return
+
+        self._reply(400)
+
+    def do_DELETE(self):
+        _, _, query = self._target()
+        if "uploadId" in query:  # AbortMultipartUpload
+            with self.store.lock:
+                self.store.uploads.pop(query["uploadId"][0], None)
+        self._reply(204)
+
+
+def serve(port=0, address="127.0.0.1"):
+    """Start the stand-in on a background thread; returns the server.
+
+    The server's store attribute holds everything it has received.
+    """
+
+    server = http.server.ThreadingHTTPServer((address, port), Handler)
+    server.daemon_threads = True
+    server.store = ObjectStore()
+    threading.Thread(target=server.serve_forever, name="s3", daemon=True).start()
+    return server
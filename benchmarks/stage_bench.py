@@ -0,0 +1,95 @@
+"""Per-stage timings for the uploader pipeline, in process and without S3.
+
+Writes a tree of small files and times each stage over all of them: the
+filter, the key mapper, journal writes, content hashing (--dedup) and a
+whole Pipeline.process() with an uploader that does nothing. Useful for
+seeing which stage a change actually moved.
+
+    python benchmarks/stage_bench.py --files 20000 --size-kb 4
+"""
+
+import argparse
+import json
+import os
+import os.path
+import sys
+import tempfile
+import time
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+
+from uploader.dedup import file_digest  # noqa: E402
+from uploader.filters import SuffixFilter  # noqa: E402
+from uploader.journal import UploadJournal  # noqa: E402
+from uploader.keys import KeyMapper  # noqa: E402
+from uploader.pipeline import Pipeline  # noqa: E402
+
+
+class NullUploader:
+    def upload(self, absolute_path, key, stat):
+        return {"ETag": '"null"'}
+
+
+def timed(name, paths, stage):
+    started = time.perf_counter()
+    for path in paths:
+        stage(path)
+    elapsed = time.perf_counter() - started
+    return {
+        "stage": name,
+        "seconds": round(elapsed, 4),
+        "per_file_us": round(elapsed / max(len(paths), 1) * 1e6, 2),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--files", type=int, default=10000)
+    parser.add_argument("--size-kb", dest="size_kb", type=int, default=4)
+    parser.add_argument("--per-directory", dest="per_directory", type=int, default=100)
+    parser.add_argument("--suffix", default=".dat")
+    parser.add_argument("--json", action="store_true", default=False)
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as scratch:
+        root = os.path.join(scratch, "share")
+        data = os.urandom(args.size_kb * 1024)
+        paths = []
+        for n in range(args.files):
+            directory = os.path.join(root, f"d{n // args.per_directory}")
+            if n % args.per_directory == 0:
+                os.makedirs(directory)
+            path = os.path.join(directory, f"f{n}.dat")
+            with open(path, "wb") as fp:
+                fp.write(data)
+            paths.append(path)
+
+        file_filter = SuffixFilter(args.suffix)
+        key_mapper = KeyMapper(root, "prefix")
+        journal = UploadJournal(os.path.join(scratch, "journal.db"))
+        pipeline = Pipeline(
+            NullUploader(), key_mapper, file_filter=file_filter, journal=journal
+        )
+
+        results = [
+            timed("filter", paths, lambda p: file_filter(os.path.basename(p))),
+            timed("key mapper", paths, key_mapper),
+            timed("journal", paths, journal.pending),
+            timed("hash", paths, file_digest),
+            timed("process", paths, pipeline.process),
+        ]
+
+    if args.json:
+        print(json.dumps(results))
+    else:
+        for result in results:
+            print(
+                f"{result['stage']:>12}: {result['seconds']:>9.4f}s"
+                f" {result['per_file_us']:>10.2f}us/file"
+            )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
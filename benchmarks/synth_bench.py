@@ -0,0 +1,153 @@
+"""Import and synth timings for SftpStack, per context variant.
+
+Each run is a fresh interpreter, as in CI, that imports aws_cdk and
+sftp.sftp_stack and then synthesizes the stack into a temporary directory.
+The context is what the cdk CLI would pass, cdk.json's context plus
+cdk.context.json, with each variant's overrides on top.
+
+    python benchmarks/synth_bench.py
+    python benchmarks/synth_bench.py --repeat 5 --variant big='{"CidrRanges": ["10.0.0.0/8", "172.16.0.0/12"]}'
+
+Built-in variants:
+
+    attributes     AvailabilityZones in context: Vpc.from_vpc_attributes
+    cached-lookup  AZs read from the vpc-provider entry in cdk.context.json
+    lookup         no cached entry for the account: Vpc.from_lookup
+"""
+
+import argparse
+import json
+import os
+import os.path
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# the account and region the cached lookups in cdk.context.json belong to
+CACHED_ACCOUNT = "347249518786"
+REGION = "us-east-1"
+
+VARIANTS = {
+    "attributes": (
+        CACHED_ACCOUNT,
+        {"AvailabilityZones": ["us-east-1a", "us-east-1c"], "OfflineSynth": True},
+    ),
+    "cached-lookup": (CACHED_ACCOUNT, {"OfflineSynth": True}),
+    "lookup": ("111111111111", {}),
+}
+
+
+def load_context():
+    with open(os.path.join(REPO, "cdk.json")) as fp:
+        context = json.load(fp).get("context", {})
+    try:
+        with open(os.path.join(REPO, "cdk.context.json")) as fp:
+            context.update(json.load(fp))
+    except FileNotFoundError:
+        pass
+    context["Users"] = {}  # their key files live in ~/.ssh, not in the repo
+    return context
+
+
+def child(account, context):
+    """Runs in the fresh interpreter; prints its timings as JSON."""
+
+    started = time.perf_counter()
+    from aws_cdk import App, Environment, LegacyStackSynthesizer
+
+    sys.path.insert(0, REPO)
+    from sftp.sftp_stack import SftpStack
+
+    imported = time.perf_counter()
+    with tempfile.TemporaryDirectory() as outdir:
+        app = App(context=context, outdir=outdir)
+        SftpStack(
+            app,
+            "SftpStack",
+            env=Environment(account=account, region=REGION),
+            synthesizer=LegacyStackSynthesizer(),
+        )
+        app.synth()
+    synthesized = time.perf_counter()
+
+    print(
+        json.dumps(
+            {
+                "import_s": imported - started,
+                "synth_s": synthesized - imported,
+            }
+        )
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument(
+        "--variant", action="append", default=[]
+    )  # NAME=JSON context overrides, on the cached account
+    parser.add_argument("--only", nargs="+", default=None)
+    parser.add_argument("--json", action="store_true", default=False)
+    parser.add_argument("--child", default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        account, context = json.loads(args.child)
+        child(account, context)
+        return 0
+
+    variants = dict(VARIANTS)
+    for spec in args.variant:
+        name, _, overrides = spec.partition("=")
+        variants[name] = (CACHED_ACCOUNT, json.loads(overrides or "{}"))
+    if args.only:
+        variants = {name: variants[name] for name in args.only}
+
+    base = load_context()
+    results = []
+    for name, (account, overrides) in variants.items():
+        context = dict(base, **overrides)
+        runs = []
+        for _ in range(args.repeat):
+            started = time.perf_counter()
+            output = subprocess.run(
+                [sys.executable, __file__, "--child", json.dumps([account, context])],
+                capture_output=True,
+                text=True,
+                cwd=REPO,
+            )
+            wall = time.perf_counter() - started
+            if output.returncode:
+                sys.exit(f"{name}: synth failed\n{output.stdout}{output.stderr}")
+            timings = json.loads(output.stdout.strip().splitlines()[-1])
+            timings["wall_s"] = wall
+            runs.append(timings)
+
+        results.append(
+            {
+                "variant": name,
+                **{
+                    measure: round(statistics.median(run[measure] for run in runs), 3)
+                    for measure in ("import_s", "synth_s", "wall_s")
+                },
+            }
+        )
+
+    if args.json:
+        print(json.dumps(results))
+    else:
+        print(f"{'variant':>16} {'import s':>9} {'synth s':>9} {'wall s':>9}")
+        for result in results:
+            print(
+                f"{result['variant']:>16} {result['import_s']:>9.3f}"
+                f" {result['synth_s']:>9.3f} {result['wall_s']:>9.3f}"
+            )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,245 @@
+"""Throughput and latency benchmark for the EFS -> S3 uploader scripts.
+
+Starts a local S3 stand-in and one of the uploader scripts watching a
+temporary directory, writes a synthetic workload into that directory and
+waits until every file has arrived. It then reports files/sec, MB/sec,
+p50/p99 latency from a file being closed to its upload completing, and the
+uploader's peak resident memory.
+
+    python benchmarks/uploader_bench.py --workload tiny --files 5000 -- --workers 16
+    python benchmarks/uploader_bench.py --workload huge -- --part-size 32
+
+Anything after -- is passed to the uploader unchanged, so the same
+workload can be replayed against different --workers, --engine, ...
+settings. Needs boto3 and inotify, like the uploaders themselves.
+"""
+
+import argparse
+import json
+import os
+import os.path
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import s3_standin
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BUCKET = "bench"
+KB = 1024
+MB = 1024 * 1024
+
+# settings each workload uses unless overridden on the command line
+WORKLOADS = {
+    "tiny": {"files": 2000, "size_kb": 4},  # many small files
+    "huge": {"files": 4, "size_kb": 256 * 1024},  # a few multi-part files
+    "deep": {"files": 2000, "size_kb": 16, "depth": 8},  # nested directories
+    "rewrite": {"files": 200, "size_kb": 64, "rewrites": 10},  # rewrite storm
+}
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def peak_rss_kb(pid):
+    """VmHWM from /proc, the high-water mark of the process' resident set."""
+    try:
+        with open(f"/proc/{pid}/status") as fp:
+            for line in fp:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+
+def write_file(path, size, chunk):
+    with open(path, "wb") as fp:
+        remaining = size
+        while remaining > 0:
+            n = min(remaining, len(chunk))
+            fp.write(chunk[:n])
+            remaining -= n
+    return time.time()  # closed, IN_CLOSE_WRITE has been raised
+
+
+def generate(root, workload, files, size_kb, depth, rewrites, writers):
+    """Write the workload into root; returns {relative path: last close time}."""
+
+    size = size_kb * KB
+    chunk = os.urandom(min(size, 4 * MB)) or b"\0"
+    closed = {}
+    lock = threading.Lock()
+
+    def relative_path(n):
+        if workload == "deep":
+            parts = [f"d{(n >> level) % 4}" for level in range(depth)]
+            return os.path.join(*parts, f"f{n}.dat")
+        return f"f{n}.dat"
+
+    def write(n):
+        relative = relative_path(n)
+        path = os.path.join(root, relative)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        for _ in range(rewrites if workload == "rewrite" else 1):
+            finished = write_file(path, size, chunk)
+        with lock:
+            closed[relative] = finished
+
+    with ThreadPoolExecutor(max_workers=writers) as executor:
+        list(executor.map(write, range(files)))
+    return closed
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    uploader_args = []
+    if "--" in argv:
+        index = argv.index("--")
+        argv, uploader_args = argv[:index], argv[index + 1 :]
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workload", choices=sorted(WORKLOADS), default="tiny")
+    parser.add_argument(
+        "--script",
+        default=os.path.join(REPO, "historical", "send_dir_to_s3.py"),
+    )
+    parser.add_argument("--files", type=int)
+    parser.add_argument("--size-kb", dest="size_kb", type=int)
+    parser.add_argument("--depth", type=int)
+    parser.add_argument("--rewrites", type=int)
+    parser.add_argument("--writers", type=int, default=4)
+    parser.add_argument("--startup-seconds", dest="startup", type=float, default=2)
+    parser.add_argument("--timeout", type=float, default=600)
+    parser.add_argument("--json", action="store_true", default=False)
+    args = parser.parse_args(argv)
+
+    settings = dict(WORKLOADS[args.workload])
+    for name in ("files", "size_kb", "depth", "rewrites"):
+        if getattr(args, name) is not None:
+            settings[name] = getattr(args, name)
+
+    server = s3_standin.serve()
+    store = server.store
+    endpoint = f"http://127.0.0.1:{server.server_address[1]}"
+
+    with tempfile.TemporaryDirectory() as scratch:
+        root = os.path.join(scratch, "share")
+        os.mkdir(root)
+
+        # path style addressing for a bare IP endpoint, and no streaming
+        # checksums, so the stand-in can stay simple
+        config_file = os.path.join(scratch, "aws-config")
+        with open(config_file, "w") as fp:
+            fp.write(
+                "[default]\n"
+                "region = us-east-1\n"
+                "request_checksum_calculation = when_required\n"
+                "response_checksum_validation = when_required\n"
+                "s3 =\n"
+                "    addressing_style = path\n"
+            )
+
+        env = dict(
+            os.environ,
+            AWS_CONFIG_FILE=config_file,
+            AWS_SHARED_CREDENTIALS_FILE=os.devnull,
+            AWS_ACCESS_KEY_ID="bench",
+            AWS_SECRET_ACCESS_KEY="bench",
+            AWS_ENDPOINT_URL_S3=endpoint,
+        )
+        command = [
+            sys.executable,
+            args.script,
+            "--directory",
+            root,
+            "--s3bucket",
+            BUCKET,
+        ] + uploader_args
+        uploader = subprocess.Popen(
+            command,
+            env=env,
+            cwd=os.path.dirname(args.script),
+            stdout=subprocess.DEVNULL,
+        )
+
+        try:
+            time.sleep(args.startup)  # let it set up its watches
+            started = time.time()
+            closed = generate(
+                root,
+                args.workload,
+                settings["files"],
+                settings["size_kb"],
+                settings.get("depth", 1),
+                settings.get("rewrites", 1),
+                args.writers,
+            )
+
+            # done when every file has arrived after its last close
+            deadline = time.monotonic() + args.timeout
+            while True:
+                with store.lock:
+                    arrivals = {key: t for (_, key), t in store.arrivals.items()}
+                waiting = [
+                    relative
+                    for relative, close in closed.items()
+                    if arrivals.get(relative, 0) < close
+                ]
+                if not waiting or time.monotonic() > deadline:
+                    break
+                if uploader.poll() is not None:
+                    sys.exit(f"uploader exited with status {uploader.returncode}")
+                time.sleep(0.05)
+
+            peak_kb = peak_rss_kb(uploader.pid)
+        finally:
+            uploader.terminate()
+            uploader.wait()
+            server.shutdown()
+
+    latencies = [
+        arrivals[relative] - close
+        for relative, close in closed.items()
+        if relative in arrivals and arrivals[relative] >= close
+    ]
+    finished = max(arrivals.values(), default=started)
+    elapsed = max(finished - started, 1e-9)
+    delivered = len(closed) - len(waiting)
+
+    report = {
+        "workload": args.workload,
+        "settings": settings,
+        "uploader_args": uploader_args,
+        "files": len(closed),
+        "delivered": delivered,
+        "timed_out": len(waiting),
+        "elapsed_s": round(elapsed, 3),
+        "files_per_s": round(delivered / elapsed, 1),
+        "mb_per_s": round(store.bytes_received / MB / elapsed, 2),
+        "requests": store.requests,
+        "latency_p50_s": round(percentile(latencies, 0.50), 4),
+        "latency_p99_s": round(percentile(latencies, 0.99), 4),
+        "latency_mean_s": round(statistics.fmean(latencies), 4) if latencies else 0,
+        "peak_rss_mb": round(peak_kb / 1024, 1),
+    }
+
+    if args.json:
+        print(json.dumps(report))
+    else:
+        for name, value in report.items():
+            print(f"{name:>16}: {value}")
+
+    return 0 if not waiting else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
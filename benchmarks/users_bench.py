@@ -0,0 +1,98 @@
+"""Loading and synthesizing a large user manifest.
+
+Writes a manifest of --users users sharing --key-files key files, times
+load_users() and shard() on it in process, and with --synth runs
+synth_bench.py on the manifest (which needs aws_cdk).
+
+    python benchmarks/users_bench.py --users 10000 --format csv --synth
+"""
+
+import argparse
+import json
+import os.path
+import sys
+import tempfile
+import time
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+
+from benchmarks import synth_bench  # noqa: E402
+from sftp.users import load_users, shard  # noqa: E402
+
+
+def write_manifest(directory, users, key_files, format):
+    keys = []
+    for n in range(key_files):
+        path = os.path.join(directory, f"key{n}.pub")
+        with open(path, "w") as fp:
+            fp.write(f"ssh-ed25519 AAAAC3NzaC1lZDI1NTE5AAAAI{n:032} key{n}\n")
+        keys.append(path)
+
+    path = os.path.join(directory, "users." + format)
+    with open(path, "w") as fp:
+        if format == "csv":
+            fp.write("UserName,SshKeyFile,UserId,GroupId\n")
+        for n in range(users):
+            row = {
+                "UserName": f"user{n:05}",
+                "SshKeyFile": keys[n % key_files],
+                "UserId": 10000 + n,
+                "GroupId": 1000 + n % 50,
+            }
+            if format == "csv":
+                fp.write(",".join(str(value) for value in row.values()) + "\n")
+            else:
+                fp.write(json.dumps(row) + "\n")
+    return path
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--key-files", type=int, default=100)
+    parser.add_argument("--format", choices=["csv", "jsonl"], default="csv")
+    parser.add_argument("--synth", action="store_true", default=False)
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as directory:
+        manifest = write_manifest(directory, args.users, args.key_files, args.format)
+
+        started = time.perf_counter()
+        users = load_users(manifest=manifest)
+        loaded = time.perf_counter()
+        groups = shard(users)
+        sharded = time.perf_counter()
+
+        print(
+            json.dumps(
+                {
+                    "users": len(users),
+                    "load_s": round(loaded - started, 3),
+                    "shard_s": round(sharded - loaded, 3),
+                    "shards": len(groups),
+                    "largest_shard": max(len(group) for group in groups),
+                }
+            )
+        )
+
+        if args.synth:
+            overrides = {
+                "AvailabilityZones": ["us-east-1a", "us-east-1c"],
+                "UserManifest": manifest,
+            }
+            return synth_bench.main(
+                [
+                    "--repeat",
+                    "1",
+                    "--only",
+                    "users",
+                    "--variant",
+                    "users=" + json.dumps(overrides),
+                ]
+            )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
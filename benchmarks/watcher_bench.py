@@ -0,0 +1,120 @@
+"""Events per second per core for the inotify watcher stages.
+
+A separate writer process rewrites --files files --rounds times over
+(a rewrite storm) while the watcher under test consumes the events on
+this process's main thread. The watcher's CPU time is that thread's, so
+events/sec/core is the closed files it reported over its CPU seconds.
+
+    python benchmarks/watcher_bench.py --files 100 --rounds 500
+    python benchmarks/watcher_bench.py --watcher native --json
+
+The inotify watcher needs the inotify package and is skipped without it.
+"""
+
+import argparse
+import json
+import os
+import os.path
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+
+from uploader.watcher import CLOSED, InotifyTreeWatcher, NativeTreeWatcher  # noqa: E402
+
+WATCHERS = {"inotify": InotifyTreeWatcher, "native": NativeTreeWatcher}
+SENTINEL = "_done"
+
+WRITER = """
+import os, sys, time
+directory, files, rounds, size = sys.argv[1], *map(int, sys.argv[2:])
+data = b"x" * size
+for _ in range(rounds):
+    for n in range(files):
+        with open(os.path.join(directory, f"f{n}.dat"), "wb") as fp:
+            fp.write(data)
+# repeated in case the first one was lost to a queue overflow
+while True:
+    open(os.path.join(directory, "_done"), "wb").close()
+    time.sleep(0.2)
+"""
+
+
+def measure(name, files, rounds, size):
+    with tempfile.TemporaryDirectory() as directory:
+        os.makedirs(os.path.join(directory, "alice"))
+        watcher = WATCHERS[name](directory)
+        writer = subprocess.Popen(
+            [
+                sys.executable,
+                "-c",
+                WRITER,
+                os.path.join(directory, "alice"),
+                str(files),
+                str(rounds),
+                str(size),
+            ]
+        )
+
+        closed = 0
+        started, cpu_started = time.perf_counter(), time.thread_time()
+        try:
+            for kind, path, _ in watcher.events():
+                if kind != CLOSED:
+                    continue
+                if os.path.basename(path) == SENTINEL:
+                    break
+                closed += 1
+        finally:
+            cpu = time.thread_time() - cpu_started
+            wall = time.perf_counter() - started
+            writer.kill()
+            writer.wait()
+            if hasattr(watcher, "close"):
+                watcher.close()
+
+    return {
+        "watcher": name,
+        "events": closed,
+        "lost": files * rounds - closed,
+        "wall_s": round(wall, 3),
+        "cpu_s": round(cpu, 3),
+        "events_per_core_s": round(closed / cpu) if cpu else None,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--watcher", choices=sorted(WATCHERS), nargs="+")
+    parser.add_argument("--files", type=int, default=100)
+    parser.add_argument("--rounds", type=int, default=500)
+    parser.add_argument("--size", type=int, default=64)  # bytes per write
+    parser.add_argument("--json", action="store_true", default=False)
+    args = parser.parse_args(argv)
+
+    results = []
+    for name in args.watcher or sorted(WATCHERS):
+        try:
+            results.append(measure(name, args.files, args.rounds, args.size))
+        except ImportError as e:
+            print(f"skipping {name}: {e}", file=sys.stderr)
+
+    if args.json:
+        print(json.dumps(results))
+    else:
+        print(
+            f"{'watcher':>8} {'events':>8} {'lost':>6} {'cpu s':>7} {'ev/core/s':>10}"
+        )
+        for result in results:
+            print(
+                f"{result['watcher']:>8} {result['events']:>8} {result['lost']:>6}"
+                f" {result['cpu_s']:>7.3f} {result['events_per_core_s']:>10}"
+            )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
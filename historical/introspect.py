@@ -1,40 +1,174 @@
-import urllib3, ssl
-from urllib.parse import urlencode
+"""Dump the EC2 instance metadata tree.
+
+    python introspect.py                          # the whole tree, indented
+    python introspect.py --json --paths placement/ iam/ instance-id
+    python introspect.py --json --cache /tmp/imds.json --cache-ttl 300
+
+Directories (paths ending in /) are listed and their children fetched
+concurrently by a pool of --workers threads sharing one urllib3 connection
+pool. An IMDSv2 session token is fetched once and reused for every request
+(falling back to IMDSv1 if the endpoint does not issue tokens). With
+--cache the resulting dict is kept on disk and reused for --cache-ttl
+seconds, so repeated calls during host bootstrap cost nothing.
+"""
+
+import argparse
+import json
+import os
+import os.path
+import ssl
 import sys
-import re
+import tempfile
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 
+import urllib3
 
-def retrieve_data(http, url, depth):
-    response = http.request("GET", url)
-    text = response.data.decode("utf-8")
+METADATA_URL = "http://169.254.169.254"
+TOKEN_TTL = 21600  # seconds, the most IMDSv2 allows
+TOKEN_HEADER = "X-aws-ec2-metadata-token"
 
-    # if (re.search('/$', url)):
-    if url[-1] == "/":
-        # trailing slash means that the return value is an array
-        for n in range(1, depth):
-            sys.stdout.write(" ")
-        print(url)
 
-        paths = re.split("\n", text)
-        hash = {}
+class MetadataCrawler:
+    def __init__(self, http, base_url=METADATA_URL, workers=16, timeout=2.0):
+        self.http = http
+        self.base_url = base_url.rstrip("/")
+        self.workers = workers
+        self.timeout = timeout
+        self.token = self.fetch_token()
 
-        for step in paths:
-            next_url = url + step
-            # https://docs.python.org/3/library/re.html
-            result = re.search("(.*)\/$", step)  # if present, whack the trailing slash
-            key = result.group(1) if result else step
-            hash[key] = retrieve_data(http, next_url, depth + 1)
+    def fetch_token(self):
+        """An IMDSv2 session token, or None if only IMDSv1 is available."""
+        try:
+            response = self.http.request(
+                "PUT",
+                f"{self.base_url}/latest/api/token",
+                headers={"X-aws-ec2-metadata-token-ttl-seconds": str(TOKEN_TTL)},
+                timeout=self.timeout,
+            )
+        except urllib3.exceptions.HTTPError:
+            return None
+        return response.data.decode("utf-8") if response.status == 200 else None
 
-        return hash
+    def get(self, path):
+        """The text at path, or None if IMDS does not return it."""
+        url = f"{self.base_url}/latest/meta-data/{path}"
+        headers = {TOKEN_HEADER: self.token} if self.token else {}
+        response = self.http.request("GET", url, headers=headers, timeout=self.timeout)
+        if response.status == 401 and self.token:
+            # the token expired; every worker shares the replacement
+            self.token = self.fetch_token()
+            headers = {TOKEN_HEADER: self.token} if self.token else {}
+            response = self.http.request(
+                "GET", url, headers=headers, timeout=self.timeout
+            )
+        if response.status != 200:
+            return None
+        return response.data.decode("utf-8")
 
-    else:
-        for n in range(1, depth):
-            sys.stdout.write(" ")
-        print(url + " -> " + text)
-        return text
+    def crawl(self, paths=("",)):
+        """The metadata under each of paths, as nested dicts.
+
+        A path ending in / (or "", the root) is a directory; anything else
+        is a single value. Keys are path components without the slash.
+        Entries that cannot be fetched are left out; only the paths asked
+        for have to exist.
+        """
+
+        tree = {}
+
+        def store(path, value):
+            node = tree
+            parts = path.rstrip("/").split("/")
+            for part in parts[:-1]:
+                node = node.setdefault(part, {})
+            if parts[-1]:
+                node[parts[-1]] = value
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            pending = {executor.submit(self.get, path): path for path in paths}
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    path = pending.pop(future)
+                    text = future.result()
+                    if text is None:
+                        if path in paths:
+                            raise urllib3.exceptions.HTTPError(
+                                f"GET {self.base_url}/latest/meta-data/{path} failed"
+                            )
+                        continue  # e.g. listed, but not readable by this role
+                    if path and not path.endswith("/"):
+                        store(path, text)
+                        continue
+
+                    store(path, {})
+                    for step in text.split("\n"):
+                        if step:
+                            # public-keys/ lists "0=name"; its data is under 0/
+                            index, equals, _ = step.partition("=")
+                            if equals:
+                                step = index + "/"
+                            child = path + step
+                            pending[executor.submit(self.get, child)] = child
+
+        return tree
 
 
-urllib3.disable_warnings()
-http = urllib3.PoolManager(cert_reqs=ssl.CERT_NONE)
+def read_cache(path, ttl, paths):
+    try:
+        with open(path) as fp:
+            cached = json.load(fp)
+    except (OSError, ValueError):
+        return None
+    if cached.get("paths") != list(paths) or time.time() - cached["fetched"] > ttl:
+        return None
+    return cached["data"]
+
+
+def write_cache(path, paths, data):
+    # write and rename, so a concurrent reader never sees half a file
+    directory = os.path.dirname(os.path.abspath(path))
+    with tempfile.NamedTemporaryFile("w", dir=directory, delete=False) as fp:
+        json.dump({"fetched": time.time(), "paths": list(paths), "data": data}, fp)
+    os.replace(fp.name, path)
+
+
+def print_tree(tree, prefix="", depth=0):
+    for key, value in sorted(tree.items()):
+        if isinstance(value, dict):
+            print(" " * depth + prefix + key + "/")
+            print_tree(value, prefix + key + "/", depth + 1)
+        else:
+            print(" " * depth + prefix + key + " -> " + value)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", dest="url", default=METADATA_URL)
+    parser.add_argument(
+        "--paths", dest="paths", nargs="+", default=[""]
+    )  # e.g. placement/ iam/ instance-id
+    parser.add_argument("--json", action="store_true", default=False)
+    parser.add_argument("--workers", dest="workers", type=int, default=16)
+    parser.add_argument("--cache", dest="cache", required=False, default="")
+    parser.add_argument("--cache-ttl", dest="cache_ttl", type=int, default=300)
+    args = parser.parse_args(argv)
+
+    data = read_cache(args.cache, args.cache_ttl, args.paths) if args.cache else None
+    if data is None:
+        urllib3.disable_warnings()
+        http = urllib3.PoolManager(cert_reqs=ssl.CERT_NONE, maxsize=args.workers)
+        data = MetadataCrawler(http, args.url, workers=args.workers).crawl(args.paths)
+        if args.cache:
+            write_cache(args.cache, args.paths, data)
+
+    if args.json:
+        print(json.dumps(data, indent=2, sort_keys=True))
+    else:
+        print_tree(data)
+    return 0
+
 
-response = retrieve_data(http, "http://169.254.169.254/latest/meta-data/", 0)
+if __name__ == "__main__":
+    sys.exit(main())
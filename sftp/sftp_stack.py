@@ -1,26 +1,59 @@
+import os.path
 import sys
-import os
-import boto3
-import json
-from os.path import join
 
 from aws_cdk import (
     Stack,
+    NestedStack,
     RemovalPolicy,
     aws_iam as iam,
     aws_ec2 as ec2,
     aws_transfer as transfer,
-    aws_logs as logs,
-    # aws_s3 as s3,
     aws_efs as efs,
     Aspects,
     IAspect,
     CfnResource,
     CfnOutput,
+    Duration,
+    Size,
+    Token,
 )
 from constructs import Construct, IConstruct
 import jsii
 
+from sftp.users import DEFAULT_USERS_PER_STACK, UserError, load_users, shard
+
+
+def user_session_policy(bucket_arn):
+    """Session policy keeping a Transfer user to their own prefix of the bucket."""
+
+    return {
+        "Version": "2012-10-17",
+        "Statement": [
+            {
+                "Sid": "ListHome",
+                "Effect": "Allow",
+                "Action": "s3:ListBucket",
+                "Resource": bucket_arn,
+                "Condition": {
+                    "StringLike": {
+                        "s3:prefix": ["${transfer:UserName}", "${transfer:UserName}/*"]
+                    }
+                },
+            },
+            {
+                "Sid": "HomeObjects",
+                "Effect": "Allow",
+                "Action": [
+                    "s3:PutObject",
+                    "s3:GetObject",
+                    "s3:GetObjectVersion",
+                    "s3:DeleteObject",
+                ],
+                "Resource": bucket_arn + "/${transfer:UserName}/*",
+            },
+        ],
+    }
+
 
 @jsii.implements(IAspect)
 class IamNamingAspect:
@@ -156,8 +189,8 @@ class SftpStack(Stack):
         if not cidr_ranges:
             cidr_ranges = []
 
-        vpc = ec2.Vpc.from_lookup(self, "Vpc", vpc_id=vpc_id)
         subnet_ids = self.node.try_get_context("SubnetIds")
+        vpc = self.vpc_from_context(vpc_id, subnet_ids)
 
         sftp_security_group = ec2.SecurityGroup(self, "SftpSecurityGroup", vpc=vpc)
         for cidr in cidr_ranges:
@@ -178,6 +211,234 @@ class SftpStack(Stack):
             ],
         )
 
+        storage_domain = (self.node.try_get_context("StorageDomain") or "EFS").upper()
+        if storage_domain not in ("EFS", "S3"):
+            print("StorageDomain must be EFS or S3")
+            sys.exit(1)
+
+        fs = bucket = None
+        if storage_domain == "EFS":
+            fs = self.file_system(vpc, subnet_ids, cidr_ranges)
+            storage_policy = iam.PolicyStatement(
+                effect=iam.Effect.ALLOW,
+                actions=[
+                    "elasticfilesystem:Describe*",
+                    "elasticfilesystem:List*",
+                    "elasticfilesystem:ClientWrite",
+                    # "elasticfilesystem:ClientRootAccess",
+                    "elasticfilesystem:ClientMount",
+                ],
+                resources=[fs.file_system_arn],
+            )
+        else:
+            # users write straight to S3, so nothing has to copy files off EFS
+            bucket = self.storage_bucket()
+            storage_policy = iam.PolicyStatement(
+                effect=iam.Effect.ALLOW,
+                actions=["s3:ListBucket", "s3:GetBucketLocation"],
+                resources=[bucket.bucket_arn],
+            )
+
+        logging_role = iam.Role(
+            self,
+            "TransferLoggingRole",
+            assumed_by=iam.ServicePrincipal("transfer.amazonaws.com"),
+            inline_policies={"logs": logging_policy},
+        )
+
+        # https://docs.aws.amazon.com/transfer/latest/userguide/create-server-sftp.html
+        # https://docs.aws.amazon.com/transfer/latest/userguide/directory-services-users.html
+
+        server = transfer.CfnServer(
+            self,
+            "SftpServer",
+            pre_authentication_login_banner="your papers, please\n",
+            # post_authentication_login_banner="your papers appear to be in order",
+            endpoint_details=transfer.CfnServer.EndpointDetailsProperty(
+                vpc_id=vpc.vpc_id,
+                security_group_ids=[sftp_security_group.security_group_id],
+                subnet_ids=subnet_ids,
+            ),
+            domain=storage_domain,
+            identity_provider_type="SERVICE_MANAGED",  # AWS_DIRECTORY_SERVICE
+            endpoint_type="VPC",
+            protocols=["SFTP"],
+            logging_role=logging_role.role_arn,
+            # structured_log_destinations=[log_group.log_group_arn],
+        )
+
+        if self.context_flag("PostUploadWorkflow"):
+            if not fs:
+                print("PostUploadWorkflow is for StorageDomain EFS")
+                sys.exit(1)
+            self.post_upload_workflow(vpc, subnet_ids, fs, server)
+
+        if self.node.try_get_context("UploaderNodes"):
+            if not fs:
+                print("UploaderNodes is for StorageDomain EFS")
+                sys.exit(1)
+            self.uploader_fleet(vpc, subnet_ids, fs)
+
+        user_role = iam.Role(
+            self,
+            "TransferUserRole",
+            assumed_by=iam.ServicePrincipal("transfer.amazonaws.com"),
+            inline_policies={
+                "logs": logging_policy,
+                storage_domain.lower(): iam.PolicyDocument(
+                    assign_sids=True, statements=[storage_policy]
+                ),
+            },
+        )
+        if bucket:
+            # each user's session policy narrows this to their own prefix
+            user_role.add_to_policy(
+                iam.PolicyStatement(
+                    effect=iam.Effect.ALLOW,
+                    actions=[
+                        "s3:PutObject",
+                        "s3:GetObject",
+                        "s3:GetObjectVersion",
+                        "s3:DeleteObject",
+                    ],
+                    resources=[bucket.arn_for_objects("*")],
+                )
+            )
+
+        context_users = self.node.try_get_context("Users") or {}
+        try:
+            users = load_users(context_users, self.node.try_get_context("UserManifest"))
+        except UserError as e:
+            print(e)
+            sys.exit(1)
+
+        access_points = fs is not None and self.context_flag("EfsAccessPoints")
+        resources_per_user = 2 if access_points else 1  # CfnUser, AccessPoint
+
+        shards = self.node.try_get_context("UserShards")
+        per_stack = self.node.try_get_context("UsersPerStack") or (
+            DEFAULT_USERS_PER_STACK // resources_per_user
+        )
+
+        # a user never moves between stacks by itself: CloudFormation would
+        # create the new CfnUser before deleting the old one, and user names
+        # are unique per server, so sharding is only ever switched on by hand
+        if shards:
+            # the Users param stays in the main stack, manifest users are sharded
+            main = [user for user in users if user.name in context_users]
+            sharded = [user for user in users if user.name not in context_users]
+        else:
+            main, sharded = users, []
+        if len(main) > per_stack:
+            print(
+                f"{len(main)} users are more than fit in the main stack ({per_stack});"
+                " set UserShards to put the UserManifest users in nested stacks"
+                " (see Many users in README.md)"
+            )
+            sys.exit(1)
+
+        self.add_users(self, main, server, user_role, fs, bucket, access_points)
+        if sharded:
+            try:
+                groups = shard(sharded, shards, per_stack, resources_per_user)
+            except UserError as e:
+                print(e)
+                sys.exit(1)
+            for index, group in enumerate(groups):
+                self.add_users(
+                    NestedStack(self, f"Users{index}"),
+                    group,
+                    server,
+                    user_role,
+                    fs,
+                    bucket,
+                    access_points,
+                )
+
+        server_address = (
+            f"{server.attr_server_id}.server.transfer.{self.region}.amazonaws.com"
+        )
+        if self.context_flag("LoadBalancer", default=True):
+            # clients connect to the load balancer, which spreads them over
+            # the endpoint in every zone and stops using a zone that fails
+            nlb = self.load_balancer(vpc, subnet_ids, server)
+            CfnOutput(self, "SftpEndpointAddress", value=server_address)
+            server_address = nlb.load_balancer_dns_name
+
+        CfnOutput(
+            self,
+            "SftpServerAddress",
+            value=server_address,
+            export_name=f"{self.stack_name}-SftpServerAddress",
+        )
+
+        if fs:
+            CfnOutput(
+                self,
+                "FileSystemAddress",
+                value=f"{fs.file_system_id}.efs.{self.region}.amazonaws.com",
+            )
+        else:
+            CfnOutput(self, "StorageBucket", value=bucket.bucket_name)
+
+    def add_users(
+        self, scope, users, server, user_role, fs=None, bucket=None, access_points=False
+    ):
+        # looked up once, not once per user
+        role_arn = user_role.role_arn
+        server_id = server.attr_server_id
+        if fs:
+            file_system_id = fs.file_system_id
+        else:
+            bucket_name = bucket.bucket_name
+            session_policy = Stack.of(scope).to_json_string(
+                user_session_policy(bucket.bucket_arn)
+            )
+
+        for user in users:
+            # https://docs.aws.amazon.com/AWSCloudFormation/latest/UserGuide/aws-resource-transfer-user.html
+            if fs:
+                home = dict(
+                    home_directory=f"/{file_system_id}/{user.name}/",
+                    posix_profile={"uid": user.uid, "gid": user.gid},
+                )
+            else:
+                # the user sees their prefix as /, and cannot leave it
+                home = dict(
+                    home_directory_type="LOGICAL",
+                    home_directory_mappings=[
+                        transfer.CfnUser.HomeDirectoryMapEntryProperty(
+                            entry="/", target=f"/{bucket_name}/{user.name}"
+                        )
+                    ],
+                    policy=session_policy,
+                )
+            transfer.CfnUser(
+                scope,
+                f"CfnUser-{user.name}",
+                role=role_arn,
+                server_id=server_id,
+                user_name=user.name,
+                ssh_public_keys=list(user.ssh_keys),
+                **home,
+            )
+
+            if access_points:
+                # an entry point per home directory, so NFS clients working on
+                # one user's files get that user's identity and path
+                uid, gid = str(user.uid), str(user.gid)
+                efs.AccessPoint(
+                    scope,
+                    f"AccessPoint-{user.name}",
+                    file_system=fs,
+                    path=f"/{user.name}",
+                    create_acl=efs.Acl(owner_uid=uid, owner_gid=gid, permissions="750"),
+                    posix_user=efs.PosixUser(uid=uid, gid=gid),
+                )
+
+    def file_system(self, vpc, subnet_ids, cidr_ranges):
+        """The EFS file system users' home directories live in."""
+
         efs_security_group = ec2.SecurityGroup(self, "EfsAccess", vpc=vpc)
 
         # allow connections on the NFS port from inside the VPC
@@ -217,105 +478,575 @@ class SftpStack(Stack):
             lifecycle_policy=efs.LifecyclePolicy.AFTER_30_DAYS,
             encrypted=True,
             file_system_policy=file_system_policy,
+            **self.efs_performance(),
         )
+        return fs
 
-        logging_role = iam.Role(
+    def post_upload_workflow(self, vpc, subnet_ids, fs, server):
+        """Copy each finished upload to S3 from a Lambda, run by the server.
+
+        Replaces the watcher daemon: Transfer starts the workflow when a
+        file is closed, so copies run in parallel, one invocation per file.
+        The Lambda runs uploader.workflow with the file system mounted and
+        needs a route to S3 (an endpoint or NAT) from SubnetIds.
+        """
+
+        from aws_cdk import aws_lambda as lambda_, aws_s3 as s3
+
+        key = "WorkflowBucket"
+        bucket_name = self.node.try_get_context(key)
+        if not bucket_name:
+            print("missing context variable " + key)
+            sys.exit(1)
+        bucket = s3.Bucket.from_bucket_name(self, "WorkflowBucket", bucket_name)
+
+        # root on the file system, to read every user's files
+        access_point = efs.AccessPoint(
             self,
-            "TransferLoggingRole",
-            assumed_by=iam.ServicePrincipal("transfer.amazonaws.com"),
-            inline_policies={"logs": logging_policy},
+            "WorkflowAccessPoint",
+            file_system=fs,
+            path="/",
+            posix_user=efs.PosixUser(uid="0", gid="0"),
         )
 
-        # https://docs.aws.amazon.com/transfer/latest/userguide/create-server-sftp.html
-        # https://docs.aws.amazon.com/transfer/latest/userguide/directory-services-users.html
-
-        server = transfer.CfnServer(
+        # just the uploader package, which has the handler
+        repo = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        function = lambda_.Function(
             self,
-            "SftpServer",
-            pre_authentication_login_banner="your papers, please\n",
-            # post_authentication_login_banner="your papers appear to be in order",
-            endpoint_details=transfer.CfnServer.EndpointDetailsProperty(
-                vpc_id=vpc.vpc_id,
-                security_group_ids=[sftp_security_group.security_group_id],
-                subnet_ids=subnet_ids,
+            "PostUploadFunction",
+            runtime=lambda_.Runtime.PYTHON_3_12,
+            handler="uploader.workflow.handler",
+            code=lambda_.Code.from_asset(
+                repo, exclude=["*", "!uploader", "!uploader/*.py"]
             ),
-            domain="EFS",
-            identity_provider_type="SERVICE_MANAGED",  # AWS_DIRECTORY_SERVICE
-            endpoint_type="VPC",
-            protocols=["SFTP"],
-            logging_role=logging_role.role_arn,
-            # structured_log_destinations=[log_group.log_group_arn],
+            vpc=vpc,
+            vpc_subnets=ec2.SubnetSelection(
+                subnets=[
+                    ec2.Subnet.from_subnet_id(self, "workflow-" + subnet_id, subnet_id)
+                    for subnet_id in subnet_ids
+                ]
+            ),
+            filesystem=lambda_.FileSystem.from_efs_access_point(
+                access_point, "/mnt/efs"
+            ),
+            memory_size=1024,
+            timeout=Duration.minutes(15),
+            environment={
+                "BUCKET": bucket_name,
+                "PREFIX": self.node.try_get_context("WorkflowPrefix") or "",
+                "COMPRESS": ",".join(
+                    self.node.try_get_context("WorkflowCompress") or []
+                ),
+                "MOUNT_PATH": "/mnt/efs",
+            },
+        )
+        fs.connections.allow_default_port_from(function)
+        bucket.grant_put(function)
+        function.add_to_role_policy(
+            iam.PolicyStatement(
+                effect=iam.Effect.ALLOW,
+                actions=["transfer:SendWorkflowStepState"],
+                resources=[
+                    self.format_arn(
+                        service="transfer", resource="workflow", resource_name="*"
+                    )
+                ],
+            )
         )
 
-        user_role = iam.Role(
+        workflow = transfer.CfnWorkflow(
             self,
-            "TransferUserRole",
+            "PostUploadWorkflow",
+            description="copy uploaded files to S3",
+            steps=[
+                transfer.CfnWorkflow.WorkflowStepProperty(
+                    type="CUSTOM",
+                    # the step details are untyped in the template, so the
+                    # keys must be spelled the way CloudFormation expects
+                    custom_step_details={
+                        "Name": "CopyToS3",
+                        "Target": function.function_arn,
+                        "TimeoutSeconds": 900,
+                        "SourceFileLocation": "${original.file}",
+                    },
+                )
+            ],
+        )
+
+        execution_role = iam.Role(
+            self,
+            "WorkflowExecutionRole",
             assumed_by=iam.ServicePrincipal("transfer.amazonaws.com"),
-            inline_policies={
-                "logs": logging_policy,
-                "efs": iam.PolicyDocument(
-                    assign_sids=True,
-                    statements=[
+        )
+        function.grant_invoke(execution_role)
+
+        server.workflow_details = transfer.CfnServer.WorkflowDetailsProperty(
+            on_upload=[
+                transfer.CfnServer.WorkflowDetailProperty(
+                    execution_role=execution_role.role_arn,
+                    workflow_id=workflow.attr_workflow_id,
+                )
+            ]
+        )
+
+    def uploader_fleet(self, vpc, subnet_ids, fs):
+        """UploaderNodes Fargate tasks copying the file system to S3.
+
+        Each node is its own single-task service, so it knows its place in
+        the fleet: it is started with --node-index and --node-count and
+        uploads only the home directories the hash ring gives it. Changing
+        UploaderNodes redeploys every node with the new count; a user that
+        changes hands is new to its new node's scan index, so all of its
+        files are offered again, and --dedup skips the ones already in S3.
+
+        Each node keeps its --journal and --scan-index on a small file
+        system of their own, outside the watched tree, in a directory per
+        node, so a replaced task picks up where the last one stopped
+        instead of rescanning and re-offering every file. Only one task per
+        node runs at a time, which SQLite needs on NFS.
+        """
+
+        from aws_cdk import aws_ecs as ecs, aws_s3 as s3
+
+        nodes = int(self.node.try_get_context("UploaderNodes"))
+        workers = int(self.node.try_get_context("UploaderWorkers") or 16)
+
+        key = "UploaderBucket"
+        bucket_name = self.node.try_get_context(key)
+        if not bucket_name:
+            print("missing context variable " + key)
+            sys.exit(1)
+        bucket = s3.Bucket.from_bucket_name(self, "UploaderBucket", bucket_name)
+
+        access_point = efs.AccessPoint(
+            self,
+            "UploaderAccessPoint",
+            file_system=fs,
+            path="/",
+            posix_user=efs.PosixUser(uid="0", gid="0"),
+        )
+
+        repo = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        image = ecs.ContainerImage.from_asset(
+            repo,
+            file="uploader/Dockerfile",
+            exclude=["*", "!uploader", "!uploader/*.py", "!uploader/Dockerfile"],
+        )
+
+        cluster = ecs.Cluster(self, "UploaderCluster", vpc=vpc)
+        subnets = ec2.SubnetSelection(
+            subnets=[
+                ec2.Subnet.from_subnet_id(self, "uploader-" + subnet_id, subnet_id)
+                for subnet_id in subnet_ids
+            ]
+        )
+
+        # rebuilt from S3 (--dedup) if lost, so it goes with the stack
+        state = efs.FileSystem(
+            self,
+            "UploaderState",
+            vpc=vpc,
+            vpc_subnets=subnets,
+            removal_policy=RemovalPolicy.DESTROY,
+            encrypted=True,
+        )
+
+        for index in range(nodes):
+            state_access_point = efs.AccessPoint(
+                self,
+                f"UploaderState{index}",
+                file_system=state,
+                path=f"/node{index}",
+                create_acl=efs.Acl(owner_uid="0", owner_gid="0", permissions="700"),
+                posix_user=efs.PosixUser(uid="0", gid="0"),
+            )
+            task = ecs.FargateTaskDefinition(
+                self,
+                f"UploaderTask{index}",
+                cpu=int(self.node.try_get_context("UploaderCpu") or 1024),
+                memory_limit_mib=int(
+                    self.node.try_get_context("UploaderMemory") or 2048
+                ),
+                volumes=[
+                    ecs.Volume(
+                        name="efs",
+                        efs_volume_configuration=ecs.EfsVolumeConfiguration(
+                            file_system_id=fs.file_system_id,
+                            transit_encryption="ENABLED",
+                            authorization_config=ecs.AuthorizationConfig(
+                                access_point_id=access_point.access_point_id,
+                                iam="ENABLED",
+                            ),
+                        ),
+                    ),
+                    ecs.Volume(
+                        name="state",
+                        efs_volume_configuration=ecs.EfsVolumeConfiguration(
+                            file_system_id=state.file_system_id,
+                            transit_encryption="ENABLED",
+                            authorization_config=ecs.AuthorizationConfig(
+                                access_point_id=state_access_point.access_point_id,
+                                iam="ENABLED",
+                            ),
+                        ),
+                    ),
+                ],
+            )
+            container = task.add_container(
+                "uploader",
+                image=image,
+                command=[
+                    "--directory",
+                    "/mnt/efs",
+                    "--s3bucket",
+                    bucket_name,
+                    "--s3prefix",
+                    self.node.try_get_context("UploaderPrefix") or "",
+                    # Transfer writes through the EFS service, not this
+                    # mount, so inotify would never see them
+                    "--watch-mode",
+                    "scan",
+                    "--workers",
+                    str(workers),
+                    "--dedup",
+                    "--journal",
+                    "/var/lib/uploader/journal.db",
+                    "--scan-index",
+                    "/var/lib/uploader/scan-index.db",
+                    "--node-index",
+                    str(index),
+                    "--node-count",
+                    str(nodes),
+                ],
+                logging=ecs.LogDrivers.aws_logs(stream_prefix=f"node{index}"),
+            )
+            container.add_mount_points(
+                ecs.MountPoint(
+                    container_path="/mnt/efs", source_volume="efs", read_only=False
+                ),
+                ecs.MountPoint(
+                    container_path="/var/lib/uploader",
+                    source_volume="state",
+                    read_only=False,
+                ),
+            )
+            bucket.grant_read_write(task.task_role)
+            task.add_to_task_role_policy(
+                iam.PolicyStatement(
+                    effect=iam.Effect.ALLOW,
+                    actions=[
+                        "elasticfilesystem:ClientMount",
+                        "elasticfilesystem:ClientWrite",
+                        "elasticfilesystem:ClientRootAccess",
+                    ],
+                    resources=[fs.file_system_arn, state.file_system_arn],
+                )
+            )
+
+            service = ecs.FargateService(
+                self,
+                f"UploaderNode{index}",
+                cluster=cluster,
+                task_definition=task,
+                desired_count=1,
+                vpc_subnets=subnets,
+                # never two copies of a node while it is replaced
+                min_healthy_percent=0,
+                max_healthy_percent=100,
+            )
+            fs.connections.allow_default_port_from(service)
+            state.connections.allow_default_port_from(service)
+
+    def endpoint_ips(self, server, subnet_ids):
+        """Private IPs of the server's VPC endpoint, one per subnet.
+
+        CloudFormation does not return them, so custom resources look them
+        up: the server's endpoint, that endpoint's network interfaces, and
+        the interfaces' addresses. Their physical id names the server and
+        its subnets, so they run again if the server is replaced or moved
+        to other SubnetIds, which keeps its endpoint but not the interfaces.
+        """
+
+        from aws_cdk import custom_resources as cr
+
+        count = len(subnet_ids)
+        physical_id = cr.PhysicalResourceId.of(
+            server.attr_server_id + ":" + ",".join(subnet_ids)
+        )
+
+        def lookup(name, service, action, parameters, output_paths, resources):
+            call = cr.AwsSdkCall(
+                service=service,
+                action=action,
+                parameters=parameters,
+                output_paths=output_paths,  # responses must stay under 4 KB
+                physical_resource_id=physical_id,
+            )
+            return cr.AwsCustomResource(
+                self,
+                name,
+                on_create=call,
+                on_update=call,
+                install_latest_aws_sdk=False,
+                policy=cr.AwsCustomResourcePolicy.from_statements(
+                    [
                         iam.PolicyStatement(
                             effect=iam.Effect.ALLOW,
                             actions=[
-                                "elasticfilesystem:Describe*",
-                                "elasticfilesystem:List*",
-                                "elasticfilesystem:ClientWrite",
-                                # "elasticfilesystem:ClientRootAccess",
-                                "elasticfilesystem:ClientMount",
+                                f"{service.lower()}:{action[0].upper()}{action[1:]}"
                             ],
-                            resources=[fs.file_system_arn],
-                        ),
-                    ],
+                            resources=resources,
+                        )
+                    ]
                 ),
+            )
+
+        describe_server = lookup(
+            "DescribeSftpServer",
+            "Transfer",
+            "describeServer",
+            {"ServerId": server.attr_server_id},
+            ["Server.EndpointDetails.VpcEndpointId"],
+            [server.attr_arn],
+        )
+        endpoint = lookup(
+            "DescribeSftpEndpoint",
+            "EC2",
+            "describeVpcEndpoints",
+            {
+                "VpcEndpointIds": [
+                    describe_server.get_response_field(
+                        "Server.EndpointDetails.VpcEndpointId"
+                    )
+                ]
+            },
+            [f"VpcEndpoints.0.NetworkInterfaceIds.{n}" for n in range(count)],
+            ["*"],
+        )
+        interfaces = lookup(
+            "DescribeSftpEndpointInterfaces",
+            "EC2",
+            "describeNetworkInterfaces",
+            {
+                "NetworkInterfaceIds": [
+                    endpoint.get_response_field(
+                        f"VpcEndpoints.0.NetworkInterfaceIds.{n}"
+                    )
+                    for n in range(count)
+                ]
             },
+            [f"NetworkInterfaces.{n}.PrivateIpAddress" for n in range(count)],
+            ["*"],
         )
+        return [
+            interfaces.get_response_field(f"NetworkInterfaces.{n}.PrivateIpAddress")
+            for n in range(count)
+        ]
 
-        home = os.environ.get("HOME")
-        user_info = self.node.try_get_context("Users") or {}
+    def load_balancer(self, vpc, subnet_ids, server):
+        """Internal NLB on TCP 22 in front of the server's endpoint IPs."""
 
-        for username, details in user_info.items():
-            filename = details["SshKeyFile"]
-            user_id = details["UserId"]
-            group_id = details["GroupId"]
+        from aws_cdk import (
+            aws_elasticloadbalancingv2 as elbv2,
+            aws_elasticloadbalancingv2_targets as elbv2_targets,
+        )
 
-            if filename[0] == "/":
-                path = filename
-            else:
-                # look for the ssh public key file in  ~/.ssh
-                path = join(home, ".ssh", filename)
+        subnets = ec2.SubnetSelection(
+            subnets=[
+                ec2.Subnet.from_subnet_id(self, "nlb-" + subnet_id, subnet_id)
+                for subnet_id in subnet_ids
+            ]
+        )
+        nlb = elbv2.NetworkLoadBalancer(
+            self,
+            "SftpLoadBalancer",
+            vpc=vpc,
+            vpc_subnets=subnets,
+            internet_facing=False,
+            cross_zone_enabled=True,
+        )
 
-            ssh_keys = []
-            with open(path) as fp:
-                for line in fp.readlines():
-                    ssh_keys.append(line.strip())
+        # with the client's own address passed through, CidrRanges on the
+        # server's security group still decide who gets in; they must also
+        # cover SubnetIds, where the health checks come from
+        targets = elbv2.NetworkTargetGroup(
+            self,
+            "SftpTargets",
+            vpc=vpc,
+            port=22,
+            protocol=elbv2.Protocol.TCP,
+            target_type=elbv2.TargetType.IP,
+            preserve_client_ip=True,
+            deregistration_delay=Duration.seconds(30),
+            health_check=elbv2.HealthCheck(
+                protocol=elbv2.Protocol.TCP,
+                port="22",
+                interval=Duration.seconds(10),
+                healthy_threshold_count=2,
+                unhealthy_threshold_count=2,
+            ),
+            targets=[
+                elbv2_targets.IpTarget(ip)
+                for ip in self.endpoint_ips(server, subnet_ids)
+            ],
+        )
+        nlb.add_listener(
+            "Sftp",
+            port=22,
+            protocol=elbv2.Protocol.TCP,
+            default_target_groups=[targets],
+        )
+        return nlb
 
-            # https://docs.aws.amazon.com/AWSCloudFormation/latest/UserGuide/aws-resource-transfer-user.html
-            user = transfer.CfnUser(
-                self,
-                f"CfnUser-{username}",
-                role=user_role.role_arn,
-                server_id=server.attr_server_id,
-                user_name=username,
-                ssh_public_keys=ssh_keys,
-                home_directory=f"/{fs.file_system_id}/{username}/",
-                posix_profile={"uid": user_id, "gid": group_id}
-                # policy
-                # home_directory_type
-            )
+    def storage_bucket(self):
+        """The bucket users' home directories live in, for StorageDomain S3."""
 
-        # create NLB. accept tcp 22. register endpoints.
-        # custom resource to extract endpoints from server.
+        from aws_cdk import aws_s3 as s3
 
-        CfnOutput(
+        transition_days = self.node.try_get_context("S3TransitionDays")
+        expiration_days = self.node.try_get_context("S3ExpirationDays")
+
+        rule = dict(abort_incomplete_multipart_upload_after=Duration.days(7))
+        if transition_days != 0:
+            # like the file system's move to infrequent access after 30 days
+            rule["transitions"] = [
+                s3.Transition(
+                    storage_class=s3.StorageClass.INFREQUENT_ACCESS,
+                    transition_after=Duration.days(transition_days or 30),
+                )
+            ]
+        if expiration_days:
+            rule["expiration"] = Duration.days(expiration_days)
+
+        return s3.Bucket(
             self,
-            "SftpServerAddress",
-            value=f"{server.attr_server_id}.server.transfer.{self.region}.amazonaws.com",
+            "Storage",
+            bucket_name=self.node.try_get_context("S3BucketName"),
+            encryption=s3.BucketEncryption.S3_MANAGED,
+            block_public_access=s3.BlockPublicAccess.BLOCK_ALL,
+            enforce_ssl=True,
+            removal_policy=RemovalPolicy.RETAIN,
+            lifecycle_rules=[s3.LifecycleRule(**rule)],
         )
 
-        CfnOutput(
-            self,
-            "FileSystemAddress",
-            value=f"{fs.file_system_id}.efs.{self.region}.amazonaws.com",
+    def efs_performance(self):
+        """FileSystem arguments for the EfsThroughputMode, EfsProvisionedMibps
+        and EfsPerformanceMode context params."""
+
+        throughput_modes = {
+            "bursting": efs.ThroughputMode.BURSTING,
+            "provisioned": efs.ThroughputMode.PROVISIONED,
+            "elastic": efs.ThroughputMode.ELASTIC,
+        }
+        performance_modes = {
+            "generalPurpose": efs.PerformanceMode.GENERAL_PURPOSE,
+            "maxIO": efs.PerformanceMode.MAX_IO,
+        }
+
+        throughput = self.node.try_get_context("EfsThroughputMode") or "bursting"
+        performance = (
+            self.node.try_get_context("EfsPerformanceMode") or "generalPurpose"
         )
+        mibps = self.node.try_get_context("EfsProvisionedMibps")
+
+        if throughput not in throughput_modes:
+            print("EfsThroughputMode must be one of " + ", ".join(throughput_modes))
+            sys.exit(1)
+        if performance not in performance_modes:
+            print("EfsPerformanceMode must be one of " + ", ".join(performance_modes))
+            sys.exit(1)
+        if throughput == "elastic" and performance == "maxIO":
+            print("elastic throughput needs the generalPurpose performance mode")
+            sys.exit(1)
+
+        kwargs = {
+            "throughput_mode": throughput_modes[throughput],
+            "performance_mode": performance_modes[performance],
+        }
+        if throughput == "provisioned":
+            if not mibps:
+                print("provisioned throughput needs EfsProvisionedMibps")
+                sys.exit(1)
+            kwargs["provisioned_throughput_per_second"] = Size.mebibytes(int(mibps))
+        return kwargs
+
+    def context_flag(self, key, default=False):
+        """A true/false context param; from -c Key=false it is the string "false"."""
+
+        value = self.node.try_get_context(key)
+        if value is None:
+            return default
+        if isinstance(value, str):
+            flag = value.strip().lower()
+            if flag in ("true", "yes", "1"):
+                return True
+            if flag in ("false", "no", "0", ""):
+                return False
+            print(f"{key} must be true or false, not {value!r}")
+            sys.exit(1)
+        return bool(value)
+
+    def subnet_availability_zones(self, vpc_id, subnet_ids):
+        """The AZ of each of subnet_ids without asking AWS, or None if not known.
+
+        Taken from the AvailabilityZones context param, or else from a VPC
+        lookup already cached in cdk.context.json.
+        """
+
+        zones = self.node.try_get_context("AvailabilityZones")
+        if zones:
+            return zones
+
+        if Token.is_unresolved(self.account) or Token.is_unresolved(self.region):
+            return None  # the cached lookups are keyed by account and region
+
+        cached = self.node.try_get_context(
+            f"vpc-provider:account={self.account}:filter.vpc-id={vpc_id}"
+            f":region={self.region}:returnAsymmetricSubnets=true"
+        )
+        if not cached:
+            return None
+
+        subnet_zones = {
+            subnet["subnetId"]: subnet["availabilityZone"]
+            for group in cached.get("subnetGroups", [])
+            for subnet in group["subnets"]
+        }
+        if not all(subnet_id in subnet_zones for subnet_id in subnet_ids):
+            return None
+        return [subnet_zones[subnet_id] for subnet_id in subnet_ids]
+
+    def vpc_from_context(self, vpc_id, subnet_ids):
+        # Vpc.from_lookup is only needed when the subnets' AZs are unknown;
+        # otherwise synth never has to leave the machine
+        subnet_ids = subnet_ids or []
+        zones = self.subnet_availability_zones(vpc_id, subnet_ids)
+        # from_vpc_attributes puts the nth subnet in the nth zone, so it only
+        # fits one subnet per zone, in the same order
+        one_per_zone = (
+            zones and len(zones) == len(subnet_ids) and len(set(zones)) == len(zones)
+        )
+        if one_per_zone:
+            return ec2.Vpc.from_vpc_attributes(
+                self,
+                "Vpc",
+                vpc_id=vpc_id,
+                availability_zones=zones,
+                private_subnet_ids=subnet_ids,
+            )
+
+        if self.node.try_get_context("AvailabilityZones"):
+            print(
+                "AvailabilityZones must list the zone of each of SubnetIds,"
+                " in the same order, with one subnet per zone"
+            )
+            sys.exit(1)
+
+        if self.context_flag("OfflineSynth"):
+            print(
+                "OfflineSynth needs one subnet per zone in SubnetIds, and"
+                " AvailabilityZones or a cached lookup of " + vpc_id
+            )
+            sys.exit(1)
+
+        return ec2.Vpc.from_lookup(self, "Vpc", vpc_id=vpc_id)
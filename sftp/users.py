@@ -0,0 +1,157 @@
+"""Transfer users, from the Users context param and an optional manifest file.
+
+A manifest (UserManifest) holds one user per row, as CSV with a header
+
+    UserName,SshKeyFile,UserId,GroupId
+    alice,team.pub,5001,501
+
+or as JSON lines with the same keys. Key files are read once each, however
+many users share them, and every row is checked in the same pass so that
+all the problems in a manifest are reported together.
+"""
+
+import csv
+import json
+import math
+import os
+import re
+import zlib
+from os.path import join
+
+FIELDS = ("UserName", "SshKeyFile", "UserId", "GroupId")
+
+# https://docs.aws.amazon.com/transfer/latest/APIReference/API_CreateUser.html
+USERNAME = re.compile(r"^[\w][\w@.-]{2,99}$")
+
+# CloudFormation allows 500 resources per template; users are spread over
+# the shards by hash, so leave room for an unlucky one
+DEFAULT_USERS_PER_STACK = 400
+MAX_RESOURCES_PER_STACK = 500
+
+
+class UserError(ValueError):
+    pass
+
+
+class User:
+    __slots__ = ("name", "ssh_keys", "uid", "gid")
+
+    def __init__(self, name, ssh_keys, uid, gid):
+        self.name = name
+        self.ssh_keys = ssh_keys  # shared by every user of the same key file
+        self.uid = uid
+        self.gid = gid
+
+
+def read_manifest(path):
+    """(where, row) for each user in a CSV or JSON lines manifest."""
+
+    with open(path, newline="") as fp:
+        if path.endswith(".csv"):
+            reader = csv.DictReader(fp)
+            for row in reader:
+                yield f"{path}:{reader.line_num}", row
+            return
+
+        for number, line in enumerate(fp, 1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError as e:
+                row = {"__error__": f"not JSON: {e}"}
+            yield f"{path}:{number}", row
+
+
+def _rows(context_users, manifest):
+    for username, details in (context_users or {}).items():
+        yield f"Users.{username}", dict(details, UserName=username)
+    if manifest:
+        yield from read_manifest(manifest)
+
+
+def load_users(context_users=None, manifest=None, home=None):
+    """The users in context_users (the Users param) and then in manifest.
+
+    Raises UserError listing every bad row: duplicate or malformed names,
+    ids that are not numbers, and key files that are missing or empty.
+    """
+
+    home = home or os.environ.get("HOME", "")
+    keys = {}  # key file path -> tuple of keys, or the error reading it
+    users = []
+    seen = set()
+    problems = []
+
+    for where, row in _rows(context_users, manifest):
+        if "__error__" in row:
+            problems.append(f"{where}: {row['__error__']}")
+            continue
+        missing = [field for field in FIELDS if row.get(field) in (None, "")]
+        if missing:
+            problems.append(f"{where}: missing {', '.join(missing)}")
+            continue
+
+        name = str(row["UserName"]).strip()
+        if not USERNAME.match(name):
+            problems.append(f"{where}: {name!r} is not a valid user name")
+            continue
+        if name in seen:
+            problems.append(f"{where}: {name} is listed more than once")
+            continue
+        seen.add(name)
+
+        try:
+            uid, gid = int(row["UserId"]), int(row["GroupId"])
+        except (TypeError, ValueError):
+            problems.append(f"{where}: UserId and GroupId must be numbers")
+            continue
+
+        filename = str(row["SshKeyFile"]).strip()
+        # relative names are looked for in ~/.ssh
+        path = filename if filename[0] == "/" else join(home, ".ssh", filename)
+        if path not in keys:
+            try:
+                with open(path) as fp:
+                    keys[path] = (
+                        tuple(line.strip() for line in fp if line.strip())
+                        or f"{path} has no keys"
+                    )
+            except OSError as e:
+                keys[path] = f"cannot read {path}: {e.strerror}"
+        if isinstance(keys[path], str):
+            problems.append(f"{where}: {keys[path]}")
+            continue
+
+        users.append(User(name, keys[path], uid, gid))
+
+    if problems:
+        raise UserError("\n".join(problems))
+    return users
+
+
+def shard_of(name, shards):
+    """Which of shards a user belongs in; stable however many users there are."""
+    return zlib.crc32(name.encode("utf-8")) % shards
+
+
+def shard(users, shards=None, per_stack=DEFAULT_USERS_PER_STACK, resources_per_user=1):
+    """users split into shards lists (enough for per_stack each, if not given).
+
+    Raises UserError if a shard would go over CloudFormation's resource
+    limit, with resources_per_user resources made for each user.
+    """
+
+    shards = shards or max(1, math.ceil(len(users) / per_stack))
+    groups = [[] for _ in range(shards)]
+    for user in users:
+        groups[shard_of(user.name, shards)].append(user)
+
+    largest = max(len(group) for group in groups)
+    if largest * resources_per_user > MAX_RESOURCES_PER_STACK:
+        raise UserError(
+            f"{largest} users in one stack is over the limit of"
+            f" {MAX_RESOURCES_PER_STACK} resources; raise UserShards"
+        )
+    return groups
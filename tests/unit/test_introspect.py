@@ -0,0 +1,104 @@
+import http.server
+import importlib.util
+import json
+import os.path
+import threading
+
+import pytest
+
+urllib3 = pytest.importorskip("urllib3")
+
+SCRIPT = os.path.join(
+    os.path.dirname(__file__), "..", "..", "historical", "introspect.py"
+)
+spec = importlib.util.spec_from_file_location("introspect", SCRIPT)
+introspect = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(introspect)
+
+TREE = {
+    "": "ami-id\ninstance-id\nplacement/\npublic-keys/\nspot/",
+    "public-keys/": "0=my-key",
+    "public-keys/0/": "openssh-key",
+    "public-keys/0/openssh-key": "ssh-rsa AAAA my-key",
+    "spot/": "instance-action",
+    "ami-id": "ami-123",
+    "instance-id": "i-abc",
+    "placement/": "availability-zone\nregion",
+    "placement/availability-zone": "us-east-1a",
+    "placement/region": "us-east-1",
+}
+
+
+class IMDS(http.server.BaseHTTPRequestHandler):
+    tokens_issued = 0
+    requests = 0
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_PUT(self):
+        type(self).tokens_issued += 1
+        self._reply(200, "token")
+
+    def do_GET(self):
+        type(self).requests += 1
+        if self.headers.get("X-aws-ec2-metadata-token") != "token":
+            self._reply(401, "")
+            return
+        path = self.path[len("/latest/meta-data/") :]
+        if path in TREE:
+            self._reply(200, TREE[path])
+        else:
+            self._reply(404, "")
+
+    def _reply(self, status, body):
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body.encode())
+
+
+@pytest.fixture
+def imds():
+    IMDS.tokens_issued = 0
+    IMDS.requests = 0
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), IMDS)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+
+
+def test_crawl_whole_tree(imds):
+    crawler = introspect.MetadataCrawler(urllib3.PoolManager(), imds, workers=4)
+    assert crawler.crawl() == {
+        "ami-id": "ami-123",
+        "instance-id": "i-abc",
+        "placement": {"availability-zone": "us-east-1a", "region": "us-east-1"},
+        "public-keys": {"0": {"openssh-key": "ssh-rsa AAAA my-key"}},
+        "spot": {},  # instance-action is listed but 404s
+    }
+    assert IMDS.tokens_issued == 1  # reused for every request
+
+
+def test_missing_requested_path(imds):
+    crawler = introspect.MetadataCrawler(urllib3.PoolManager(), imds, workers=4)
+    with pytest.raises(urllib3.exceptions.HTTPError):
+        crawler.crawl(["no-such-thing"])
+
+
+def test_paths_and_cache(imds, tmp_path, capsys):
+    cache = str(tmp_path / "imds.json")
+    argv = ["--url", imds, "--json", "--paths", "placement/", "instance-id"]
+    argv += ["--cache", cache]
+
+    introspect.main(argv)
+    expected = {
+        "instance-id": "i-abc",
+        "placement": {"availability-zone": "us-east-1a", "region": "us-east-1"},
+    }
+    assert json.loads(capsys.readouterr().out) == expected
+    requests = IMDS.requests
+
+    introspect.main(argv)  # served from the cache
+    assert json.loads(capsys.readouterr().out) == expected
+    assert IMDS.requests == requests
@@ -0,0 +1,190 @@
+import json
+
+import pytest
+
+cdk = pytest.importorskip("aws_cdk")
+assertions = pytest.importorskip("aws_cdk.assertions")
+
+from sftp.sftp_stack import SftpStack
+
+CONTEXT = {
+    "VpcId": "vpc-021a93ecf7ec27962",
+    "SubnetIds": ["subnet-06b4b7a7ce84c94fa", "subnet-05049e5fc39116994"],
+    "AvailabilityZones": ["us-east-1a", "us-east-1c"],
+    "CidrRanges": ["10.0.0.0/8"],
+    "LoadBalancer": False,
+}
+
+
+def synth(**context):
+    app = cdk.App(context=dict(CONTEXT, **context))
+    stack = SftpStack(
+        app,
+        "SftpStack",
+        env=cdk.Environment(account="111111111111", region="us-east-1"),
+    )
+    return assertions.Template.from_stack(stack)
+
+
+def test_workflow_custom_step_keys():
+    template = synth(PostUploadWorkflow=True, WorkflowBucket="bucket")
+    (workflow,) = template.find_resources("AWS::Transfer::Workflow").values()
+    (step,) = workflow["Properties"]["Steps"]
+    assert step["Type"] == "CUSTOM"
+    assert sorted(step["CustomStepDetails"]) == [
+        "Name",
+        "SourceFileLocation",
+        "Target",
+        "TimeoutSeconds",
+    ]
+    template.has_resource_properties(
+        "AWS::Transfer::Server",
+        {"WorkflowDetails": {"OnUpload": [assertions.Match.any_value()]}},
+    )
+
+
+def users(tmp_path, names):
+    key = tmp_path / "team.pub"
+    key.write_text("ssh-ed25519 AAAA team\n")
+    return {
+        name: {"SshKeyFile": str(key), "UserId": 5000 + n, "GroupId": 500}
+        for n, name in enumerate(names)
+    }
+
+
+def manifest(tmp_path, names):
+    path = tmp_path / "users.jsonl"
+    path.write_text(
+        "".join(
+            json.dumps(dict(details, UserName=name)) + "\n"
+            for name, details in users(tmp_path, names).items()
+        )
+    )
+    return str(path)
+
+
+def test_users_past_the_main_stack_need_shards(tmp_path):
+    with pytest.raises(SystemExit):
+        synth(
+            Users=users(tmp_path, ["alice", "bob"]),
+            UserManifest=manifest(tmp_path, ["carol", "dave"]),
+            UsersPerStack=3,
+        )
+
+
+def test_shards_leave_the_users_param_in_the_main_stack(tmp_path):
+    context = dict(Users=users(tmp_path, ["alice", "bob"]), UsersPerStack=3)
+    before = synth(**context).find_resources("AWS::Transfer::User")
+
+    template = synth(
+        UserManifest=manifest(tmp_path, [f"user{n}" for n in range(10)]),
+        UserShards=2,
+        **context,
+    )
+    assert template.find_resources("AWS::Transfer::User") == before
+    template.resource_count_is("AWS::CloudFormation::Stack", 2)
+
+
+def cached_lookup(zones):
+    """A cdk.context.json VPC lookup with one subnet in each of zones."""
+
+    key = (
+        "vpc-provider:account=111111111111:filter.vpc-id=vpc-021a93ecf7ec27962"
+        ":region=us-east-1:returnAsymmetricSubnets=true"
+    )
+    subnets = [
+        {"subnetId": f"subnet-{n}", "availabilityZone": zone, "cidr": f"10.0.{n}.0/24"}
+        for n, zone in enumerate(zones)
+    ]
+    return {
+        key: {"vpcId": "vpc-021a93ecf7ec27962", "subnetGroups": [{"name": "Private", "type": "Private", "subnets": subnets}]},
+        "SubnetIds": [subnet["subnetId"] for subnet in subnets],
+        "AvailabilityZones": None,
+        "OfflineSynth": True,
+    }
+
+
+def test_cached_lookup_builds_the_vpc_offline():
+    template = synth(**cached_lookup(["us-east-1a", "us-east-1c"]))
+    template.resource_count_is("AWS::EFS::MountTarget", 2)
+
+
+def test_two_subnets_in_one_zone_are_not_built_offline():
+    with pytest.raises(SystemExit):
+        synth(**cached_lookup(["us-east-1a", "us-east-1a", "us-east-1c", "us-east-1c"]))
+    with pytest.raises(SystemExit):
+        synth(AvailabilityZones=["us-east-1a", "us-east-1a"])
+
+
+@pytest.mark.parametrize("flag, count", [(None, 0), ("false", 0), ("true", 2)])
+def test_access_points_are_opt_in(tmp_path, flag, count):
+    context = dict(Users=users(tmp_path, ["alice", "bob"]))
+    if flag is not None:
+        context["EfsAccessPoints"] = flag  # -c EfsAccessPoints=false is a string
+    template = synth(**context)
+    template.resource_count_is("AWS::EFS::AccessPoint", count)
+
+
+def test_a_flag_that_is_not_true_or_false_stops_synth():
+    with pytest.raises(SystemExit):
+        synth(EfsAccessPoints="maybe")
+
+
+def test_load_balancer_targets_the_endpoint_in_every_subnet():
+    template = synth(LoadBalancer="true")
+    template.has_resource_properties(
+        "AWS::ElasticLoadBalancingV2::LoadBalancer",
+        {
+            "Type": "network",
+            "Scheme": "internal",
+            "LoadBalancerAttributes": assertions.Match.array_with(
+                [{"Key": "load_balancing.cross_zone.enabled", "Value": "true"}]
+            ),
+        },
+    )
+    (targets,) = template.find_resources(
+        "AWS::ElasticLoadBalancingV2::TargetGroup"
+    ).values()
+    properties = targets["Properties"]
+    assert properties["TargetType"] == "ip"
+    assert len(properties["Targets"]) == len(CONTEXT["SubnetIds"])
+    assert properties["HealthCheckProtocol"] == "TCP"
+    assert properties["HealthCheckPort"] == "22"
+
+    # the lookups run again when SubnetIds change, as the interfaces do
+    lookups = [
+        json.dumps(lookup["Properties"]["Create"])
+        for lookup in template.find_resources("Custom::AWS").values()
+    ]
+    assert len(lookups) == 3
+    for create in lookups:
+        assert all(subnet_id in create for subnet_id in CONTEXT["SubnetIds"])
+
+    (export,) = template.find_outputs("SftpServerAddress").values()
+    assert export["Export"]["Name"] == "SftpStack-SftpServerAddress"
+    assert "GetAtt" in json.dumps(export["Value"])  # the NLB's DNS name
+    template.has_output("SftpEndpointAddress", {})
+
+
+def test_load_balancer_false_string_leaves_it_out():
+    synth(LoadBalancer="false").resource_count_is(
+        "AWS::ElasticLoadBalancingV2::LoadBalancer", 0
+    )
+
+
+def test_fleet_keeps_its_state_per_node_outside_the_tree():
+    template = synth(UploaderNodes=2, UploaderBucket="bucket")
+    template.resource_count_is("AWS::EFS::FileSystem", 2)
+    paths = [
+        access_point["Properties"]["RootDirectory"]["Path"]
+        for access_point in template.find_resources("AWS::EFS::AccessPoint").values()
+    ]
+    assert sorted(paths) == ["/", "/node0", "/node1"]
+
+    for task in template.find_resources("AWS::ECS::TaskDefinition").values():
+        (container,) = task["Properties"]["ContainerDefinitions"]
+        command = container["Command"]
+        for flag, name in [("--journal", "journal.db"), ("--scan-index", "scan-index.db")]:
+            assert command[command.index(flag) + 1] == "/var/lib/uploader/" + name
+        mounts = {mount["ContainerPath"] for mount in container["MountPoints"]}
+        assert mounts == {"/mnt/efs", "/var/lib/uploader"}
@@ -0,0 +1,89 @@
+import json
+
+import pytest
+
+from sftp.users import UserError, load_users, shard
+
+
+def keyfile(tmp_path, name, *keys):
+    path = tmp_path / name
+    path.write_text("".join(key + "\n" for key in keys))
+    return str(path)
+
+
+def test_csv_and_jsonl_manifests_share_key_reads(tmp_path):
+    team = keyfile(tmp_path, "team.pub", "ssh-ed25519 AAAA team", "")
+    csv_manifest = tmp_path / "users.csv"
+    csv_manifest.write_text(
+        "UserName,SshKeyFile,UserId,GroupId\n"
+        f"alice,{team},5001,501\n"
+        f"bob,{team},5002,501\n"
+    )
+    jsonl_manifest = tmp_path / "users.jsonl"
+    jsonl_manifest.write_text(
+        json.dumps(
+            {"UserName": "carol", "SshKeyFile": team, "UserId": 5003, "GroupId": 501}
+        )
+        + "\n"
+    )
+
+    context = {"fmc_backup": {"SshKeyFile": team, "UserId": 5000, "GroupId": 500}}
+    users = load_users(context, str(csv_manifest)) + load_users(
+        None, str(jsonl_manifest)
+    )
+
+    assert [user.name for user in users] == ["fmc_backup", "alice", "bob", "carol"]
+    assert users[1].ssh_keys == ("ssh-ed25519 AAAA team",)
+    assert users[1].ssh_keys is users[2].ssh_keys  # the file was read once
+    assert (users[2].uid, users[2].gid) == (5002, 501)
+
+
+def test_every_problem_is_reported(tmp_path):
+    team = keyfile(tmp_path, "team.pub", "ssh-ed25519 AAAA team")
+    empty = keyfile(tmp_path, "empty.pub")
+    manifest = tmp_path / "users.csv"
+    manifest.write_text(
+        "UserName,SshKeyFile,UserId,GroupId\n"
+        f"alice,{team},5001,501\n"
+        f"alice,{team},5002,501\n"
+        f"x,{team},5003,501\n"
+        f"dave,{team},five,501\n"
+        f"erin,{tmp_path}/nope.pub,5005,501\n"
+        f"frank,{empty},5006,501\n"
+        f"grace,,5007,501\n"
+    )
+
+    with pytest.raises(UserError) as raised:
+        load_users(None, str(manifest))
+    problems = str(raised.value).splitlines()
+    assert len(problems) == 6
+    assert "users.csv:3: alice is listed more than once" in problems[0]
+    assert "missing SshKeyFile" in problems[-1]
+
+
+def test_shards_are_stable_and_bounded(tmp_path):
+    team = keyfile(tmp_path, "team.pub", "ssh-ed25519 AAAA team")
+    context = {
+        f"user{n:04}": {"SshKeyFile": team, "UserId": n, "GroupId": 1}
+        for n in range(1000)
+    }
+    users = load_users(context)
+
+    groups = shard(users, per_stack=400)
+    assert len(groups) == 3
+    assert sum(len(group) for group in groups) == 1000
+
+    placed = {user.name: i for i, group in enumerate(groups) for user in group}
+    more = shard(users + load_users({"newcomer": context["user0000"]}), shards=3)
+    assert all(
+        placed[user.name] == i
+        for i, group in enumerate(more)
+        for user in group
+        if user.name in placed
+    )
+
+    with pytest.raises(UserError):
+        shard(users, shards=1)
+    assert len(shard(users[:300], shards=1)[0]) == 300
+    with pytest.raises(UserError):
+        shard(users[:300], shards=1, resources_per_user=2)  # with access points
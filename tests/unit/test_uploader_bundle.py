@@ -0,0 +1,145 @@
+import io
+import json
+import os
+import threading
+import time
+
+from uploader.bundle import INDEX_SUFFIX, BundlingUploader, extract
+from uploader.keys import KeyMapper
+from uploader.pipeline import Pipeline
+
+
+class FakeS3:
+    def __init__(self):
+        self.objects = {}
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        self.objects[Key] = Body
+        return {"ETag": f'"{len(self.objects)}"'}
+
+    def get_object(self, Bucket, Key):
+        return {"Body": io.BytesIO(self.objects[Key])}
+
+
+class DirectUploader:
+    def __init__(self):
+        self.uploaded = []
+
+    def upload(self, absolute_path, key, stat):
+        self.uploaded.append(key)
+        return {"ETag": '"direct"'}
+
+
+def delete(absolute_path, key, stat, response):
+    os.remove(absolute_path)
+
+
+def test_small_files_are_bundled_and_extractable(tmp_path):
+    root = tmp_path / "share"
+    root.mkdir()
+    contents = {"a.txt": b"alpha", "b.txt": b"bravo" * 10, "big.bin": b"x" * 4096}
+    for name, data in contents.items():
+        (root / name).write_bytes(data)
+
+    s3 = FakeS3()
+    direct = DirectUploader()
+    bundler = BundlingUploader(
+        direct,
+        s3,
+        "bucket",
+        prefix="p",
+        threshold=1024,
+        max_age=3600,
+        compression="gzip",
+    )
+    pipeline = Pipeline(bundler, KeyMapper(str(root), "p"), post_actions=[delete])
+    bundler.finished = pipeline.finished
+    bundler.failed = pipeline.failed
+
+    for name in contents:
+        assert pipeline.process(str(root / name))
+
+    # the large file went straight through; the small ones wait for the bundle
+    assert direct.uploaded == ["p/big.bin"]
+    assert os.path.exists(root / "a.txt")
+
+    pipeline.close()
+    assert not os.path.exists(root / "a.txt")
+    assert not os.path.exists(root / "b.txt")
+
+    (index_key,) = [key for key in s3.objects if key.endswith(INDEX_SUFFIX)]
+    bundle_key = index_key[: -len(INDEX_SUFFIX)]
+    assert bundle_key.startswith("p/_bundles/") and bundle_key.endswith(".tar.gz")
+    index = json.loads(s3.objects[index_key])
+    assert [entry["key"] for entry in index["files"]] == ["p/a.txt", "p/b.txt"]
+
+    destination = tmp_path / "restored"
+    extract(s3, "bucket", bundle_key, "p/b.txt", str(destination))
+    assert destination.read_bytes() == contents["b.txt"]
+
+
+def test_full_bundle_is_sent_without_waiting(tmp_path):
+    s3 = FakeS3()
+    bundler = BundlingUploader(
+        DirectUploader(),
+        s3,
+        "bucket",
+        threshold=1024,
+        max_bytes=10,
+        max_age=3600,
+        compression="none",
+    )
+    done = []
+    bundler.finished = lambda path, stat, response: done.append(path)
+
+    path = tmp_path / "f"
+    path.write_bytes(b"0123456789")
+    bundler.upload(str(path), "f", os.stat(path))
+
+    deadline = time.monotonic() + 5
+    while not done and time.monotonic() < deadline:
+        time.sleep(0.01)  # sent on the bundler thread
+    assert done == [str(path)]
+    assert len(s3.objects) == 2
+
+
+class SlowS3(FakeS3):
+    def __init__(self):
+        super().__init__()
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        self.started.set()
+        self.release.wait(5)
+        return super().put_object(Bucket, Key, Body, **kwargs)
+
+
+def test_close_waits_for_the_bundle_being_sent(tmp_path):
+    s3 = SlowS3()
+    bundler = BundlingUploader(
+        DirectUploader(),
+        s3,
+        "bucket",
+        threshold=1024,
+        max_bytes=10,
+        max_age=3600,
+        compression="none",
+    )
+    done = []
+    bundler.finished = lambda path, stat, response: done.append(path)
+
+    path = tmp_path / "f"
+    path.write_bytes(b"0123456789")
+    bundler.upload(str(path), "f", os.stat(path))
+    assert s3.started.wait(5)  # the bundler thread has taken the bundle
+
+    closer = threading.Thread(target=bundler.close)
+    closer.start()
+    closer.join(0.2)
+    assert closer.is_alive() and not done
+
+    s3.release.set()
+    closer.join(5)
+    assert not closer.is_alive()
+    assert done == [str(path)]
@@ -0,0 +1,84 @@
+import base64
+import gzip
+import hashlib
+import os
+
+import pytest
+
+from uploader import compress, multipart
+from uploader.compress import CompressionRules, upload_compressed
+
+
+class FakeS3:
+    def __init__(self):
+        self.objects = {}
+        self.uploads = {}
+
+    def put_object(self, Bucket, Key, Body, ChecksumSHA256, **kwargs):
+        assert base64.b64encode(hashlib.sha256(Body).digest()).decode() == (
+            ChecksumSHA256
+        )
+        self.objects[Key] = (Body, kwargs)
+        return {"ETag": '"put"'}
+
+    def create_multipart_upload(self, Bucket, Key, ChecksumAlgorithm, **kwargs):
+        self.uploads["1"] = ({}, kwargs)
+        return {"UploadId": "1"}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body, ChecksumSHA256):
+        assert base64.b64encode(hashlib.sha256(Body).digest()).decode() == (
+            ChecksumSHA256
+        )
+        self.uploads[UploadId][0][PartNumber] = Body
+        return {"ETag": f'"{PartNumber}"'}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        parts, kwargs = self.uploads.pop(UploadId)
+        numbers = [part["PartNumber"] for part in MultipartUpload["Parts"]]
+        assert numbers == sorted(parts)
+        self.objects[Key] = (b"".join(parts[n] for n in numbers), kwargs)
+        return {"ETag": '"multipart"'}
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId):
+        self.uploads.pop(UploadId)
+
+
+def test_compression_rules():
+    rules = CompressionRules([".log=gzip", ".conf=gzip"])
+    assert rules.codec_for("app.LOG") == "gzip"
+    assert rules.codec_for("data.bin") is None
+    with pytest.raises(ValueError):
+        CompressionRules([".log=lz4"])
+
+
+def test_small_file_is_one_checksummed_put(tmp_path):
+    path = tmp_path / "app.log"
+    data = b"the same line again\n" * 1000
+    path.write_bytes(data)
+
+    s3 = FakeS3()
+    response = upload_compressed(s3, "bucket", "app.log", str(path), "gzip")
+    assert response["ETag"] == '"put"'
+
+    body, kwargs = s3.objects["app.log"]
+    assert gzip.decompress(body) == data
+    assert len(body) < len(data) // 10
+    assert kwargs["ContentEncoding"] == "gzip"
+    assert kwargs["Metadata"]["uncompressed-size"] == str(len(data))
+
+
+def test_large_output_is_streamed_in_parts(tmp_path, monkeypatch):
+    monkeypatch.setattr(multipart, "MIN_PART_SIZE", 1024)
+    monkeypatch.setattr(compress, "CHUNK_SIZE", 4096)
+    path = tmp_path / "random.log"
+    data = os.urandom(64 * 1024)  # does not compress
+    path.write_bytes(data)
+
+    s3 = FakeS3()
+    response = upload_compressed(
+        s3, "bucket", "random.log", str(path), "gzip", part_size=8192
+    )
+    assert response["ETag"] == '"multipart"'
+    body, kwargs = s3.objects["random.log"]
+    assert gzip.decompress(body) == data
+    assert kwargs["ContentEncoding"] == "gzip"
@@ -0,0 +1,62 @@
+import threading
+import time
+
+from uploader.debounce import Debouncer
+
+
+def test_repeated_writes_are_released_once_settled():
+    released = []
+    done = threading.Event()
+
+    def release(path):
+        released.append((path, time.monotonic()))
+        if len(released) == 2:
+            done.set()
+
+    debouncer = Debouncer(release, settle_ms=100)
+    started = time.monotonic()
+    for _ in range(5):
+        debouncer.touch("/a")
+        time.sleep(0.02)
+    debouncer.touch("/b")
+    assert debouncer.pending("/a")
+
+    assert done.wait(5)
+    assert [path for path, _ in released] == ["/a", "/b"]
+    # the last of five touches, 80ms in, restarted the window
+    assert released[0][1] - started >= 0.18
+    assert not debouncer.pending("/a")
+
+
+def test_a_failing_release_does_not_stop_the_thread():
+    released = []
+
+    def release(path):
+        if path == "/bad":
+            raise OSError("gone")
+        released.append(path)
+
+    debouncer = Debouncer(release, settle_ms=10)
+    debouncer.touch("/bad")
+    debouncer.touch("/good")
+
+    deadline = time.monotonic() + 5
+    while not released and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert released == ["/good"]
+
+
+def test_stop_returns_what_had_not_settled():
+    released = []
+    debouncer = Debouncer(released.append, settle_ms=10)
+    debouncer.touch("/settled")
+    deadline = time.monotonic() + 5
+    while not released and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    debouncer.settle = 3600
+    debouncer.touch("/b")
+    debouncer.touch("/a")
+    assert debouncer.stop() == ["/b", "/a"]
+    assert not debouncer.thread.is_alive()
+    assert released == ["/settled"]
@@ -0,0 +1,58 @@
+import hashlib
+import os
+
+from uploader import dedup
+from uploader.dedup import METADATA_KEY, Deduplicator, HashCache, file_digest
+
+
+class FakeS3:
+    def __init__(self, objects):
+        self.objects = objects  # key -> head_object response
+
+    def head_object(self, Bucket, Key):
+        if Key not in self.objects:
+            raise KeyError(Key)  # botocore raises a ClientError for the 404
+        return self.objects[Key]
+
+
+def test_file_digest_reads_in_chunks(tmp_path):
+    path = tmp_path / "f"
+    data = os.urandom(10000)
+    path.write_bytes(data)
+    assert file_digest(str(path), chunk_size=4096) == hashlib.sha256(data).hexdigest()
+
+
+def test_hash_cache_rehashes_only_changed_files(tmp_path, monkeypatch):
+    hashed = []
+    monkeypatch.setattr(
+        dedup, "file_digest", lambda path: hashed.append(path) or f"sha-{len(hashed)}"
+    )
+    path = tmp_path / "f"
+    path.write_bytes(b"one")
+
+    cache = HashCache(max_entries=1)
+    assert cache.digest(str(path), os.stat(path)) == "sha-1"
+    assert cache.digest(str(path), os.stat(path)) == "sha-1"
+
+    path.write_bytes(b"longer")
+    assert cache.digest(str(path), os.stat(path)) == "sha-2"
+    assert len(cache.entries) == 1  # the stale entry was evicted
+
+
+def test_check_skips_only_identical_content(tmp_path):
+    path = tmp_path / "f"
+    path.write_bytes(b"content")
+    stat = os.stat(path)
+    digest = hashlib.sha256(b"content").hexdigest()
+
+    s3 = FakeS3(
+        {
+            "same": {"ContentLength": 7, "Metadata": {METADATA_KEY: digest}},
+            "other": {"ContentLength": 7, "Metadata": {METADATA_KEY: "0" * 64}},
+        }
+    )
+    deduplicator = Deduplicator(s3, "bucket")
+
+    assert deduplicator.check("same", str(path), stat)[1] is not None
+    assert deduplicator.check("other", str(path), stat) == (digest, None)
+    assert deduplicator.check("missing", str(path), stat) == (digest, None)
@@ -0,0 +1,91 @@
+import os
+import queue
+import time
+
+import pytest
+
+from uploader.fair import FairQueue, TokenBucket, parse_settings, tenant_of
+from uploader.pool import UploadPool
+
+MB = 1024 * 1024
+
+
+def sizes(table):
+    return lambda path: table[os.path.basename(path)]
+
+
+def test_tenant_of():
+    assert tenant_of("/mnt/efs", "/mnt/efs/alice/in/a.csv") == "alice"
+    assert tenant_of("/mnt/efs/", "/mnt/efs/bob/b.csv") == "bob"
+    assert tenant_of("/mnt/efs", "/mnt/efs/loose.csv") == ""
+
+
+def test_parse_settings():
+    assert parse_settings(["alice=4", "bob=0.5"]) == {"alice": 4.0, "bob": 0.5}
+    with pytest.raises(ValueError):
+        parse_settings(["4"])
+
+
+def test_small_upload_overtakes_bulk_backlog():
+    table = {f"big{n}": 1024 * MB for n in range(10)}
+    table["small"] = 1024
+    fair = FairQueue("/efs", maxsize=0, cost=sizes(table))
+    for n in range(10):
+        fair.put(f"/efs/bulk/big{n}")
+    fair.put("/efs/alice/small")
+
+    order = [fair.get() for _ in range(11)]
+    assert order.index("/efs/alice/small") <= 1
+    assert fair.qsize() == 0
+
+
+def test_weights_share_workers():
+    fair = FairQueue("/efs", maxsize=0, weights={"heavy": 3}, cost=lambda path: MB)
+    for n in range(40):
+        fair.put(f"/efs/heavy/{n}")
+        fair.put(f"/efs/light/{n}")
+
+    first = [fair.get().split("/")[2] for _ in range(20)]
+    assert first.count("heavy") == 15
+
+
+def test_rate_limited_tenant_waits():
+    fair = FairQueue("/efs", maxsize=0, rates={"slow": MB}, cost=lambda path: 9 * MB)
+    fair.put("/efs/slow/1")
+    fair.put("/efs/slow/2")
+    assert fair.get() == "/efs/slow/1"  # within the burst
+    with pytest.raises(queue.Empty):
+        fair.get_nowait()  # 1MB in debt, past the 8MB burst
+
+
+def test_token_bucket():
+    bucket = TokenBucket(rate=100, burst=100)
+    now = time.monotonic()
+    bucket.take(150, now)
+    assert bucket.wait_time(now) == pytest.approx(0.5, abs=0.01)
+
+
+def test_pool_runs_on_fair_queue(tmp_path):
+    done = []
+    fair = FairQueue(str(tmp_path), maxsize=10)
+    pool = UploadPool(done.append, workers=2, work_queue=fair)
+    paths = [str(tmp_path / "alice" / str(n)) for n in range(5)]
+    for path in paths:
+        pool.submit(path)
+    left = pool.shutdown()  # stop markers are served ahead of queued paths
+    assert sorted(done + left) == sorted(paths)
+
+
+def test_shutdown_returns_a_throttled_backlog():
+    table = {f"f{n}": 9 * MB for n in range(11)}
+    fair = FairQueue("/efs", maxsize=0, rates={"alice": 1 * MB}, cost=sizes(table))
+    uploaded = []
+    pool = UploadPool(uploaded.append, workers=2, work_queue=fair)
+    for n in range(11):
+        pool.submit(f"/efs/alice/f{n}")
+    time.sleep(0.2)  # the first file uses up alice's burst
+
+    pending = pool.shutdown()
+    assert len(uploaded) < 11
+    assert sorted(uploaded + pending) == sorted(f"/efs/alice/f{n}" for n in range(11))
+    assert fair.qsize() == 0
@@ -0,0 +1,175 @@
+import asyncio
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+from uploader.native_inotify import IN_CLOSE_WRITE, InotifyReader
+from uploader.engines import run_sync
+from uploader.keys import KeyMapper
+from uploader.pipeline import Pipeline
+from uploader.watcher import CLOSED, NEW_DIRECTORY, NativeTreeWatcher
+
+pytestmark = pytest.mark.skipif(
+    not sys.platform.startswith("linux"), reason="inotify is Linux only"
+)
+
+
+def test_reader_batches_events(tmp_path):
+    reader = InotifyReader(str(tmp_path))
+    assert reader.read_events() == []
+    assert not reader.wait(0)
+
+    for n in range(200):
+        (tmp_path / f"file-{n}.dat").write_bytes(b"x")
+    assert reader.wait(1)
+
+    closed = []
+    while True:
+        events = reader.read_events()
+        if not events:
+            break
+        closed += [e.name for e in events if e.mask & IN_CLOSE_WRITE]
+    reader.close()
+    assert closed == [f"file-{n}.dat" for n in range(200)]
+
+
+def test_watcher_follows_new_directories(tmp_path):
+    watcher = NativeTreeWatcher(str(tmp_path))
+    events = watcher.events()
+
+    before = time.time_ns()
+    os.makedirs(tmp_path / "alice")
+    kind, path, watched = next(events)
+    assert (kind, path) == (NEW_DIRECTORY, str(tmp_path / "alice"))
+    assert before <= watched[path] <= time.time_ns()
+
+    (tmp_path / "alice" / "a.dat").write_bytes(b"x")
+    assert next(events) == (CLOSED, str(tmp_path / "alice" / "a.dat"), None)
+    watcher.close()
+
+
+class CountingPipeline:
+    """Just enough of Pipeline for the asyncio engine, counting its tasks."""
+
+    def __init__(self, delay=0):
+        self.delay = delay
+        self.logger = self
+        self.metrics = self
+        self.events = self
+        self.processed = []
+        self.most_tasks = 0
+        self.retries = None
+
+    def log(self, message):
+        pass
+
+    def inc(self, amount=1):
+        pass
+
+    def gauge(self, name, help, function):
+        self.tasks = function
+
+    def process(self, absolute_path):
+        self.most_tasks = max(self.most_tasks, self.tasks())
+        time.sleep(self.delay)
+        self.processed.append(absolute_path)
+        return True
+
+
+@pytest.mark.parametrize("concurrency", [1, 4])
+def test_async_backlog_is_bounded(tmp_path, concurrency):
+    from uploader.async_engine import run
+
+    files = [f"/backlog/{n}" for n in range(500)]
+    pipeline = CountingPipeline()
+
+    async def main():
+        engine = asyncio.create_task(
+            run(pipeline, str(tmp_path), concurrency=concurrency, backlog=iter(files))
+        )
+        while len(pipeline.processed) < len(files):
+            await asyncio.sleep(0.01)
+        engine.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await engine
+
+    asyncio.run(asyncio.wait_for(main(), 30))
+    assert sorted(pipeline.processed) == sorted(files)
+    # the uploads in progress, not one task per file
+    assert pipeline.most_tasks <= concurrency
+
+
+def test_cancel_leaves_the_rest_of_the_backlog(tmp_path):
+    from uploader.async_engine import run
+
+    files = (f"/backlog/{n}" for n in range(1000000))
+    pipeline = CountingPipeline(delay=0.01)
+
+    async def main():
+        engine = asyncio.create_task(
+            run(pipeline, str(tmp_path), concurrency=4, backlog=files)
+        )
+        await asyncio.sleep(0.3)
+        engine.cancel()
+        cancelled = time.monotonic()
+        with pytest.raises(asyncio.CancelledError):
+            await engine
+        return time.monotonic() - cancelled
+
+    assert asyncio.run(asyncio.wait_for(main(), 30)) < 2
+    # only what was in flight finished after the cancel
+    assert 0 < len(pipeline.processed) < 400
+
+
+class SizeRecorder:
+    def __init__(self):
+        self.uploaded = []
+
+    def upload(self, absolute_path, key, stat):
+        self.uploaded.append((key, stat.st_size))
+        return {"ETag": '"etag"'}
+
+
+def test_file_still_being_written_into_a_new_directory_is_uploaded_once(tmp_path):
+    chunk = b"x" * 100 * 1024
+    path = tmp_path / "alice" / "big.dat"
+    first_chunk = threading.Event()
+
+    def write_slowly():
+        with open(path, "wb") as fp:
+            time.sleep(0.05)  # past the watch, even on a coarse mtime clock
+            fp.write(chunk)
+            fp.flush()
+            first_chunk.set()
+            for _ in range(19):
+                time.sleep(0.02)
+                fp.write(chunk)
+
+    class WriterWatcher:
+        """Starts the writer once the new directory is watched, before it is
+        scanned, the way a client does that uploads as soon as it can."""
+
+        def __init__(self):
+            self.watcher = NativeTreeWatcher(str(tmp_path))
+
+        def events(self):
+            for kind, absolute_path, watched in self.watcher.events():
+                if kind == NEW_DIRECTORY:
+                    threading.Thread(target=write_slowly).start()
+                    assert first_chunk.wait(5)
+                yield kind, absolute_path, watched
+                if kind == CLOSED:
+                    return
+
+    uploader = SizeRecorder()
+    pipeline = Pipeline(uploader, KeyMapper(str(tmp_path)))
+    consumer = threading.Thread(target=run_sync, args=(pipeline, WriterWatcher()))
+    consumer.start()
+    os.makedirs(tmp_path / "alice")
+    consumer.join(10)
+    time.sleep(0.2)  # anything the scanner found has been uploaded by now
+
+    assert uploader.uploaded == [("alice/big.dat", 20 * len(chunk))]
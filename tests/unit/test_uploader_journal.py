@@ -0,0 +1,48 @@
+import os
+
+from uploader.journal import DONE, UploadJournal
+
+
+def write(path, data=b"x"):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as fp:
+        fp.write(data)
+
+
+def test_reconcile_skips_only_unchanged_uploads(tmp_path):
+    root = str(tmp_path / "share")
+    done = os.path.join(root, "done.dat")
+    changed = os.path.join(root, "alice", "changed.dat")
+    unfinished = os.path.join(root, "alice", "unfinished.dat")
+    new = os.path.join(root, "bob", "new.dat")
+    for path in (done, changed, unfinished, new):
+        write(path)
+
+    journal = UploadJournal(str(tmp_path / "journal.db"))
+    journal.completed(done, os.stat(done), '"etag"')
+    journal.completed(changed, os.stat(changed), '"etag"')
+    journal.started(unfinished, os.stat(unfinished))
+    write(changed, b"rewritten while we were down")
+
+    assert sorted(journal.reconcile(root)) == sorted([changed, unfinished, new])
+    journal.close()
+
+
+def test_reconcile_filters_and_forgets_deleted_files(tmp_path):
+    root = str(tmp_path)
+    kept = os.path.join(root, "kept.csv")
+    gone = os.path.join(root, "gone.csv")
+    write(kept)
+    write(os.path.join(root, "ignored.tmp"))
+
+    journal = UploadJournal(str(tmp_path / "journal.db"))
+    journal.completed(gone, os.stat(kept))
+
+    found = list(journal.reconcile(root, wanted=lambda name: name.endswith(".csv")))
+    assert found == [kept]
+    assert "gone.csv" not in journal._rows_for(root)
+
+    journal.completed(kept, os.stat(kept))
+    assert journal._rows_for(root)["kept.csv"][2] == DONE
+    assert list(journal.reconcile(root, wanted=lambda name: name.endswith(".csv"))) == []
+    journal.close()
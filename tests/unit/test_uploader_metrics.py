@@ -0,0 +1,65 @@
+import json
+
+from uploader.keys import KeyMapper
+from uploader.metrics import Registry, UploaderMetrics
+from uploader.pipeline import Pipeline
+
+
+class Pending:
+    """Stands in for the debouncer: every path has a newer write settling."""
+
+    def pending(self, path):
+        return True
+
+
+def test_render_and_snapshot():
+    registry = Registry()
+    registry.counter("files_total", "files").inc(3)
+    registry.gauge("queued", "queued files", lambda: 7)
+    latency = registry.histogram("upload_seconds", "latency", buckets=(0.1, 1))
+    for value in (0.05, 0.5, 5):
+        latency.observe(value)
+
+    assert registry.render().splitlines() == [
+        "# HELP files_total files",
+        "# TYPE files_total counter",
+        "files_total 3",
+        "# HELP queued queued files",
+        "# TYPE queued gauge",
+        "queued 7",
+        "# HELP upload_seconds latency",
+        "# TYPE upload_seconds histogram",
+        'upload_seconds_bucket{le="0.1"} 1',
+        'upload_seconds_bucket{le="1"} 2',
+        'upload_seconds_bucket{le="+Inf"} 3',
+        "upload_seconds_sum 5.55",
+        "upload_seconds_count 3",
+    ]
+    snapshot = json.loads(json.dumps(registry.snapshot()))
+    assert snapshot["upload_seconds"]["buckets"] == [1, 1, 1]
+
+
+def test_uploaded_observes_lag_once():
+    metrics = UploaderMetrics()
+    metrics.seen("/a")
+    metrics.uploaded("/a", 10, 0.2)
+    metrics.uploaded("/a", 10, 0.2)  # a retry, no longer in first_seen
+    assert metrics.lag.count == 1
+    assert metrics.bytes_sent.value == 20
+    assert metrics.first_seen == {}
+
+
+def test_files_that_are_not_uploaded_are_forgotten(tmp_path):
+    metrics = UploaderMetrics()
+    pipeline = Pipeline(None, KeyMapper(str(tmp_path)), metrics=metrics)
+
+    gone = str(tmp_path / "gone")
+    assert pipeline.accept(gone)
+    assert not pipeline.process(gone)
+
+    settling = str(tmp_path / "settling")
+    assert pipeline.accept(settling)
+    pipeline.debouncer = Pending()
+    assert not pipeline.process(settling)
+
+    assert metrics.first_seen == {}
@@ -0,0 +1,97 @@
+import os
+from collections import Counter
+
+import pytest
+
+from uploader import multipart
+from uploader.multipart import MAX_PARTS, MB, _part_size_for, upload_file
+
+
+class FakeS3:
+    def __init__(self, failures=None):
+        self.failures = failures or {}  # part number -> times it fails
+        self.attempts = Counter()
+        self.objects = {}
+        self.uploads = {}
+        self.aborted = []
+
+    def put_object(self, Bucket, Key, Body, Tagging, **kwargs):
+        self.objects[Key] = Body.read()
+        return {"ETag": '"put"'}
+
+    def create_multipart_upload(self, Bucket, Key, **kwargs):
+        self.uploads["1"] = {}
+        return {"UploadId": "1"}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body):
+        self.attempts[PartNumber] += 1
+        if self.failures.get(PartNumber, 0) >= self.attempts[PartNumber]:
+            raise ConnectionResetError(f"part {PartNumber}")
+        self.uploads[UploadId][PartNumber] = Body
+        return {"ETag": f'"{PartNumber}"'}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        parts = self.uploads.pop(UploadId)
+        numbers = [part["PartNumber"] for part in MultipartUpload["Parts"]]
+        assert numbers == sorted(parts)
+        self.objects[Key] = b"".join(parts[n] for n in numbers)
+        return {"ETag": '"multipart"'}
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId):
+        self.uploads.pop(UploadId)
+        self.aborted.append(UploadId)
+
+
+@pytest.fixture
+def data_file(tmp_path, monkeypatch):
+    monkeypatch.setattr(multipart, "MIN_PART_SIZE", 1024)
+    monkeypatch.setattr(multipart.time, "sleep", lambda seconds: None)
+    path = tmp_path / "data.bin"
+    path.write_bytes(os.urandom(3000))  # three parts of 1024
+    return str(path)
+
+
+@pytest.mark.parametrize("threshold, etag", [(3001, '"put"'), (3000, '"multipart"')])
+def test_threshold_picks_put_or_multipart(data_file, threshold, etag):
+    s3 = FakeS3()
+    response = upload_file(
+        s3, "bucket", "key", data_file, threshold=threshold, part_size=1024
+    )
+    assert response["ETag"] == etag
+    with open(data_file, "rb") as fp:
+        assert s3.objects["key"] == fp.read()
+
+
+def test_part_size_grows_past_ten_thousand_parts():
+    assert _part_size_for(100 * MB, 16 * MB) == 16 * MB
+    assert _part_size_for(100 * MB, 1) == 5 * MB  # never below the S3 minimum
+
+    size = MAX_PARTS * 16 * MB + 1
+    part_size = _part_size_for(size, 16 * MB)
+    assert part_size > 16 * MB
+    assert -(-size // part_size) <= MAX_PARTS
+
+
+def test_a_failed_part_is_retried_on_its_own(data_file):
+    s3 = FakeS3(failures={2: 2})
+    response = upload_file(s3, "bucket", "key", data_file, threshold=0, part_size=1024)
+    assert response["ETag"] == '"multipart"'
+    assert s3.attempts == {1: 1, 2: 3, 3: 1}
+    assert s3.aborted == []
+
+
+def test_upload_is_aborted_when_a_part_keeps_failing(data_file):
+    s3 = FakeS3(failures={2: 10})
+    with pytest.raises(ConnectionResetError):
+        upload_file(
+            s3,
+            "bucket",
+            "key",
+            data_file,
+            threshold=0,
+            part_size=1024,
+            part_retries=2,
+        )
+    assert s3.attempts[2] == 3
+    assert s3.aborted == ["1"]
+    assert "key" not in s3.objects
@@ -0,0 +1,143 @@
+import os
+import time
+
+from uploader import journal as upload_journal
+from uploader import retry
+from uploader.engines import run_threads
+from uploader.filters import SuffixFilter
+from uploader.journal import UploadJournal
+from uploader.keys import KeyMapper
+from uploader.pipeline import Pipeline
+from uploader.retry import RetryScheduler
+from uploader.watcher import CLOSED
+
+
+class FakeUploader:
+    def __init__(self, error=None):
+        self.error = error
+        self.uploaded = []
+
+    def upload(self, absolute_path, key, stat):
+        if self.error:
+            raise self.error
+        self.uploaded.append((key, stat.st_size))
+        return {"ETag": '"etag"'}
+
+
+class Delete:
+    """Removes the local copy, like VerifiedDelete without asking S3."""
+
+    def __init__(self, journal=None):
+        self.journal = journal
+
+    def __call__(self, absolute_path, key, stat, response):
+        os.remove(absolute_path)
+        if self.journal:
+            self.journal.forget(absolute_path)
+
+
+def journal_state(journal, path):
+    directory, name = os.path.split(path)
+    return journal._rows_for(directory)[name][2]
+
+
+def test_suffix_filter_and_key_mapper():
+    wanted = SuffixFilter(".csv")
+    assert wanted("report.CSV")
+    assert not wanted("report.csv.tmp")
+    assert SuffixFilter("")("anything")
+
+    assert KeyMapper("/share", "incoming")("/share/a/b.csv") == "incoming/a/b.csv"
+    assert KeyMapper("/share/")("/share/a//b.csv") == "a/b.csv"
+
+
+def test_process_uploads_then_runs_post_actions(tmp_path):
+    root = tmp_path / "share"
+    (root / "sub").mkdir(parents=True)
+    path = str(root / "sub" / "data.csv")
+    with open(path, "wb") as fp:
+        fp.write(b"x" * 10)
+
+    journal = UploadJournal(str(tmp_path / "journal.db"))
+    uploader = FakeUploader()
+    pipeline = Pipeline(
+        uploader,
+        KeyMapper(str(root), "prefix"),
+        file_filter=SuffixFilter(".csv"),
+        post_actions=[Delete(journal=journal)],
+        journal=journal,
+    )
+
+    assert not pipeline.accept(str(root / "sub" / "data.txt"))
+    assert pipeline.accept(path)
+    assert journal_state(journal, path) == upload_journal.PENDING
+
+    assert pipeline.process(path)
+    assert uploader.uploaded == [("prefix/sub/data.csv", 10)]
+    assert not os.path.exists(path)
+    assert journal._rows_for(os.path.dirname(path)) == {}
+
+    # already deleted: nothing left to upload
+    assert not pipeline.process(path)
+    assert len(uploader.uploaded) == 1
+
+
+def test_failed_upload_is_journaled_and_kept(tmp_path):
+    path = str(tmp_path / "data.csv")
+    with open(path, "wb") as fp:
+        fp.write(b"x")
+
+    journal = UploadJournal(str(tmp_path / "journal.db"))
+    pipeline = Pipeline(
+        FakeUploader(error=OSError("connection reset")),
+        KeyMapper(str(tmp_path)),
+        post_actions=[Delete()],
+        journal=journal,
+    )
+
+    assert not pipeline.process(path)
+    assert os.path.exists(path)
+    assert journal_state(journal, path) == upload_journal.FAILED
+    assert pipeline.metrics.failures.value == 1
+
+
+class ListWatcher:
+    def __init__(self, paths):
+        self.paths = paths
+
+    def events(self):
+        for path in self.paths:
+            yield CLOSED, path, None
+
+
+def test_files_still_settling_at_exit_are_reported(tmp_path, capsys):
+    paths = [str(tmp_path / name) for name in ("a.csv", "b.csv")]
+    uploader = FakeUploader()
+    pipeline = Pipeline(uploader, KeyMapper(str(tmp_path)))
+
+    run_threads(pipeline, ListWatcher(paths), workers=1, settle_ms=60000)
+
+    assert not pipeline.debouncer.thread.is_alive()
+    assert uploader.uploaded == []
+    assert capsys.readouterr().err.splitlines() == [
+        f"not uploaded: {path}" for path in paths
+    ]
+
+
+def test_retries_still_scheduled_at_exit_are_reported(tmp_path, capsys, monkeypatch):
+    monkeypatch.setattr(retry, "backoff", lambda attempt, base, cap: 3600)
+    path = tmp_path / "a.csv"
+    path.write_bytes(b"x")
+    pipeline = Pipeline(FakeUploader(TimeoutError()), KeyMapper(str(tmp_path)))
+    pipeline.retries = RetryScheduler(pipeline.process)
+
+    class FailingWatcher(ListWatcher):
+        def events(self):
+            yield from super().events()
+            # exit only once the upload has failed and its retry is scheduled
+            while not pipeline.retries.heap:
+                time.sleep(0.01)
+
+    run_threads(pipeline, FailingWatcher([str(path)]), workers=1)
+
+    assert capsys.readouterr().err.splitlines() == [f"not uploaded: {path}"]
@@ -0,0 +1,50 @@
+import threading
+
+from uploader.pool import UploadPool
+
+
+class Log:
+    def __init__(self):
+        self.lines = []
+
+    def log(self, message):
+        self.lines.append(message)
+
+
+def test_every_item_is_uploaded_despite_failures():
+    uploaded = []
+    lock = threading.Lock()
+
+    def upload(item):
+        if item % 10 == 0:
+            raise OSError(f"cannot read {item}")
+        with lock:
+            uploaded.append(item)
+
+    logger = Log()
+    pool = UploadPool(upload, workers=4, queue_depth=5, logger=logger)
+    for item in range(100):
+        pool.submit(item)  # blocks while five are queued
+    pool.queue.join()
+    assert pool.shutdown() == []
+
+    assert sorted(uploaded) == [n for n in range(100) if n % 10]
+    assert len(logger.lines) == 10
+
+
+def test_shutdown_returns_what_no_worker_started():
+    release = threading.Event()
+    started = threading.Event()
+
+    def upload(item):
+        started.set()
+        release.wait(5)
+
+    pool = UploadPool(upload, workers=1, queue_depth=10)
+    for item in range(5):
+        pool.submit(item)
+    assert started.wait(5)  # the worker holds item 0
+
+    threading.Timer(0.1, release.set).start()
+    assert pool.shutdown() == [1, 2, 3, 4]
+    assert not pool.in_flight
@@ -0,0 +1,137 @@
+import os
+import threading
+import time
+
+from uploader.journal import DELETING, FAILED, UploadJournal
+from uploader.post import VerifiedDelete
+
+
+class FakeS3:
+    def __init__(self, objects):
+        self.objects = objects  # key -> head_object response
+        self.heads = []
+
+    def head_object(self, Bucket, Key, ChecksumMode):
+        self.heads.append(Key)
+        if Key not in self.objects:
+            raise FileNotFoundError(Key)
+        return self.objects[Key]
+
+
+def write(path, data):
+    path.write_bytes(data)
+    return str(path), os.stat(path)
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+
+def test_only_verified_files_are_deleted(tmp_path):
+    good, good_stat = write(tmp_path / "good", b"12345")
+    short, short_stat = write(tmp_path / "short", b"12345")
+    missing, missing_stat = write(tmp_path / "missing", b"12345")
+    rewritten, rewritten_stat = write(tmp_path / "rewritten", b"12345")
+    bundled, bundled_stat = write(tmp_path / "bundled", b"1")
+
+    s3 = FakeS3(
+        {
+            "good": {"ETag": '"a"', "ContentLength": 5},
+            "short": {"ETag": '"b"', "ContentLength": 4},
+            "rewritten": {"ETag": '"c"', "ContentLength": 5},
+            "bundle.tar": {"ETag": '"d"', "ContentLength": 999},
+        }
+    )
+    deleter = VerifiedDelete(s3, "bucket", batch_wait=0.05)
+    deleter(good, "good", good_stat, {"ETag": '"a"'})
+    deleter(short, "short", short_stat, {"ETag": '"b"'})
+    deleter(missing, "missing", missing_stat, {"ETag": '"x"'})
+    os.utime(rewritten, ns=(0, 0))
+    deleter(rewritten, "rewritten", rewritten_stat, {"ETag": '"c"'})
+    deleter(bundled, "bundled", bundled_stat, {"ETag": '"d"', "Bundle": "bundle.tar"})
+
+    wait_for(lambda: not os.path.exists(bundled))
+    deleter.close()
+
+    assert not os.path.exists(good)
+    assert not os.path.exists(bundled)
+    assert os.path.exists(short)
+    assert os.path.exists(missing)
+    assert os.path.exists(rewritten)
+    assert sorted(set(s3.heads)) == [
+        "bundle.tar",
+        "good",
+        "missing",
+        "rewritten",
+        "short",
+    ]
+
+
+def test_grace_delay(tmp_path):
+    path, stat = write(tmp_path / "f", b"1")
+    s3 = FakeS3({"f": {"ETag": '"a"', "ContentLength": 1}})
+    deleter = VerifiedDelete(s3, "bucket", grace=0.3, batch_wait=0)
+    deleter(path, "f", stat, {"ETag": '"a"'})
+
+    wait_for(lambda: deleter.heap)
+    assert os.path.exists(path)  # verified, waiting out the grace delay
+    wait_for(lambda: not os.path.exists(path))
+    assert not os.path.exists(path)
+
+
+class SlowS3(FakeS3):
+    def __init__(self, objects):
+        super().__init__(objects)
+        self.release = threading.Event()
+
+    def head_object(self, Bucket, Key, ChecksumMode):
+        self.release.wait(5)
+        return super().head_object(Bucket, Key, ChecksumMode)
+
+
+def test_close_finishes_the_batch_being_verified(tmp_path):
+    path, stat = write(tmp_path / "f", b"1")
+    s3 = SlowS3({"f": {"ETag": '"a"', "ContentLength": 1}})
+    deleter = VerifiedDelete(s3, "bucket", batch_wait=0)
+    deleter(path, "f", stat, {"ETag": '"a"'})
+    wait_for(lambda: deleter.queue.empty())  # taken by the verify thread
+
+    threading.Timer(0.2, s3.release.set).start()
+    deleter.close()
+    assert not os.path.exists(path)
+    assert not any(thread.is_alive() for thread in deleter.threads)
+
+
+def test_undeleted_files_stay_in_the_journal(tmp_path):
+    root = tmp_path / "share"
+    root.mkdir()
+    deleted, deleted_stat = write(root / "deleted", b"1")
+    waiting, waiting_stat = write(root / "waiting", b"1")
+    kept, kept_stat = write(root / "kept", b"1")
+    s3 = FakeS3(
+        {
+            "deleted": {"ETag": '"a"', "ContentLength": 1},
+            "waiting": {"ETag": '"a"', "ContentLength": 1},
+        }
+    )
+    journal = UploadJournal(str(tmp_path / "journal.db"))
+    for path, stat in [(deleted, deleted_stat), (waiting, waiting_stat), (kept, kept_stat)]:
+        journal.completed(path, stat, '"a"')
+
+    deleter = VerifiedDelete(s3, "bucket", journal=journal, batch_wait=0)
+    deleter(deleted, "deleted", deleted_stat, {"ETag": '"a"'})
+    deleter(kept, "kept", kept_stat, {"ETag": '"a"'})  # not in S3
+    deleter.close()
+
+    deleter = VerifiedDelete(s3, "bucket", journal=journal, grace=3600, batch_wait=0)
+    deleter(waiting, "waiting", waiting_stat, {"ETag": '"a"'})
+    deleter.close()  # while it waits out the grace delay
+
+    assert not os.path.exists(deleted)
+    assert sorted(journal.reconcile(str(root))) == [kept, waiting]
+    rows = journal._rows_for(str(root))
+    assert "deleted" not in rows
+    assert rows["kept"][2] == FAILED
+    assert rows["waiting"][2] == DELETING
@@ -0,0 +1,88 @@
+import threading
+
+import pytest
+
+from uploader import retry
+from uploader.retry import (
+    BUCKET_MISSING,
+    FATAL,
+    RETRYABLE,
+    RetryScheduler,
+    backoff,
+    classify,
+)
+
+
+class ClientError(Exception):
+    """Shaped like botocore's, which carries the parsed error response."""
+
+    def __init__(self, code, status):
+        super().__init__(code)
+        self.response = {
+            "Error": {"Code": code},
+            "ResponseMetadata": {"HTTPStatusCode": status},
+        }
+
+
+@pytest.mark.parametrize(
+    "exc, kind",
+    [
+        (ClientError("SlowDown", 503), RETRYABLE),
+        (ClientError("InternalError", 500), RETRYABLE),
+        (ClientError("", 429), RETRYABLE),
+        (ClientError("NoSuchBucket", 404), BUCKET_MISSING),
+        (ClientError("AccessDenied", 403), FATAL),
+        (ConnectionResetError(), RETRYABLE),
+        (TimeoutError(), RETRYABLE),
+        (FileNotFoundError(), FATAL),
+    ],
+)
+def test_classify(exc, kind):
+    assert classify(exc) == kind
+
+
+def test_backoff_is_jittered_and_capped():
+    delays = [backoff(3, base=1.0, cap=5.0) for _ in range(200)]
+    assert all(0 <= delay <= 5.0 for delay in delays)
+    assert len(set(delays)) > 1
+    assert all(backoff(20, base=1.0, cap=5.0) <= 5.0 for _ in range(200))
+
+
+def test_scheduler_retries_until_max_attempts(monkeypatch):
+    delays = []
+
+    def no_wait(attempt, base, cap):
+        delays.append(min(cap, base * 2**attempt))
+        return 0
+
+    monkeypatch.setattr(retry, "backoff", no_wait)
+    retried = threading.Semaphore(0)
+    scheduler = RetryScheduler(lambda item: retried.release(), max_attempts=2)
+
+    error = ClientError("SlowDown", 503)
+    assert scheduler.failed("a", error)
+    assert retried.acquire(timeout=5)
+    assert scheduler.failed("a", error)
+    assert retried.acquire(timeout=5)
+    assert not scheduler.failed("a", error)  # third failure: gave up
+    assert delays == [2.0, 4.0]
+
+    assert not scheduler.failed("b", ClientError("AccessDenied", 403))
+    assert scheduler.attempts == {}
+
+
+def test_success_resets_attempts():
+    scheduler = RetryScheduler(lambda item: None, max_attempts=1, base=3600)
+    assert scheduler.failed("a", TimeoutError())
+    scheduler.succeeded("a")
+    assert scheduler.failed("a", TimeoutError())  # a fresh first attempt
+
+
+def test_stop_returns_the_retries_not_yet_run(monkeypatch):
+    monkeypatch.setattr(retry, "backoff", lambda attempt, base, cap: 3600)
+    scheduler = RetryScheduler(lambda item: None)
+    scheduler.failed("b", TimeoutError())
+    scheduler.failed("a", TimeoutError())
+
+    assert scheduler.stop() == ["b", "a"]
+    assert not any(thread.is_alive() for thread in scheduler.threads)
@@ -0,0 +1,90 @@
+import os
+import queue
+from concurrent.futures import ThreadPoolExecutor
+
+from uploader.index import ScanIndex
+from uploader.scan import DirectoryScanner, existing_files
+from uploader.watcher import ScanTreeWatcher
+
+
+def write(path, data=b"x"):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as fp:
+        fp.write(data)
+
+
+def scan(watcher, report=True):
+    with ThreadPoolExecutor(4) as executor:
+        return sorted(watcher.scan(executor, report=report))
+
+
+def test_scan_reports_new_and_changed_files(tmp_path):
+    root = str(tmp_path / "share")
+    write(os.path.join(root, "a.dat"))
+    write(os.path.join(root, "d1", "d2", "b.dat"))
+
+    watcher = ScanTreeWatcher(root, min_age=0)
+    assert scan(watcher, report=False) == []  # baseline
+    assert scan(watcher) == []
+
+    write(os.path.join(root, "d1", "c.dat"))
+    write(os.path.join(root, "a.dat"), b"longer")
+    assert scan(watcher) == [
+        os.path.join(root, "a.dat"),
+        os.path.join(root, "d1", "c.dat"),
+    ]
+    assert scan(watcher) == []
+    assert watcher.scanned_files == 3
+
+
+def test_scan_waits_for_files_to_settle(tmp_path):
+    root = str(tmp_path)
+    watcher = ScanTreeWatcher(root, min_age=3600)
+    scan(watcher, report=False)
+
+    write(os.path.join(root, "young.dat"))
+    assert scan(watcher) == []
+
+    watcher.min_age = 0
+    assert scan(watcher) == [os.path.join(root, "young.dat")]
+
+
+def test_index_persists_and_prunes_removed_directories(tmp_path):
+    root = str(tmp_path / "share")
+    write(os.path.join(root, "keep", "a.dat"))
+    write(os.path.join(root, "gone", "b.dat"))
+    path = str(tmp_path / "index.db")
+
+    watcher = ScanTreeWatcher(root, index=ScanIndex(path), min_age=0)
+    scan(watcher, report=False)
+    watcher.index.close()
+
+    os.remove(os.path.join(root, "gone", "b.dat"))
+    os.rmdir(os.path.join(root, "gone"))
+    write(os.path.join(root, "keep", "new.dat"))
+
+    # a restart only reports what changed while it was down
+    index = ScanIndex(path)
+    assert not index.empty()
+    watcher = ScanTreeWatcher(root, index=index, min_age=0)
+    assert scan(watcher) == [os.path.join(root, "keep", "new.dat")]
+    assert index.rows(os.path.join(root, "gone")) == {}
+
+
+def test_directory_scanner_finds_files_written_before_the_watch(tmp_path):
+    root = str(tmp_path / "alice")
+    write(os.path.join(root, "a.dat"))
+    write(os.path.join(root, "deep", "b.dat"))
+    assert sorted(existing_files(root)) == [
+        os.path.join(root, "a.dat"),
+        os.path.join(root, "deep", "b.dat"),
+    ]
+    assert list(existing_files(str(tmp_path / "missing"))) == []
+
+    found = queue.Queue()
+    scanner = DirectoryScanner(found.put)
+    scanner.submit(root)
+    assert sorted(found.get(timeout=5) for _ in range(2)) == [
+        os.path.join(root, "a.dat"),
+        os.path.join(root, "deep", "b.dat"),
+    ]
@@ -0,0 +1,88 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from uploader.index import ScanIndex
+from uploader.shard import HashRing, Shard, ShardedWatcher
+from uploader.watcher import CLOSED, NEW_DIRECTORY, ScanTreeWatcher
+
+USERS = [f"user{n:03}" for n in range(60)]
+
+
+def make_tree(root):
+    for user in USERS:
+        os.makedirs(os.path.join(root, user, "in"))
+        for name in ("a.dat", os.path.join("in", "b.dat")):
+            with open(os.path.join(root, user, name), "wb") as fp:
+                fp.write(b"x")
+
+
+def scan(watcher):
+    with ThreadPoolExecutor(4) as executor:
+        return set(watcher.scan(executor))
+
+
+def test_ring_is_consistent():
+    users = [f"user{n}" for n in range(5000)]
+    four = HashRing(["0", "1", "2", "3"])
+    owners = {user: four.owner(user) for user in users}
+
+    shares = [list(owners.values()).count(node) for node in "0123"]
+    assert min(shares) > 0.15 * len(users)
+
+    five = HashRing(["0", "1", "2", "3", "4"])
+    moved = [user for user in users if five.owner(user) != owners[user]]
+    assert len(moved) < 0.35 * len(users)
+    assert all(five.owner(user) == "4" for user in moved)  # only to the new node
+
+
+def test_nodes_split_the_tree_and_rebalance(tmp_path):
+    root = str(tmp_path)
+    make_tree(root)
+    everything = {
+        os.path.join(root, user, name)
+        for user in USERS
+        for name in ("a.dat", os.path.join("in", "b.dat"))
+    }
+
+    indexes = [ScanIndex() for _ in range(4)]
+
+    def run(node_count):
+        return [
+            scan(
+                ScanTreeWatcher(
+                    root, indexes[n], min_age=0, owns=Shard(root, n, node_count)
+                )
+            )
+            for n in range(node_count)
+        ]
+
+    seen = run(3)
+    assert set().union(*seen) == everything
+    assert sum(len(paths) for paths in seen) == len(everything)  # no overlap
+
+    # a fourth node takes users only; they are new to its index, so it
+    # uploads all of their files, and nothing else is reported again
+    seen = run(4)
+    assert seen[:3] == [set(), set(), set()]
+    ring = HashRing(["0", "1", "2", "3"])
+    assert seen[3] == {
+        path
+        for path in everything
+        if ring.owner(os.path.relpath(path, root).split(os.sep)[0]) == "3"
+    }
+
+
+def test_sharded_watcher(tmp_path):
+    root = str(tmp_path)
+
+    class Watcher:
+        def events(self):
+            for user in USERS:
+                yield NEW_DIRECTORY, os.path.join(root, user), {}
+                yield CLOSED, os.path.join(root, user, "f.dat"), None
+
+    shards = [Shard(root, n, 2) for n in range(2)]
+    events = [list(ShardedWatcher(Watcher(), shard).events()) for shard in shards]
+    assert len(events[0]) + len(events[1]) == 2 * len(USERS)
+    for kind, path, _ in events[0]:
+        assert not shards[1](path)
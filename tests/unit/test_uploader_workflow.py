@@ -0,0 +1,76 @@
+import gzip
+import os
+
+import pytest
+
+boto3 = pytest.importorskip("boto3")
+moto = pytest.importorskip("moto")
+
+from uploader.workflow import WorkflowStep
+
+
+class FakeTransfer:
+    def __init__(self):
+        self.states = []
+
+    def send_workflow_step_state(self, **kwargs):
+        self.states.append(kwargs)
+
+
+def event(path):
+    return {
+        "token": "t0ken",
+        "serviceMetadata": {
+            "executionDetails": {"workflowId": "w-1", "executionId": "e-1"},
+            "transferDetails": {"userName": "alice", "serverId": "s-1"},
+        },
+        "fileLocation": {"domain": "EFS", "fileSystemId": "fs-1", "path": path},
+    }
+
+
+@pytest.fixture
+def s3(monkeypatch):
+    for name in ("AWS_ACCESS_KEY_ID", "AWS_SECRET_ACCESS_KEY", "AWS_SESSION_TOKEN"):
+        monkeypatch.setenv(name, "testing")
+    with moto.mock_aws():
+        client = boto3.client("s3", region_name="us-east-1")
+        client.create_bucket(Bucket="bucket")
+        yield client
+
+
+def test_copies_compresses_and_reports(tmp_path, s3):
+    os.makedirs(tmp_path / "alice")
+    (tmp_path / "alice" / "data.bin").write_bytes(b"\0" * 1000)
+    (tmp_path / "alice" / "app.log").write_bytes(b"line\n" * 1000)
+
+    transfer = FakeTransfer()
+    step = WorkflowStep(
+        s3,
+        transfer,
+        "bucket",
+        prefix="in",
+        compress=[".log=gzip"],
+        mount_path=str(tmp_path),
+    )
+    assert step(event("/alice/data.bin"))["status"] == "SUCCESS"
+    assert step(event("/alice/app.log"))["status"] == "SUCCESS"
+
+    assert (
+        s3.get_object(Bucket="bucket", Key="in/alice/data.bin")["Body"].read()
+        == b"\0" * 1000
+    )
+    log = s3.get_object(Bucket="bucket", Key="in/alice/app.log")
+    assert log["ContentEncoding"] == "gzip"
+    assert gzip.decompress(log["Body"].read()) == b"line\n" * 1000
+    tags = s3.get_object_tagging(Bucket="bucket", Key="in/alice/app.log")["TagSet"]
+    assert {"Key": "compression", "Value": "gzip"} in tags
+
+    assert [state["Status"] for state in transfer.states] == ["SUCCESS", "SUCCESS"]
+    assert transfer.states[0]["Token"] == "t0ken"
+
+
+def test_failure_is_reported(tmp_path, s3):
+    transfer = FakeTransfer()
+    step = WorkflowStep(s3, transfer, "bucket", mount_path=str(tmp_path))
+    assert step(event("/alice/missing.dat"))["status"] == "FAILURE"
+    assert transfer.states[0]["Status"] == "FAILURE"
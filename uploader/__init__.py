@@ -0,0 +1,11 @@
+"""Watches a directory tree (the EFS share) and copies closed files to S3.
+
+The work is split into stages that can be swapped or benchmarked one at a
+time:
+
+    watcher -> filter -> key mapper -> uploader -> post-actions
+
+uploader.pipeline.Pipeline runs one file through the stages, the engines
+in uploader.engines and uploader.async_engine feed it from a watcher, and
+uploader.cli wires it all up from the command line (python -m uploader).
+"""
@@ -0,0 +1,181 @@
+import asyncio
+import concurrent.futures
+import os.path
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from uploader.debounce import Debouncer
+from uploader.native_inotify import (
+    IN_CLOSE_WRITE,
+    IN_CREATE,
+    IN_ISDIR,
+    IN_MOVED_TO,
+    IN_Q_OVERFLOW,
+    InotifyReader,
+)
+from uploader.scan import existing_files
+
+
+async def run(pipeline, root_directory, concurrency=64, settle_ms=0, backlog=None):
+    """Watch root_directory and run closed files through pipeline concurrently.
+
+    pipeline.process is the same blocking call the threaded engine makes.
+    It runs on a private thread pool, at most concurrency at a time, so the
+    event loop keeps draining inotify while uploads are in flight. With
+    settle_ms, closed files are only processed once they have settled.
+    backlog is an iterable of paths to process as well (typically
+    UploadJournal.reconcile); it is consumed on a thread of its own once
+    the watches are in place, so nothing written in between is missed, and
+    through a bounded queue, so a backlog of millions of files never has
+    more than concurrency uploads waiting at a time. Whatever is left of
+    it when the run is cancelled is dropped; the journal still has it.
+    """
+
+    logger = pipeline.logger
+    metrics = pipeline.metrics
+
+    loop = asyncio.get_running_loop()
+    loop.set_default_executor(ThreadPoolExecutor(max_workers=concurrency))
+
+    watcher = InotifyReader(root_directory)
+    readable = asyncio.Event()
+    loop.add_reader(watcher.fd, readable.set)
+
+    semaphore = asyncio.Semaphore(concurrency)
+    tasks = set()
+
+    metrics.gauge("uploader_tasks", "uploads queued or in progress", tasks.__len__)
+
+    def start_upload(absolute_path):
+        task = asyncio.create_task(upload_one(absolute_path))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+
+    debouncer = None
+    if settle_ms:
+        # settled paths come back from the debouncer's thread
+        debouncer = Debouncer(
+            lambda path: loop.call_soon_threadsafe(start_upload, path),
+            settle_ms=settle_ms,
+            logger=logger,
+        )
+        pipeline.debouncer = debouncer
+        enqueue = debouncer.touch
+    else:
+        enqueue = start_upload
+
+    async def scan_new_directory(directory, watched):
+        # anything closed before the watch was added never raises an event
+        found = await loop.run_in_executor(
+            None, list, existing_files(directory, watched)
+        )
+        for absolute_path in found:
+            if pipeline.wanted(os.path.basename(absolute_path)):
+                enqueue(absolute_path)
+
+    async def process(absolute_path):
+        try:
+            await loop.run_in_executor(None, pipeline.process, absolute_path)
+        except Exception as e:
+            logger.log(f"upload of {absolute_path} failed with exception {e}")
+
+    async def upload_one(absolute_path):
+        async with semaphore:
+            await process(absolute_path)
+
+    stop_backlog = threading.Event()
+
+    async def drain_backlog():
+        queue = asyncio.Queue(maxsize=concurrency)
+
+        def put(item):
+            """False if the run is over and item was not queued."""
+            future = asyncio.run_coroutine_threadsafe(queue.put(item), loop)
+            while not stop_backlog.is_set():
+                try:
+                    future.result(0.1)
+                    return True
+                except concurrent.futures.TimeoutError:
+                    continue
+                except concurrent.futures.CancelledError:
+                    break  # the loop is shutting down
+            future.cancel()
+            return False
+
+        def produce():
+            # a thread of its own, not the executor's: it blocks while the
+            # queue is full, and the uploads it waits for need those threads
+            for absolute_path in backlog:
+                if not put(absolute_path):
+                    return
+            put(None)
+
+        threading.Thread(target=produce, name="backlog", daemon=True).start()
+        while True:
+            absolute_path = await queue.get()
+            if absolute_path is None:
+                break
+            # wait for a free upload slot before making the next task; the
+            # files were closed before we started, so they skip --settle-ms
+            await semaphore.acquire()
+            task = asyncio.create_task(process(absolute_path))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+            task.add_done_callback(lambda _: semaphore.release())
+
+    drain = None
+    if backlog is not None:
+        drain = asyncio.create_task(drain_backlog())
+
+    try:
+        while True:
+            await readable.wait()
+            readable.clear()
+
+            events = watcher.read_events()
+            metrics.events.inc(len(events))
+
+            for event in events:
+                mask = event.mask
+                if mask & IN_Q_OVERFLOW:
+                    logger.log("inotify queue overflowed, events were lost")
+                    continue
+
+                if mask & IN_ISDIR:
+                    if mask & (IN_CREATE | IN_MOVED_TO):
+                        new_directory = os.path.join(event.directory, event.name)
+                        watched = watcher.add_tree(new_directory)
+                        task = asyncio.create_task(
+                            scan_new_directory(new_directory, watched)
+                        )
+                        tasks.add(task)
+                        task.add_done_callback(tasks.discard)
+                    continue
+
+                if not (mask & IN_CLOSE_WRITE):
+                    continue  # we only care about IN_CLOSE_WRITE events
+
+                absolute_path = os.path.normpath(f"{event.directory}/{event.name}")
+                if pipeline.accept(absolute_path):
+                    enqueue(absolute_path)
+
+    finally:
+        loop.remove_reader(watcher.fd)
+        watcher.close()
+        # stop taking from the backlog, but let in-flight uploads finish
+        # before the loop shuts down
+        stop_backlog.set()
+        if debouncer is not None:
+            for absolute_path in debouncer.stop():
+                print(f"not uploaded: {absolute_path}", file=sys.stderr)
+        if drain is not None:
+            drain.cancel()
+            await asyncio.gather(drain, return_exceptions=True)
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+        if pipeline.retries is not None:
+            # waits for retries already running, off the loop
+            retrying = await loop.run_in_executor(None, pipeline.retries.stop)
+            for absolute_path in retrying:
+                print(f"not uploaded: {absolute_path}", file=sys.stderr)
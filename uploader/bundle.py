@@ -0,0 +1,288 @@
+import gzip
+import io
+import json
+import os.path
+import socket
+import tarfile
+import threading
+import time
+
+from uploader.pipeline import DEFERRED
+
+try:
+    import zstandard  # https://pypi.org/project/zstandard/
+except ImportError:
+    zstandard = None
+
+KB = 1024
+MB = 1024 * 1024
+
+DEFAULT_THRESHOLD = 16 * KB
+DEFAULT_MAX_BYTES = 16 * MB
+DEFAULT_MAX_AGE = 30.0
+
+SUFFIXES = {"zstd": ".tar.zst", "gzip": ".tar.gz", "none": ".tar"}
+INDEX_SUFFIX = ".index.json"
+
+
+def _compressor(compression, raw):
+    if compression == "zstd":
+        if zstandard is None:
+            raise ValueError("zstd bundles need the zstandard package")
+        return zstandard.ZstdCompressor().stream_writer(raw, closefd=False)
+    if compression == "gzip":
+        return gzip.GzipFile(fileobj=raw, mode="wb", mtime=0)
+    return raw
+
+
+def _decompressor(compression, raw):
+    if compression == "zstd":
+        if zstandard is None:
+            raise ValueError("zstd bundles need the zstandard package")
+        return zstandard.ZstdDecompressor().stream_reader(raw)
+    if compression == "gzip":
+        return gzip.GzipFile(fileobj=raw, mode="rb")
+    return raw
+
+
+class Bundle:
+    """One tar archive being filled in memory, compressed as it is written."""
+
+    def __init__(self, key, compression):
+        self.key = key
+        self.compression = compression
+        self.raw = io.BytesIO()
+        self.stream = _compressor(compression, self.raw)
+        self.tar = tarfile.open(
+            fileobj=self.stream, mode="w|", format=tarfile.PAX_FORMAT
+        )
+        self.members = []  # (absolute_path, stat, index entry)
+        self.size = 0  # uncompressed bytes of file data
+        self.started = time.monotonic()
+
+    def add(self, absolute_path, key, stat, data):
+        info = tarfile.TarInfo(key)
+        info.size = len(data)
+        info.mtime = stat.st_mtime
+        info.mode = stat.st_mode & 0o7777
+        offset = self.tar.offset  # of the header, in the uncompressed tar
+        self.tar.addfile(info, io.BytesIO(data))
+        self.members.append(
+            (
+                absolute_path,
+                stat,
+                {
+                    "key": key,
+                    "path": absolute_path,
+                    "size": len(data),
+                    "mtime_ns": stat.st_mtime_ns,
+                    "offset": offset,
+                },
+            )
+        )
+        self.size += len(data)
+
+    def close(self):
+        """Finish the archive; returns its compressed bytes."""
+        self.tar.close()
+        if self.stream is not self.raw:
+            self.stream.close()
+        return self.raw.getvalue()
+
+    def index(self):
+        return {
+            "bundle": self.key,
+            "compression": self.compression,
+            "files": [entry for _, _, entry in self.members],
+        }
+
+
+class BundlingUploader:
+    """The upload stage with small files packed into bundles (--bundle-threshold).
+
+    Files of at least threshold bytes go straight to the wrapped uploader.
+    Smaller ones are read into a tar archive that is compressed as it
+    grows, and upload() returns DEFERRED. A bundle is sent once it holds
+    max_bytes of file data or its oldest file is max_age seconds old,
+    followed by a side-car JSON index (bundle key + .index.json) listing
+    each file's S3 key, size, mtime and offset in the tar, so single files
+    can be found and pulled back out with extract().
+
+    finished(path, stat, response) and failed(path, stat, exception) are
+    called for every file in the bundle once it has been sent; the
+    pipeline attaches them after it is built.
+    """
+
+    def __init__(
+        self,
+        uploader,
+        s3_client,
+        bucket,
+        prefix="",
+        threshold=DEFAULT_THRESHOLD,
+        max_bytes=DEFAULT_MAX_BYTES,
+        max_age=DEFAULT_MAX_AGE,
+        compression="zstd" if zstandard else "gzip",
+        metrics=None,
+        logger=None,
+    ):
+        if compression not in SUFFIXES:
+            raise ValueError(f"unknown bundle compression {compression}")
+        if compression == "zstd" and zstandard is None:
+            raise ValueError("zstd bundles need the zstandard package")
+
+        self.uploader = uploader
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.prefix = prefix
+        self.threshold = threshold
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.compression = compression
+        self.metrics = metrics
+        self.logger = logger
+
+        self.finished = None
+        self.failed = None
+
+        self.hostname = socket.gethostname()
+        self.sequence = 0
+        self.bundle = None
+        self.full = []  # bundles waiting to be sent
+        self.sending = None  # the bundle the bundler thread is sending
+        self.condition = threading.Condition()
+        self.bundles_sent = (
+            metrics.counter("uploader_bundles_total", "bundles sent to S3")
+            if metrics
+            else None
+        )
+        self.thread = threading.Thread(target=self._run, name="bundler", daemon=True)
+        self.thread.start()
+
+    def _log(self, message):
+        if self.logger:
+            self.logger.log(message)
+
+    def _next_key(self):
+        self.sequence += 1
+        name = time.strftime("%Y/%m/%d/%H%M%S", time.gmtime())
+        key = f"_bundles/{name}-{self.hostname}-{os.getpid()}-{self.sequence}"
+        if self.prefix:
+            key = f"{self.prefix}/{key}"
+        return key + SUFFIXES[self.compression]
+
+    def upload(self, absolute_path, key, stat):
+        if stat.st_size >= self.threshold:
+            return self.uploader.upload(absolute_path, key, stat)
+
+        with open(absolute_path, "rb") as fp:
+            data = fp.read()
+
+        with self.condition:
+            if self.bundle is None:
+                self.bundle = Bundle(self._next_key(), self.compression)
+            self.bundle.add(absolute_path, key, stat, data)
+            self._log(f"bundling {absolute_path} into {self.bundle.key}")
+            if self.bundle.size >= self.max_bytes:
+                self.full.append(self.bundle)
+                self.bundle = None
+            self.condition.notify()
+        return DEFERRED
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while not self.full:
+                    if self.bundle is not None:
+                        age = time.monotonic() - self.bundle.started
+                        if age >= self.max_age:
+                            self.full.append(self.bundle)
+                            self.bundle = None
+                            break
+                        self.condition.wait(self.max_age - age)
+                    else:
+                        self.condition.wait()
+                bundle = self.sending = self.full.pop(0)
+            try:
+                self._send(bundle)
+            finally:
+                with self.condition:
+                    self.sending = None
+                    self.condition.notify_all()
+
+    def _send(self, bundle):
+        started = time.monotonic()
+        try:
+            body = bundle.close()
+            response = self.s3_client.put_object(
+                Bucket=self.bucket,
+                Key=bundle.key,
+                Body=body,
+                Metadata={"files": str(len(bundle.members))},
+            )
+            self.s3_client.put_object(
+                Bucket=self.bucket,
+                Key=bundle.key + INDEX_SUFFIX,
+                Body=json.dumps(bundle.index()).encode(),
+                ContentType="application/json",
+            )
+        except Exception as e:
+            self._log(f"sending bundle {bundle.key} failed with exception {e}")
+            for absolute_path, stat, _ in bundle.members:
+                if self.failed:
+                    self.failed(absolute_path, stat, e)
+            return
+
+        seconds = time.monotonic() - started
+        self._log(
+            f"sent {len(bundle.members)} files in s3://{self.bucket}/{bundle.key}"
+        )
+        if self.bundles_sent:
+            self.bundles_sent.inc()
+        for absolute_path, stat, entry in bundle.members:
+            if self.metrics:
+                self.metrics.uploaded(absolute_path, entry["size"], seconds)
+            if self.finished:
+                # post actions verify against the bundle, not the file's key
+                self.finished(absolute_path, stat, dict(response, Bundle=bundle.key))
+
+    def close(self):
+        """Send whatever is still being bundled, on the calling thread.
+
+        Also waits for the bundle the bundler thread is sending, so every
+        file has been finished or failed when close() returns.
+        """
+
+        with self.condition:
+            bundles = self.full + ([self.bundle] if self.bundle else [])
+            self.full = []
+            self.bundle = None
+        for bundle in bundles:
+            self._send(bundle)
+        with self.condition:
+            while self.sending is not None:
+                self.condition.wait()
+
+
+def extract(s3_client, bucket, bundle_key, key, destination):
+    """Pull one file (by its S3 key) out of a bundle and write it to destination."""
+
+    index = json.loads(
+        s3_client.get_object(Bucket=bucket, Key=bundle_key + INDEX_SUFFIX)[
+            "Body"
+        ].read()
+    )
+    body = s3_client.get_object(Bucket=bucket, Key=bundle_key)["Body"]
+    stream = _decompressor(index["compression"], body)
+
+    found = None
+    with tarfile.open(fileobj=stream, mode="r|") as tar:
+        for info in tar:
+            if info.name == key:
+                # the last copy wins if it was bundled more than once
+                found = tar.extractfile(info).read()
+    if found is None:
+        raise KeyError(f"{key} is not in {bundle_key}")
+
+    with open(destination, "wb") as fp:
+        fp.write(found)
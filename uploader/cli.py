@@ -0,0 +1,308 @@
+import argparse
+import asyncio
+
+from uploader import async_engine, bundle, engines, fair, multipart
+from uploader.compress import CompressionRules
+from uploader.dedup import Deduplicator
+from uploader.filters import SuffixFilter
+from uploader.index import ScanIndex
+from uploader.journal import UploadJournal
+from uploader.keys import KeyMapper
+from uploader.log import SilentLogger, VerboseLogger
+from uploader.metrics import UploaderMetrics
+from uploader.pipeline import Pipeline
+from uploader.post import VerifiedDelete
+from uploader.retry import RetryScheduler
+from uploader.s3 import S3Uploader, make_client
+from uploader.shard import Shard, ShardedWatcher
+from uploader.watcher import InotifyTreeWatcher, NativeTreeWatcher, ScanTreeWatcher
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="python -m uploader")
+    parser.add_argument("--directory", dest="directory", required=True)
+    parser.add_argument("--s3bucket", dest="s3bucket", required=True)
+    parser.add_argument("--s3prefix", dest="s3prefix", required=False, default="")
+    parser.add_argument("--suffix", dest="suffix", required=False, default="")
+    parser.add_argument("--delete-after-upload", action="store_true", default=False)
+    parser.add_argument(
+        "--delete-grace", dest="delete_grace", type=float, default=0
+    )  # seconds between verifying an upload and deleting the local copy
+    parser.add_argument(
+        "--delete-workers", dest="delete_workers", type=int, default=4
+    )  # HEADs and unlinks in flight
+    parser.add_argument("--verbose", action="store_true", default=False)
+    parser.add_argument(
+        "--engine",
+        dest="engine",
+        choices=["sync", "threads", "async"],
+        default="threads",
+    )
+    parser.add_argument(
+        "--watch-mode",
+        dest="watch_mode",
+        choices=["inotify", "native", "scan"],
+        default="inotify",
+    )
+    parser.add_argument(
+        "--scan-interval", dest="scan_interval", type=float, default=30
+    )  # seconds
+    parser.add_argument("--scan-walkers", dest="scan_walkers", type=int, default=8)
+    parser.add_argument(
+        "--scan-min-age", dest="scan_min_age", type=float, default=5
+    )  # seconds
+    parser.add_argument("--scan-index", dest="scan_index", required=False, default="")
+    parser.add_argument(
+        "--node-index", dest="node_index", type=int, default=0
+    )  # this node's number in a fleet of --node-count
+    parser.add_argument("--node-count", dest="node_count", type=int, default=1)
+    parser.add_argument(
+        "--schedule", dest="schedule", choices=["fifo", "fair"], default="fifo"
+    )
+    parser.add_argument(
+        "--tenant-weight", dest="tenant_weights", action="append", default=[]
+    )  # NAME=WEIGHT, may be repeated
+    parser.add_argument(
+        "--tenant-rate", dest="tenant_rates", action="append", default=[]
+    )  # NAME=MB/s, may be repeated
+    parser.add_argument(
+        "--tenant-default-rate", dest="tenant_default_rate", type=float, default=0
+    )  # MB/s, 0 for no limit
+    parser.add_argument("--workers", dest="workers", type=int, default=4)
+    parser.add_argument("--queue-depth", dest="queue_depth", type=int, default=100)
+    parser.add_argument("--concurrency", dest="concurrency", type=int, default=64)
+    parser.add_argument(
+        "--multipart-threshold", dest="multipart_threshold", type=int, default=64
+    )  # MB
+    parser.add_argument("--part-size", dest="part_size", type=int, default=16)  # MB
+    parser.add_argument(
+        "--max-concurrency", dest="max_concurrency", type=int, default=4
+    )
+    parser.add_argument("--settle-ms", dest="settle_ms", type=int, default=0)
+    parser.add_argument(
+        "--compress", dest="compress", action="append", default=[]
+    )  # SUFFIX=gzip or SUFFIX=zstd, may be repeated
+    parser.add_argument(
+        "--bundle-threshold", dest="bundle_threshold", type=int, default=0
+    )  # KB, 0 sends every file on its own
+    parser.add_argument(
+        "--bundle-bytes", dest="bundle_bytes", type=int, default=16
+    )  # MB
+    parser.add_argument(
+        "--bundle-age", dest="bundle_age", type=float, default=30
+    )  # seconds
+    parser.add_argument(
+        "--bundle-compression",
+        dest="bundle_compression",
+        choices=sorted(bundle.SUFFIXES),
+        default="zstd" if bundle.zstandard else "gzip",
+    )
+    parser.add_argument("--journal", dest="journal", required=False, default="")
+    parser.add_argument("--dedup", action="store_true", default=False)
+    parser.add_argument(
+        "--dedup-cache-size", dest="dedup_cache_size", type=int, default=100000
+    )
+    parser.add_argument("--max-retries", dest="max_retries", type=int, default=5)
+    parser.add_argument(
+        "--retry-concurrency", dest="retry_concurrency", type=int, default=2
+    )
+    parser.add_argument("--metrics-port", dest="metrics_port", type=int, default=0)
+    parser.add_argument("--stats-file", dest="stats_file", required=False, default="")
+    parser.add_argument("--stats-interval", dest="stats_interval", type=int, default=60)
+    return parser
+
+
+def build_pipeline(args, s3_client, metrics, logger):
+    """Assemble the stages the command line asked for."""
+
+    # skips uploads of content that is already in the bucket under the same key
+    deduplicator = (
+        Deduplicator(s3_client, args.s3bucket, max_entries=args.dedup_cache_size)
+        if args.dedup
+        else None
+    )
+
+    # durable record of what has been uploaded, so a restart can catch up
+    journal = UploadJournal(args.journal) if args.journal else None
+
+    uploader = S3Uploader(
+        s3_client,
+        args.s3bucket,
+        threshold=args.multipart_threshold * multipart.MB,
+        part_size=args.part_size * multipart.MB,
+        max_concurrency=args.max_concurrency,
+        deduplicator=deduplicator,
+        compression=CompressionRules(args.compress) if args.compress else None,
+        metrics=metrics,
+        logger=logger,
+    )
+
+    if args.bundle_threshold:
+        # small files are packed into compressed bundles instead of one PUT each
+        uploader = bundle.BundlingUploader(
+            uploader,
+            s3_client,
+            args.s3bucket,
+            prefix=args.s3prefix,
+            threshold=args.bundle_threshold * bundle.KB,
+            max_bytes=args.bundle_bytes * bundle.MB,
+            max_age=args.bundle_age,
+            compression=args.bundle_compression,
+            metrics=metrics,
+            logger=logger,
+        )
+
+    post_actions = []
+    if args.delete_after_upload:
+        # only once a HEAD confirms S3 has exactly what was uploaded, and off
+        # the upload workers, since NFS unlinks are slow
+        post_actions.append(
+            VerifiedDelete(
+                s3_client,
+                args.s3bucket,
+                journal=journal,
+                grace=args.delete_grace,
+                workers=args.delete_workers,
+                metrics=metrics,
+                logger=logger,
+            )
+        )
+
+    pipeline = Pipeline(
+        uploader,
+        KeyMapper(args.directory, args.s3prefix),
+        file_filter=SuffixFilter(args.suffix),
+        post_actions=post_actions,
+        journal=journal,
+        metrics=metrics,
+        logger=logger,
+    )
+
+    if args.bundle_threshold:
+        uploader.finished = pipeline.finished
+        uploader.failed = pipeline.failed
+
+    # failed uploads come back after a jittered, exponential delay
+    if args.max_retries:
+        pipeline.retries = RetryScheduler(
+            pipeline.process,
+            max_attempts=args.max_retries,
+            max_concurrent=args.retry_concurrency,
+            logger=logger,
+        )
+
+    return pipeline
+
+
+def main(argv=None, defaults=None):
+    parser = build_parser()
+    if defaults:
+        parser.set_defaults(**defaults)
+    args = parser.parse_args(argv)
+    if args.watch_mode == "scan" and args.engine == "async":
+        parser.error("--watch-mode scan needs --engine sync or threads")
+    if args.schedule == "fair" and args.engine != "threads":
+        parser.error("--schedule fair needs --engine threads")
+    if args.node_count > 1 and args.engine == "async":
+        parser.error("--node-count needs --engine sync or threads")
+    try:
+        CompressionRules(args.compress)
+        weights = fair.parse_settings(args.tenant_weights)
+        rates = fair.parse_settings(args.tenant_rates)
+        shard = None
+        if args.node_count > 1:
+            # this node only uploads the users the hash ring gives it
+            shard = Shard(args.directory, args.node_index, args.node_count)
+    except ValueError as e:
+        parser.error(str(e))
+
+    logger = VerboseLogger() if args.verbose else SilentLogger()
+
+    # always collected; cheap enough to leave on
+    metrics = UploaderMetrics()
+    if args.metrics_port:
+        metrics.serve(args.metrics_port)  # http://host:port/metrics
+    if args.stats_file:
+        metrics.dump_periodically(args.stats_file, args.stats_interval)
+
+    # size the connection pool so every upload can have all of its
+    # multipart parts in flight at once
+    uploads_at_once = {"sync": 1, "threads": args.workers, "async": args.concurrency}
+    s3_client = make_client(uploads_at_once[args.engine] * args.max_concurrency)
+
+    pipeline = build_pipeline(args, s3_client, metrics, logger)
+
+    backlog = None
+    if pipeline.journal:
+        backlog = pipeline.journal.reconcile(args.directory, pipeline.wanted)
+        if shard:
+            backlog = (path for path in backlog if shard(path))
+
+    if args.engine == "async":
+        try:  # catch keyboard interrupt
+            asyncio.run(
+                async_engine.run(
+                    pipeline,
+                    args.directory,
+                    concurrency=args.concurrency,
+                    settle_ms=args.settle_ms,
+                    backlog=backlog,
+                )
+            )
+        except KeyboardInterrupt as e:
+            pass
+        pipeline.close()
+        return 0
+
+    if args.watch_mode == "scan":
+        # rescans the tree instead of relying on inotify, which misses writes
+        # made by other NFS clients and needs a watch per directory
+        watcher = ScanTreeWatcher(
+            args.directory,
+            index=ScanIndex(args.scan_index) if args.scan_index else None,
+            interval=args.scan_interval,
+            walkers=args.scan_walkers,
+            min_age=args.scan_min_age,
+            owns=shard,
+            metrics=metrics,
+            logger=logger,
+        )
+    elif args.watch_mode == "native":
+        watcher = NativeTreeWatcher(args.directory, metrics=metrics, logger=logger)
+    else:
+        watcher = InotifyTreeWatcher(args.directory, metrics=metrics)
+    if shard and args.watch_mode != "scan":
+        watcher = ShardedWatcher(watcher, shard)
+    work_queue = None
+    if args.schedule == "fair":
+        # each user (first directory under --directory) gets a fair share
+        # of the workers, and optionally a byte-rate limit
+        work_queue = fair.FairQueue(
+            args.directory,
+            maxsize=args.queue_depth,
+            weights=weights,
+            rates={name: rate * fair.MB for name, rate in rates.items()},
+            default_rate=args.tenant_default_rate * fair.MB,
+        )
+        metrics.gauge(
+            "uploader_waiting_tenants",
+            "tenants with files queued",
+            work_queue.waiting_tenants,
+        )
+
+    if args.engine == "threads":
+        engines.run_threads(
+            pipeline,
+            watcher,
+            workers=args.workers,
+            queue_depth=args.queue_depth,
+            settle_ms=args.settle_ms,
+            backlog=backlog,
+            work_queue=work_queue,
+        )
+    else:
+        engines.run_sync(pipeline, watcher, settle_ms=args.settle_ms, backlog=backlog)
+
+    # send anything still waiting in a bundle
+    pipeline.close()
+    return 0
@@ -0,0 +1,185 @@
+import base64
+import hashlib
+import os
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+from uploader import multipart
+from uploader.dedup import UNCOMPRESSED_SIZE_KEY
+from uploader.filters import SuffixFilter
+
+try:
+    import zstandard  # https://pypi.org/project/zstandard/
+except ImportError:
+    zstandard = None
+
+CHUNK_SIZE = 1024 * 1024
+
+CODECS = ("gzip", "zstd")
+
+
+def encoder(codec):
+    """A streaming compressor with compress(data) and flush() methods."""
+
+    if codec == "gzip":
+        return zlib.compressobj(6, zlib.DEFLATED, 31)  # 31: gzip framing
+    if codec == "zstd":
+        if zstandard is None:
+            raise ValueError("zstd compression needs the zstandard package")
+        return zstandard.ZstdCompressor().compressobj()
+    raise ValueError(f"unknown codec {codec}")
+
+
+class CompressionRules:
+    """Which codec, if any, to compress a file with, chosen by its suffix.
+
+    Built from --compress SUFFIX=CODEC arguments, e.g. .log=zstd. Suffixes
+    are matched the way --suffix is; the first matching rule wins.
+    """
+
+    def __init__(self, specs=()):
+        self.rules = []
+        for spec in specs:
+            suffix, _, codec = spec.rpartition("=")
+            if not suffix or codec not in CODECS:
+                raise ValueError(f"expected SUFFIX=gzip or SUFFIX=zstd, not {spec}")
+            encoder(codec)  # fail now if the codec is not available
+            self.rules.append((SuffixFilter(suffix), codec))
+
+    def codec_for(self, filename):
+        for matches, codec in self.rules:
+            if matches(filename):
+                return codec
+        return None
+
+
+def _checksum(digest):
+    return base64.b64encode(digest.digest()).decode()
+
+
+def upload_compressed(
+    s3_client,
+    bucket,
+    key,
+    path,
+    codec,
+    tagging="",
+    metadata=None,
+    part_size=multipart.DEFAULT_PART_SIZE,
+    max_concurrency=multipart.DEFAULT_MAX_CONCURRENCY,
+    part_retries=multipart.DEFAULT_PART_RETRIES,
+    logger=None,
+):
+    """Compress path with codec on the way to s3://bucket/key, in one pass.
+
+    The file is read once, in chunks, through the encoder. The compressed
+    bytes are collected into part_size buffers and each buffer's sha256 is
+    computed as it fills, so S3 can check every part (ChecksumSHA256)
+    without the file being read a second time. Output that fits in one
+    buffer goes up with put_object. Anything bigger becomes a multipart
+    upload, with at most max_concurrency parts in flight, so memory stays
+    around (max_concurrency + 1) * part_size whatever the file size. No
+    temporary files are written.
+
+    The object keeps its key and gets Content-Encoding set to the codec,
+    so clients that understand it decompress on download. Its size before
+    compression is stored in the uncompressed-size metadata.
+    """
+
+    part_size = max(part_size, multipart.MIN_PART_SIZE)
+    compressor = encoder(codec)
+
+    kwargs = {"Bucket": bucket, "Key": key, "ContentEncoding": codec}
+    if tagging:
+        kwargs["Tagging"] = tagging
+
+    upload_id = None
+    futures = []
+    slots = threading.Semaphore(max(1, max_concurrency))
+    executor = ThreadPoolExecutor(max_workers=max(1, max_concurrency))
+
+    def send_part(part_number, body, checksum):
+        try:
+            return multipart.upload_part(
+                s3_client,
+                bucket,
+                key,
+                upload_id,
+                part_number,
+                body,
+                checksum=checksum,
+                part_retries=part_retries,
+                logger=logger,
+            )
+        finally:
+            slots.release()
+
+    def submit(body, digest):
+        slots.acquire()  # wait for a free slot rather than buffer more parts
+        for future in futures:
+            if future.done():
+                future.result()  # stop early if a part has already failed
+        futures.append(
+            executor.submit(send_part, len(futures) + 1, bytes(body), _checksum(digest))
+        )
+
+    try:
+        with open(path, "rb", buffering=0) as fp:
+            # only what was there when we started; the stat the pipeline
+            # recorded matches this
+            remaining = os.fstat(fp.fileno()).st_size
+            kwargs["Metadata"] = dict(metadata or {})
+            kwargs["Metadata"][UNCOMPRESSED_SIZE_KEY] = str(remaining)
+
+            buffer = bytearray(CHUNK_SIZE)
+            view = memoryview(buffer)
+            part = bytearray()
+            digest = hashlib.sha256()
+            while remaining > 0:
+                count = fp.readinto(view[: min(CHUNK_SIZE, remaining)])
+                if not count:
+                    break  # truncated while we were reading it
+                remaining -= count
+                output = compressor.compress(view[:count])
+                part += output
+                digest.update(output)
+
+                if len(part) >= part_size:
+                    if upload_id is None:
+                        upload_id = s3_client.create_multipart_upload(
+                            ChecksumAlgorithm="SHA256", **kwargs
+                        )["UploadId"]
+                        if logger:
+                            logger.log(f"compressed multipart upload of {path}")
+                    submit(part, digest)
+                    part = bytearray()
+                    digest = hashlib.sha256()
+
+            output = compressor.flush()
+            part += output
+            digest.update(output)
+
+        if upload_id is None:
+            return s3_client.put_object(
+                Body=bytes(part), ChecksumSHA256=_checksum(digest), **kwargs
+            )
+
+        submit(part, digest)
+        parts = [future.result() for future in futures]
+        return s3_client.complete_multipart_upload(
+            Bucket=bucket,
+            Key=key,
+            UploadId=upload_id,
+            MultipartUpload={"Parts": parts},
+        )
+
+    except BaseException:
+        if upload_id is not None:
+            for future in futures:
+                future.cancel()
+            s3_client.abort_multipart_upload(Bucket=bucket, Key=key, UploadId=upload_id)
+        raise
+
+    finally:
+        executor.shutdown(wait=False)
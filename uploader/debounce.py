@@ -0,0 +1,85 @@
+import heapq
+import threading
+import time
+
+
+class Debouncer:
+    """Holds each path until it has been quiet for settle_ms.
+
+    Clients that open, write and close the same file several times raise an
+    IN_CLOSE_WRITE for every close. touch(path) restarts the quiet window
+    for that path and release(path) is called once, on a background thread,
+    when the window expires without another touch. release may be left as
+    None and assigned later, as long as that happens before the first touch.
+    stop() ends the thread and returns the paths that had not settled yet.
+    """
+
+    def __init__(self, release, settle_ms=500, logger=None):
+        self.release = release
+        self.settle = settle_ms / 1000
+        self.logger = logger
+
+        self.deadlines = {}  # path -> the deadline that will release it
+        self.heap = []  # (deadline, path), may hold stale entries
+        self.condition = threading.Condition()
+        self.stopped = False
+
+        self.thread = threading.Thread(target=self._run, name="debounce", daemon=True)
+        self.thread.start()
+
+    def touch(self, path):
+        deadline = time.monotonic() + self.settle
+        with self.condition:
+            if path in self.deadlines and self.logger:
+                self.logger.log(f"coalescing repeated write of {path}")
+            self.deadlines[path] = deadline
+            heapq.heappush(self.heap, (deadline, path))
+            self.condition.notify()
+
+    def pending(self, path):
+        """True if a newer write of path is still waiting to settle."""
+        with self.condition:
+            return path in self.deadlines
+
+    def stop(self):
+        """Release nothing more; returns the paths still settling, oldest first.
+
+        A release already under way finishes before stop returns, so the
+        caller can shut down whatever release hands paths to.
+        """
+
+        with self.condition:
+            self.stopped = True
+            self.condition.notify()
+        if threading.current_thread() is not self.thread:
+            self.thread.join()
+        with self.condition:
+            return sorted(self.deadlines, key=self.deadlines.get)
+
+    def _run(self):
+        with self.condition:
+            while not self.stopped:
+                if not self.heap:
+                    self.condition.wait()
+                    continue
+
+                deadline, path = self.heap[0]
+                delay = deadline - time.monotonic()
+                if delay > 0:
+                    self.condition.wait(delay)
+                    continue
+
+                heapq.heappop(self.heap)
+                if self.deadlines.get(path) != deadline:
+                    continue  # touched again since this entry was pushed
+                del self.deadlines[path]
+
+                # release may block (a full upload queue), so drop the lock
+                self.condition.release()
+                try:
+                    self.release(path)
+                except Exception as e:
+                    if self.logger:
+                        self.logger.log(f"releasing {path} failed with exception {e}")
+                finally:
+                    self.condition.acquire()
@@ -0,0 +1,84 @@
+import collections
+import hashlib
+import threading
+
+CHUNK_SIZE = 8 * 1024 * 1024
+
+# object metadata key holding the sha256 of what was uploaded
+METADATA_KEY = "sha256"
+
+# set on objects that were compressed on the way up (uploader.compress)
+UNCOMPRESSED_SIZE_KEY = "uncompressed-size"
+
+
+def file_digest(path, chunk_size=CHUNK_SIZE):
+    """sha256 of a file, read in large chunks into one reusable buffer."""
+
+    digest = hashlib.sha256()
+    buffer = bytearray(chunk_size)
+    view = memoryview(buffer)
+    with open(path, "rb", buffering=0) as fp:
+        while True:
+            count = fp.readinto(buffer)
+            if not count:
+                break
+            digest.update(view[:count])  # hashlib drops the GIL for big updates
+    return digest.hexdigest()
+
+
+class HashCache:
+    """LRU map of (path, size, mtime_ns) -> sha256, capped at max_entries.
+
+    A file is only re-hashed when its size or mtime changes.
+    """
+
+    def __init__(self, max_entries=100000):
+        self.max_entries = max_entries
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def digest(self, path, stat):
+        key = (path, stat.st_size, stat.st_mtime_ns)
+        with self.lock:
+            value = self.entries.get(key)
+            if value is not None:
+                self.entries.move_to_end(key)
+                return value
+
+        # hash outside the lock so workers can hash different files at once
+        value = file_digest(path)
+
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return value
+
+
+class Deduplicator:
+    """Decides whether an upload can be skipped because S3 already has it."""
+
+    def __init__(self, s3_client, bucket, max_entries=100000):
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.cache = HashCache(max_entries)
+
+    def check(self, key, path, stat):
+        """Return (digest, head_object response or None).
+
+        The response is only returned when s3://bucket/key was uploaded with
+        the same sha256, in which case the upload can be skipped.
+        """
+
+        digest = self.cache.digest(path, stat)
+        try:
+            response = self.s3_client.head_object(Bucket=self.bucket, Key=key)
+        except Exception:
+            return digest, None  # not there (404) or not readable; upload it
+
+        metadata = response.get("Metadata", {})
+        size = metadata.get(UNCOMPRESSED_SIZE_KEY, response.get("ContentLength"))
+        if str(size) == str(stat.st_size) and metadata.get(METADATA_KEY) == digest:
+            return digest, response
+        return digest, None
@@ -0,0 +1,119 @@
+import os.path
+import sys
+import threading
+
+from uploader.debounce import Debouncer
+from uploader.pool import UploadPool
+from uploader.scan import DirectoryScanner
+from uploader.watcher import NEW_DIRECTORY
+
+
+def _debounced(pipeline, release, settle_ms):
+    """The function new paths are queued with, settling them first if asked."""
+
+    if not settle_ms:
+        return release
+
+    pipeline.debouncer = Debouncer(release, settle_ms=settle_ms, logger=pipeline.logger)
+    pipeline.metrics.gauge(
+        "uploader_settling_files",
+        "files waiting for --settle-ms",
+        lambda: len(pipeline.debouncer.deadlines),
+    )
+    return pipeline.debouncer.touch
+
+
+def _consume(pipeline, watcher, enqueue, backlog):
+    def enqueue_existing(absolute_path):
+        # called for files found by scanning a newly created directory
+        if pipeline.wanted(os.path.basename(absolute_path)):
+            enqueue(absolute_path)
+
+    # files that landed in a new directory before it was watched
+    scanner = DirectoryScanner(enqueue_existing, logger=pipeline.logger)
+
+    def catch_up():
+        # the watches are in place, so anything written while we were down, or
+        # left unfinished by the last run, can be found without leaving a gap
+        for absolute_path in backlog:
+            enqueue(absolute_path)
+
+    if backlog is not None:
+        threading.Thread(target=catch_up, name="catch-up", daemon=True).start()
+
+    for kind, absolute_path, watched in watcher.events():
+        if kind == NEW_DIRECTORY:
+            scanner.submit(absolute_path, watched)
+        elif pipeline.accept(absolute_path):
+            enqueue(absolute_path)  # blocks while the queue is full
+
+
+def _stop_held(pipeline):
+    """Stop the debouncer and retry scheduler, if any; returns what they held."""
+
+    held = []
+    if pipeline.debouncer is not None:
+        held += pipeline.debouncer.stop()
+    if pipeline.retries is not None:
+        held += pipeline.retries.stop()
+    return held
+
+
+def _report(paths):
+    for absolute_path in paths:
+        print(f"not uploaded: {absolute_path}", file=sys.stderr)
+
+
+def run_sync(pipeline, watcher, settle_ms=0, backlog=None):
+    """Upload each file on the watcher's thread, one at a time."""
+
+    # with --settle-ms, uploads run on the debouncer's thread instead
+    enqueue = _debounced(pipeline, pipeline.process, settle_ms)
+    try:  # catch keyboard interrupt
+        _consume(pipeline, watcher, enqueue, backlog)
+    except KeyboardInterrupt as e:
+        pass
+
+    _report(_stop_held(pipeline))
+
+
+def run_threads(
+    pipeline,
+    watcher,
+    workers=4,
+    queue_depth=100,
+    settle_ms=0,
+    backlog=None,
+    work_queue=None,
+):
+    """The watcher only queues paths; a pool of workers does the uploads.
+
+    work_queue replaces the pool's first-come-first-served queue, e.g. with
+    an uploader.fair.FairQueue.
+    """
+
+    pool = UploadPool(
+        pipeline.process,
+        workers=workers,
+        queue_depth=queue_depth,
+        logger=pipeline.logger,
+        work_queue=work_queue,
+    )
+    pipeline.metrics.gauge(
+        "uploader_queue_depth", "files waiting for a worker", pool.queue.qsize
+    )
+    pipeline.metrics.gauge(
+        "uploader_in_flight", "uploads in progress", lambda: len(pool.in_flight)
+    )
+
+    enqueue = _debounced(pipeline, pool.submit, settle_ms)
+    try:  # catch keyboard interrupt
+        _consume(pipeline, watcher, enqueue, backlog)
+    except KeyboardInterrupt as e:
+        pass
+
+    # the debouncer must not submit once the pool is shutting down
+    held = _stop_held(pipeline)
+
+    # let in-flight uploads finish; anything left over is reported so it can be resent
+    _report(pool.shutdown() + held)
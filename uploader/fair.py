@@ -0,0 +1,237 @@
+import collections
+import os
+import os.path
+import queue
+import threading
+import time
+
+MB = 1024 * 1024
+
+# the least an upload is charged, so floods of empty files still cost something
+MIN_COST = 64 * 1024
+
+
+def tenant_of(root_directory, absolute_path):
+    """The first path component under root_directory: the SFTP user.
+
+    SftpStack gives every user the home directory /{fs_id}/{username}/, so
+    with --directory pointing at the file system's root each user's files
+    land under their own first component. Files directly in the root
+    belong to the "" tenant.
+    """
+
+    relative = os.path.relpath(absolute_path, start=root_directory)
+    head, _, rest = relative.partition(os.sep)
+    return head if rest else ""
+
+
+def parse_settings(specs, convert=float):
+    """{tenant: value} from --tenant-weight / --tenant-rate NAME=VALUE arguments."""
+
+    settings = {}
+    for spec in specs:
+        name, _, value = spec.rpartition("=")
+        if not name:
+            raise ValueError(f"expected NAME=VALUE, not {spec}")
+        settings[name] = convert(value)
+    return settings
+
+
+class TokenBucket:
+    """Byte-rate limit: rate bytes/sec on average, bursts of up to burst bytes.
+
+    take() charges a whole upload up front and may push the balance below
+    zero; the tenant then waits until it has been paid back. A single file
+    is never throttled part way through, but over time the tenant gets no
+    more than rate.
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst if burst is not None else max(rate, 8 * MB)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now):
+        """Seconds until this bucket can be drawn on again; 0 if it can now."""
+        self._refill(now)
+        return 0.0 if self.tokens > 0 else -self.tokens / self.rate
+
+    def take(self, amount, now):
+        self._refill(now)
+        self.tokens -= amount
+
+
+class _Tenant:
+    __slots__ = ("name", "weight", "bucket", "items", "last_finish")
+
+    def __init__(self, name, weight, bucket):
+        self.name = name
+        self.weight = weight
+        self.bucket = bucket
+        self.items = collections.deque()  # (start tag, cost, item)
+        self.last_finish = 0.0
+
+
+class FairQueue:
+    """A drop-in for UploadPool's queue that shares workers fairly between tenants.
+
+    Start-time fair queuing: every queued file is tagged with a virtual
+    start time of max(now, the tenant's previous finish), and its finish is
+    start + size / weight. get() always returns the head with the earliest
+    start tag, so a tenant with a 200 GB backlog gets its weighted share of
+    the workers while another tenant's small file waits at most about one
+    upload. A tenant with a byte-rate limit is skipped while its token
+    bucket is in debt.
+
+    put() blocks once maxsize files are queued, like queue.Queue. Items
+    that are not paths (the pool's stop markers) cost nothing and are
+    returned ahead of everything else.
+    """
+
+    def __init__(
+        self,
+        root_directory,
+        maxsize=100,
+        weights=None,
+        rates=None,
+        default_rate=0,
+        cost=None,
+    ):
+        self.root_directory = root_directory
+        self.maxsize = maxsize
+        self.weights = weights or {}
+        self.rates = rates or {}  # bytes/sec
+        self.default_rate = default_rate
+        self.cost = cost or self._size
+
+        self.tenants = {}
+        self.control = collections.deque()
+        self.virtual_time = 0.0
+        self.count = 0
+        self.condition = threading.Condition()
+
+    @staticmethod
+    def _size(absolute_path):
+        try:
+            return max(MIN_COST, os.stat(absolute_path).st_size)
+        except OSError:
+            return MIN_COST
+
+    def _tenant(self, name):
+        tenant = self.tenants.get(name)
+        if tenant is None:
+            rate = self.rates.get(name, self.default_rate)
+            tenant = _Tenant(
+                name,
+                self.weights.get(name, 1.0),
+                TokenBucket(rate) if rate else None,
+            )
+            self.tenants[name] = tenant
+        return tenant
+
+    def put(self, item):
+        if not isinstance(item, str):
+            with self.condition:
+                self.control.append(item)
+                self.condition.notify()
+            return
+
+        name = tenant_of(self.root_directory, item)
+        cost = self.cost(item)  # a stat, so outside the lock
+        with self.condition:
+            while self.maxsize and self.count >= self.maxsize:
+                self.condition.wait()
+            tenant = self._tenant(name)
+            start = max(self.virtual_time, tenant.last_finish)
+            tenant.last_finish = start + cost / tenant.weight
+            tenant.items.append((start, cost, item))
+            self.count += 1
+            self.condition.notify_all()
+
+    def _next(self):
+        """The next item to hand out, or the seconds to wait for one."""
+
+        if self.control:
+            return self.control.popleft(), None
+
+        now = time.monotonic()
+        best = None
+        wait = None
+        idle = []
+        for tenant in self.tenants.values():
+            if not tenant.items:
+                # nothing left to remember once virtual time has caught up
+                if tenant.last_finish <= self.virtual_time and (
+                    tenant.bucket is None or tenant.bucket.wait_time(now) == 0
+                ):
+                    idle.append(tenant.name)
+                continue
+            if tenant.bucket:
+                delay = tenant.bucket.wait_time(now)
+                if delay:
+                    wait = delay if wait is None else min(wait, delay)
+                    continue
+            if best is None or tenant.items[0][0] < best.items[0][0]:
+                best = tenant
+
+        for name in idle:
+            del self.tenants[name]
+
+        if best is None:
+            return None, wait
+
+        start, cost, item = best.items.popleft()
+        self.virtual_time = max(self.virtual_time, start)
+        if best.bucket:
+            best.bucket.take(cost, now)
+        self.count -= 1
+        self.condition.notify_all()
+        return item, None
+
+    def get(self, block=True):
+        with self.condition:
+            while True:
+                item, wait = self._next()
+                if item is not None:
+                    return item
+                if not block:
+                    raise queue.Empty
+                self.condition.wait(wait)
+
+    def get_nowait(self):
+        return self.get(block=False)
+
+    def drain(self):
+        """Remove and return every queued path, rate limits or not.
+
+        For shutting down: a tenant held back by its token bucket still
+        has its files handed back, so they can be recorded.
+        """
+
+        with self.condition:
+            items = sorted(
+                (start, n, item)
+                for tenant in self.tenants.values()
+                for n, (start, _, item) in enumerate(tenant.items)
+            )
+            for tenant in self.tenants.values():
+                tenant.items.clear()
+            self.count = 0
+            self.condition.notify_all()
+        return [item for _, _, item in items]
+
+    def task_done(self):
+        pass  # nothing joins this queue
+
+    def qsize(self):
+        with self.condition:
+            return self.count
+
+    def waiting_tenants(self):
+        with self.condition:
+            return sum(1 for tenant in self.tenants.values() if tenant.items)
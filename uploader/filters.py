@@ -0,0 +1,19 @@
+import re
+
+
+class SuffixFilter:
+    """Accepts filenames ending in suffix, ignoring case.
+
+    suffix is used as a regular expression, as --suffix always has been. An
+    empty suffix accepts everything.
+    """
+
+    def __init__(self, suffix=""):
+        if suffix:  # filter to only files with a matching suffix
+            pattern = f".*{suffix}$"  # pattern for file suffix
+        else:
+            pattern = ".*"  # match everything
+        self.pattern = re.compile(pattern, flags=re.IGNORECASE)
+
+    def __call__(self, filename):
+        return self.pattern.match(filename) is not None
@@ -0,0 +1,111 @@
+import sqlite3
+import threading
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    directory TEXT NOT NULL,
+    name TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    PRIMARY KEY (directory, name)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS directories (
+    directory TEXT PRIMARY KEY,
+    pass INTEGER NOT NULL
+) WITHOUT ROWID;
+"""
+
+_UPSERT_FILE = """
+INSERT INTO files (directory, name, size, mtime_ns) VALUES (?, ?, ?, ?)
+ON CONFLICT (directory, name) DO UPDATE SET
+    size = excluded.size,
+    mtime_ns = excluded.mtime_ns
+"""
+
+_UPSERT_DIRECTORY = """
+INSERT INTO directories (directory, pass) VALUES (?, ?)
+ON CONFLICT (directory) DO UPDATE SET pass = excluded.pass
+"""
+
+
+class ScanIndex:
+    """The size and mtime of every file the scan watcher has seen, in SQLite.
+
+    Kept on disk (--scan-index) so a restart only reports what changed while
+    the uploader was down, instead of every file in the tree. Rows are keyed
+    by (directory, name) and read one directory at a time, like the upload
+    journal, so memory stays flat however big the tree is.
+    """
+
+    def __init__(self, path=":memory:"):
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(
+            path, check_same_thread=False, isolation_level=None
+        )
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript(_SCHEMA)
+
+    def empty(self):
+        with self.lock:
+            row = self.connection.execute("SELECT 1 FROM files LIMIT 1").fetchone()
+        return row is None
+
+    def rows(self, directory):
+        """{name: (size, mtime_ns)} for every file recorded in directory."""
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT name, size, mtime_ns FROM files WHERE directory = ?",
+                (directory,),
+            ).fetchall()
+        return {name: (size, mtime_ns) for name, size, mtime_ns in rows}
+
+    def update(self, directory, scan_pass, changed=(), vanished=()):
+        """Record one scanned directory in a single transaction.
+
+        changed is (name, size, mtime_ns) for new or modified files, vanished
+        the names of files that are no longer there.
+        """
+
+        with self.lock:
+            self.connection.execute("BEGIN")
+            try:
+                self.connection.executemany(
+                    _UPSERT_FILE,
+                    ((directory, name, size, mtime) for name, size, mtime in changed),
+                )
+                self.connection.executemany(
+                    "DELETE FROM files WHERE directory = ? AND name = ?",
+                    ((directory, name) for name in vanished),
+                )
+                self.connection.execute(_UPSERT_DIRECTORY, (directory, scan_pass))
+                self.connection.execute("COMMIT")
+            except BaseException:
+                self.connection.execute("ROLLBACK")
+                raise
+
+    def prune(self, scan_pass):
+        """Forget directories that were not seen by scan_pass, i.e. removed."""
+
+        with self.lock:
+            self.connection.execute("BEGIN")
+            self.connection.execute(
+                "DELETE FROM files WHERE directory IN"
+                " (SELECT directory FROM directories WHERE pass < ?)",
+                (scan_pass,),
+            )
+            self.connection.execute(
+                "DELETE FROM directories WHERE pass < ?", (scan_pass,)
+            )
+            self.connection.execute("COMMIT")
+
+    def last_pass(self):
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT MAX(pass) FROM directories"
+            ).fetchone()
+        return row[0] or 0
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
@@ -0,0 +1,137 @@
+import os
+import os.path
+import sqlite3
+import threading
+import time
+
+PENDING = "pending"
+IN_FLIGHT = "in_flight"
+DONE = "done"
+FAILED = "failed"
+DELETING = "deleting"  # uploaded, local copy not removed yet
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    directory TEXT NOT NULL,
+    name TEXT NOT NULL,
+    size INTEGER,
+    mtime_ns INTEGER,
+    state TEXT NOT NULL,
+    etag TEXT,
+    updated REAL NOT NULL,
+    PRIMARY KEY (directory, name)
+) WITHOUT ROWID
+"""
+
+_UPSERT = """
+INSERT INTO files (directory, name, size, mtime_ns, state, etag, updated)
+VALUES (?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (directory, name) DO UPDATE SET
+    size = excluded.size,
+    mtime_ns = excluded.mtime_ns,
+    state = excluded.state,
+    etag = excluded.etag,
+    updated = excluded.updated
+"""
+
+
+class UploadJournal:
+    """Crash-safe record of what has been uploaded, kept in SQLite.
+
+    Every file moves through pending -> in_flight -> done (or failed), with
+    the size and mtime it had when it was uploaded and the ETag S3 returned.
+    With --delete-after-upload a done file is deleting until its local copy
+    is actually removed, so a restart uploads and deletes it again.
+    Rows are keyed by (directory, name) so a restart can reconcile the tree
+    one directory at a time without loading the whole journal into memory.
+    """
+
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(
+            path, check_same_thread=False, isolation_level=None
+        )
+        # WAL keeps writers from blocking the reconciliation reads, and
+        # NORMAL sync is still durable across a process crash
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(_SCHEMA)
+
+    def _record(self, path, state, stat=None, etag=None):
+        directory, name = os.path.split(path)
+        size = stat.st_size if stat else None
+        mtime_ns = stat.st_mtime_ns if stat else None
+        with self.lock:
+            self.connection.execute(
+                _UPSERT, (directory, name, size, mtime_ns, state, etag, time.time())
+            )
+
+    def pending(self, path):
+        self._record(path, PENDING)
+
+    def started(self, path, stat):
+        self._record(path, IN_FLIGHT, stat)
+
+    def completed(self, path, stat, etag=None):
+        self._record(path, DONE, stat, etag)
+
+    def deleting(self, path, stat, etag=None):
+        self._record(path, DELETING, stat, etag)
+
+    def failed(self, path, stat=None):
+        self._record(path, FAILED, stat)
+
+    def forget(self, path):
+        """Drop a file from the journal, e.g. after it was deleted."""
+        directory, name = os.path.split(path)
+        with self.lock:
+            self.connection.execute(
+                "DELETE FROM files WHERE directory = ? AND name = ?", (directory, name)
+            )
+
+    def _rows_for(self, directory):
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT name, size, mtime_ns, state FROM files WHERE directory = ?",
+                (directory,),
+            ).fetchall()
+        return {name: (size, mtime_ns, state) for name, size, mtime_ns, state in rows}
+
+    def reconcile(self, root_directory, wanted=None):
+        """Yield every file under root_directory that is not known to be in S3.
+
+        That is anything new, anything whose size or mtime changed since it
+        was uploaded, and anything left pending, in flight, failed or not yet
+        deleted by a previous run. Rows for files that no longer exist are removed.
+        """
+
+        stack = [os.path.normpath(root_directory)]
+        while stack:
+            directory = stack.pop()
+            known = self._rows_for(directory)
+            try:
+                with os.scandir(directory) as entries:
+                    for entry in entries:
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(entry.path)
+                            continue
+                        if not entry.is_file(follow_symlinks=False):
+                            continue
+
+                        row = known.pop(entry.name, None)
+                        if wanted and not wanted(entry.name):
+                            continue
+
+                        stat = entry.stat(follow_symlinks=False)
+                        if row == (stat.st_size, stat.st_mtime_ns, DONE):
+                            continue  # already uploaded, unchanged
+                        yield entry.path
+            except OSError:
+                continue  # removed or unreadable while we were walking
+
+            for name in known:  # in the journal but gone from disk
+                self.forget(os.path.join(directory, name))
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
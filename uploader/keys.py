@@ -0,0 +1,15 @@
+import os.path
+
+
+class KeyMapper:
+    """Maps a path under root_directory to its S3 key."""
+
+    def __init__(self, root_directory, prefix=""):
+        self.root_directory = root_directory
+        self.prefix = prefix
+
+    def __call__(self, absolute_path):
+        key = os.path.relpath(absolute_path, start=self.root_directory)
+        if self.prefix:
+            key = f"{self.prefix}/{key}"
+        return os.path.normpath(key)  # remove any redundant characters
@@ -0,0 +1,17 @@
+class Logger:
+    def __init__(self, target=None, prefix=""):
+        self.prefix = prefix
+        pass
+
+    def log(self, message):
+        pass  # do nothing
+
+
+class SilentLogger(Logger):
+    def log(self, message):
+        pass  # do nothing
+
+
+class VerboseLogger(Logger):
+    def log(self, message):
+        print(f"{self.prefix}{message}")
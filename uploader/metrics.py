@@ -0,0 +1,208 @@
+import bisect
+import http.server
+import json
+import os
+import threading
+import time
+
+# upload latency and event lag, in seconds
+DEFAULT_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+
+class Counter:
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self.value = 0
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def snapshot(self):
+        return self.value
+
+    def render(self):
+        return (
+            f"# HELP {self.name} {self.help}\n"
+            f"# TYPE {self.name} counter\n"
+            f"{self.name} {self.value}\n"
+        )
+
+
+class Gauge:
+    """A value read from function() whenever the metrics are collected."""
+
+    def __init__(self, name, help, function):
+        self.name = name
+        self.help = help
+        self.function = function
+
+    def snapshot(self):
+        return self.function()
+
+    def render(self):
+        return (
+            f"# HELP {self.name} {self.help}\n"
+            f"# TYPE {self.name} gauge\n"
+            f"{self.name} {self.function()}\n"
+        )
+
+
+class Histogram:
+    def __init__(self, name, help, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def snapshot(self):
+        with self.lock:
+            return {"count": self.count, "sum": self.sum, "buckets": list(self.counts)}
+
+    def render(self):
+        with self.lock:
+            counts = list(self.counts)
+            total, count = self.sum, self.count
+
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        cumulative = 0
+        for bound, n in zip(self.buckets + ("+Inf",), counts):
+            cumulative += n
+            lines.append(f'{self.name}_bucket{{le="{bound}"}} {cumulative}')
+        lines.append(f"{self.name}_sum {total}")
+        lines.append(f"{self.name}_count {count}")
+        return "\n".join(lines) + "\n"
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def counter(self, name, help):
+        return self._add(Counter(name, help))
+
+    def gauge(self, name, help, function):
+        return self._add(Gauge(name, help, function))
+
+    def histogram(self, name, help, buckets=DEFAULT_BUCKETS):
+        return self._add(Histogram(name, help, buckets))
+
+    def _add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        """Prometheus text exposition format."""
+        return "".join(metric.render() for metric in self.metrics)
+
+    def snapshot(self):
+        return {metric.name: metric.snapshot() for metric in self.metrics}
+
+    def serve(self, port, address=""):
+        """Serve /metrics over HTTP from a background thread."""
+
+        registry = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != "/metrics":
+                    self.send_error(404)
+                    return
+                body = registry.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass  # scrapes are not worth a line on stdout each
+
+        server = http.server.ThreadingHTTPServer((address, port), Handler)
+        server.daemon_threads = True
+        threading.Thread(
+            target=server.serve_forever, name="metrics", daemon=True
+        ).start()
+        return server
+
+    def dump_periodically(self, path, interval=60):
+        """Rewrite path with a JSON snapshot every interval seconds."""
+
+        def run():
+            while True:
+                time.sleep(interval)
+                snapshot = dict(self.snapshot(), timestamp=time.time())
+                temporary = f"{path}.tmp"
+                with open(temporary, "w") as fp:
+                    json.dump(snapshot, fp)
+                os.replace(temporary, path)  # readers never see half a file
+
+        thread = threading.Thread(target=run, name="stats", daemon=True)
+        thread.start()
+        return thread
+
+
+class UploaderMetrics(Registry):
+    """The instruments the uploader records into."""
+
+    def __init__(self):
+        super().__init__()
+        self.events = self.counter("uploader_events_total", "inotify events read")
+        self.filtered = self.counter(
+            "uploader_files_filtered_total", "closed files skipped by --suffix"
+        )
+        self.uploads = self.counter("uploader_uploads_total", "files uploaded to S3")
+        self.unchanged = self.counter(
+            "uploader_uploads_skipped_total", "uploads skipped by --dedup"
+        )
+        self.failures = self.counter(
+            "uploader_upload_failures_total", "uploads that raised an exception"
+        )
+        self.retries = self.counter(
+            "uploader_retries_total", "failed uploads scheduled for another try"
+        )
+        self.bytes_sent = self.counter(
+            "uploader_bytes_sent_total", "bytes uploaded to S3"
+        )
+        self.latency = self.histogram(
+            "uploader_upload_seconds", "time spent uploading one file"
+        )
+        self.lag = self.histogram(
+            "uploader_event_lag_seconds", "time from inotify event to upload done"
+        )
+
+        self.first_seen = {}  # path -> monotonic time of its event
+        self.lock = threading.Lock()
+
+    def seen(self, path):
+        with self.lock:
+            self.first_seen.setdefault(path, time.monotonic())
+
+    def uploaded(self, path, size, seconds):
+        self.uploads.inc()
+        self.bytes_sent.inc(size)
+        self.latency.observe(seconds)
+        with self.lock:
+            start = self.first_seen.pop(path, None)
+        if start is not None:
+            self.lag.observe(time.monotonic() - start)
+
+    def skipped(self, path):
+        self.unchanged.inc()
+        self.forget(path)
+
+    def forget(self, path):
+        with self.lock:
+            self.first_seen.pop(path, None)
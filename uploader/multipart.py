@@ -0,0 +1,177 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_EXCEPTION
+
+# https://docs.aws.amazon.com/AmazonS3/latest/userguide/qfacts.html
+
+MB = 1024 * 1024
+MIN_PART_SIZE = 5 * MB  # every part except the last must be at least this big
+MAX_PARTS = 10000
+
+DEFAULT_THRESHOLD = 64 * MB
+DEFAULT_PART_SIZE = 16 * MB
+DEFAULT_MAX_CONCURRENCY = 4
+DEFAULT_PART_RETRIES = 3
+
+
+def upload_file(
+    s3_client,
+    bucket,
+    key,
+    path,
+    tagging="",
+    metadata=None,
+    threshold=DEFAULT_THRESHOLD,
+    part_size=DEFAULT_PART_SIZE,
+    max_concurrency=DEFAULT_MAX_CONCURRENCY,
+    part_retries=DEFAULT_PART_RETRIES,
+    logger=None,
+):
+    """Upload path to s3://bucket/key.
+
+    Files smaller than threshold go up with a single put_object. Anything
+    bigger is sent as a multipart upload. metadata becomes the object's
+    user metadata (x-amz-meta-*).
+    """
+
+    size = os.path.getsize(path)
+    if size < threshold:
+        kwargs = {"Metadata": metadata} if metadata else {}
+        with open(path, "rb") as body:
+            return s3_client.put_object(
+                Bucket=bucket, Key=key, Body=body, Tagging=tagging, **kwargs
+            )
+
+    return multipart_upload(
+        s3_client,
+        bucket,
+        key,
+        path,
+        size,
+        tagging=tagging,
+        metadata=metadata,
+        part_size=part_size,
+        max_concurrency=max_concurrency,
+        part_retries=part_retries,
+        logger=logger,
+    )
+
+
+def _part_size_for(size, part_size):
+    # S3 caps an upload at 10,000 parts, so very large files need bigger parts
+    minimum = -(-size // MAX_PARTS)  # ceiling division
+    return max(part_size, minimum, MIN_PART_SIZE)
+
+
+def upload_part(
+    s3_client,
+    bucket,
+    key,
+    upload_id,
+    part_number,
+    body,
+    checksum=None,
+    part_retries=DEFAULT_PART_RETRIES,
+    logger=None,
+):
+    """Send one part, retrying it on its own; returns its entry for complete.
+
+    checksum is the part's base64 sha256, which S3 verifies on arrival.
+    """
+
+    kwargs = {"ChecksumSHA256": checksum} if checksum else {}
+    for attempt in range(part_retries + 1):
+        try:
+            response = s3_client.upload_part(
+                Bucket=bucket,
+                Key=key,
+                UploadId=upload_id,
+                PartNumber=part_number,
+                Body=body,
+                **kwargs,
+            )
+            part = {"PartNumber": part_number, "ETag": response["ETag"]}
+            if checksum:
+                part["ChecksumSHA256"] = checksum
+            return part
+        except Exception as e:
+            if attempt == part_retries:
+                raise
+            if logger:
+                logger.log(f"part {part_number} of {key} failed ({e}), retrying")
+            time.sleep(min(2**attempt, 30))
+
+
+def multipart_upload(
+    s3_client,
+    bucket,
+    key,
+    path,
+    size,
+    tagging="",
+    metadata=None,
+    part_size=DEFAULT_PART_SIZE,
+    max_concurrency=DEFAULT_MAX_CONCURRENCY,
+    part_retries=DEFAULT_PART_RETRIES,
+    logger=None,
+):
+    """Upload a file in parts, several at a time.
+
+    Each worker reads its own part with os.pread just before sending it, so
+    at most max_concurrency parts are held in memory no matter how large
+    the file is. A failed part is retried on its own; if it still fails the
+    whole upload is aborted so no orphaned parts are left billing in S3.
+    """
+
+    part_size = _part_size_for(size, part_size)
+    part_count = max(1, -(-size // part_size))
+
+    kwargs = {"Bucket": bucket, "Key": key}
+    if tagging:
+        kwargs["Tagging"] = tagging
+    if metadata:
+        kwargs["Metadata"] = metadata
+    upload_id = s3_client.create_multipart_upload(**kwargs)["UploadId"]
+
+    if logger:
+        logger.log(f"multipart upload of {path}: {part_count} parts of {part_size}")
+
+    def send_part(fd, part_number):
+        offset = (part_number - 1) * part_size
+        body = os.pread(fd, part_size, offset)
+        return upload_part(
+            s3_client,
+            bucket,
+            key,
+            upload_id,
+            part_number,
+            body,
+            part_retries=part_retries,
+            logger=logger,
+        )
+
+    try:
+        with open(path, "rb") as fp, ThreadPoolExecutor(
+            max_workers=max(1, max_concurrency)
+        ) as executor:
+            futures = [
+                executor.submit(send_part, fp.fileno(), part_number)
+                for part_number in range(1, part_count + 1)
+            ]
+            done, not_done = wait(futures, return_when=FIRST_EXCEPTION)
+            for future in not_done:
+                future.cancel()
+            for future in done:
+                future.result()  # re-raises the part failure, if any
+            parts = [future.result() for future in futures]
+
+        return s3_client.complete_multipart_upload(
+            Bucket=bucket,
+            Key=key,
+            UploadId=upload_id,
+            MultipartUpload={"Parts": parts},
+        )
+
+    except BaseException:
+        s3_client.abort_multipart_upload(Bucket=bucket, Key=key, UploadId=upload_id)
+        raise
@@ -0,0 +1,143 @@
+import os
+
+from uploader.log import SilentLogger
+from uploader.metrics import UploaderMetrics
+
+# returned by uploader.upload() when the file will be sent later, e.g. as
+# part of a bundle; the uploader then calls finished() or failed() itself
+DEFERRED = object()
+
+
+class Pipeline:
+    """Runs one closed file through filter -> key mapper -> uploader -> post.
+
+    Every stage is a plain object or callable, so any of them can be
+    replaced or timed on its own:
+
+        file_filter(filename) -> bool
+        key_mapper(absolute_path) -> key
+        uploader.upload(absolute_path, key, stat) -> response, raises on failure
+            (or DEFERRED, see above)
+        post_action(absolute_path, key, stat, response), for each post action
+
+    The journal, retry scheduler and debouncer are optional. retries and
+    debouncer are attributes rather than arguments because both need to
+    call back into the pipeline, so they are attached after it is built.
+    """
+
+    def __init__(
+        self,
+        uploader,
+        key_mapper,
+        file_filter=None,
+        post_actions=(),
+        journal=None,
+        metrics=None,
+        logger=None,
+    ):
+        self.uploader = uploader
+        self.key_mapper = key_mapper
+        self.file_filter = file_filter
+        self.post_actions = list(post_actions)
+        self.journal = journal
+        self.metrics = metrics or UploaderMetrics()
+        self.logger = logger or SilentLogger()
+
+        self.retries = None  # uploader.retry.RetryScheduler
+        self.debouncer = None  # uploader.debounce.Debouncer
+
+    def wanted(self, filename):
+        return self.file_filter is None or self.file_filter(filename)
+
+    def accept(self, absolute_path):
+        """Called for every closed file the watcher reports.
+
+        Returns False if the filter rejects it; otherwise records that it was
+        seen, so it can be queued.
+        """
+
+        if not self.wanted(os.path.basename(absolute_path)):
+            self.logger.log(f"ignoring {absolute_path}")
+            self.metrics.filtered.inc()
+            return False
+
+        self.metrics.seen(absolute_path)
+        if self.journal:
+            self.journal.pending(absolute_path)
+        return True
+
+    def superseded(self, absolute_path):
+        # a newer write of this file is still settling and will be uploaded itself
+        return self.debouncer is not None and self.debouncer.pending(absolute_path)
+
+    def failed(self, absolute_path, stat, e):
+        self.metrics.failures.inc()
+        if self.journal:
+            self.journal.failed(absolute_path, stat)  # picked up on the next start
+        if self.retries and self.retries.failed(absolute_path, e):
+            self.metrics.retries.inc()  # or sooner, if the error is transient
+        else:
+            self.metrics.forget(absolute_path)
+
+    def process(self, absolute_path):
+        """Upload one file and run the post actions; True if it reached S3.
+
+        Also True if the uploader took the file to send later (DEFERRED).
+        """
+
+        if self.superseded(absolute_path):
+            self.logger.log(f"skipping {absolute_path}, superseded by a newer write")
+            self.metrics.forget(absolute_path)
+            return False
+
+        try:
+            stat = os.stat(absolute_path)
+        except FileNotFoundError:
+            self.logger.log(f"{absolute_path} is gone, nothing to upload")
+            self.metrics.forget(absolute_path)
+            if self.journal:
+                self.journal.forget(absolute_path)
+            return False
+
+        key = self.key_mapper(absolute_path)
+        if self.journal:
+            self.journal.started(absolute_path, stat)
+
+        try:
+            response = self.uploader.upload(absolute_path, key, stat)
+        except Exception as e:
+            self.logger.log(f"upload of {absolute_path} failed with exception {e}")
+            self.failed(absolute_path, stat, e)
+            return False
+
+        if response is DEFERRED:
+            return True  # the uploader calls finished() once it is in S3
+
+        # will only get here if the upload succeeded
+        self.finished(absolute_path, stat, response, key)
+        return True
+
+    def finished(self, absolute_path, stat, response, key=None):
+        """Record a successful upload and run the post actions."""
+
+        if self.retries:
+            self.retries.succeeded(absolute_path)
+        if self.journal:
+            self.journal.completed(absolute_path, stat, response.get("ETag"))
+
+        if self.post_actions and self.superseded(absolute_path):
+            self.logger.log(f"not touching {absolute_path}, it was written again")
+            return
+
+        if key is None:
+            key = self.key_mapper(absolute_path)
+        for action in self.post_actions:
+            action(absolute_path, key, stat, response)
+
+    def close(self):
+        """Flush anything a stage is still holding on to."""
+
+        for stage in [self.uploader] + self.post_actions:
+            close = getattr(stage, "close", None)
+            if close:
+                close()
@@ -0,0 +1,96 @@
+import queue
+import threading
+
+# placed on the queue once per worker to tell it to exit
+_STOP = object()
+
+
+class UploadPool:
+    """Bounded producer/consumer pool of upload worker threads.
+
+    The inotify loop calls submit() and a fixed number of workers call
+    upload(item) for every queued item. submit() blocks while the queue is
+    full, which applies backpressure to the event loop instead of letting
+    the backlog grow without limit.
+    """
+
+    def __init__(
+        self, upload, workers=4, queue_depth=100, logger=None, work_queue=None
+    ):
+        self.upload = upload
+        self.logger = logger
+        # anything with queue.Queue's put/get/get_nowait/task_done/qsize,
+        # e.g. uploader.fair.FairQueue, optionally with drain() to empty it
+        self.queue = work_queue or queue.Queue(maxsize=queue_depth)
+        self.in_flight = set()
+        self.lock = threading.Lock()
+
+        self.threads = [
+            threading.Thread(target=self._run, name=f"upload-{n}", daemon=True)
+            for n in range(max(1, workers))
+        ]
+        for thread in self.threads:
+            thread.start()
+
+    def submit(self, item):
+        self.queue.put(item)
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            try:
+                if item is _STOP:
+                    return
+
+                with self.lock:
+                    self.in_flight.add(item)
+                try:
+                    self.upload(item)
+                except Exception as e:
+                    # one bad upload must not take the worker down with it
+                    if self.logger:
+                        self.logger.log(f"upload of {item} failed with exception {e}")
+                finally:
+                    with self.lock:
+                        self.in_flight.discard(item)
+            finally:
+                self.queue.task_done()
+
+    def _drain(self):
+        drain = getattr(self.queue, "drain", None)
+        if drain:
+            # a FairQueue may be holding items back for a rate limit; those
+            # are pending too
+            return drain()
+
+        pending = []
+        while True:
+            try:
+                item = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not _STOP:
+                pending.append(item)
+            self.queue.task_done()
+        return pending
+
+    def shutdown(self):
+        """Stop the workers and return the items that were not uploaded.
+
+        Queued items that no worker has started are returned immediately.
+        In-flight uploads are allowed to finish; if the wait is interrupted
+        (a second ctrl-c) the in-flight items are returned as well.
+        """
+
+        pending = self._drain()
+        for _ in self.threads:
+            self.queue.put(_STOP)
+
+        try:
+            for thread in self.threads:
+                thread.join()
+        except KeyboardInterrupt:
+            with self.lock:
+                pending.extend(self.in_flight)
+
+        return pending
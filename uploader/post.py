@@ -0,0 +1,257 @@
+import heapq
+import itertools
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from uploader.dedup import UNCOMPRESSED_SIZE_KEY
+
+DEFAULT_BATCH_SIZE = 64
+DEFAULT_BATCH_WAIT = 1.0
+DEFAULT_WORKERS = 4
+
+# queued by close() to tell the verify thread to finish up
+_STOP = object()
+
+
+class VerifiedDelete:
+    """Removes the local copy once S3 is known to hold it (--delete-after-upload).
+
+    Uploaded files are collected into batches of up to batch_size, or
+    whatever arrived within batch_wait seconds. One HEAD is issued per
+    distinct object in the batch, on a pool of workers (files that went up
+    in the same bundle share one). A file is deleted only if:
+
+      - the object's ETag is the one the upload returned,
+      - its size, before any compression, is the size that was uploaded
+        (for bundles, the bundle's own ETag is all there is to check),
+      - its SHA-256 checksum matches the upload's, when S3 has one, and
+      - the local file still has the size and mtime it had when uploaded.
+
+    Verified files are unlinked by the same pool after an optional grace
+    delay, so slow NFS unlinks never hold up the upload workers. Anything
+    that fails a check is left in place and logged. With a journal, a
+    file's row says deleting until it is unlinked, or failed if S3 does not
+    match, so either way the next start sends it again.
+    """
+
+    def __init__(
+        self,
+        s3_client,
+        bucket,
+        journal=None,
+        grace=0.0,
+        batch_size=DEFAULT_BATCH_SIZE,
+        batch_wait=DEFAULT_BATCH_WAIT,
+        workers=DEFAULT_WORKERS,
+        metrics=None,
+        logger=None,
+    ):
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.journal = journal
+        self.grace = grace
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self.logger = logger
+
+        self.queue = queue.Queue()
+        self.executor = ThreadPoolExecutor(
+            max_workers=max(1, workers), thread_name_prefix="unlink"
+        )
+        self.heap = []  # (due, sequence, path, stat), waiting out the grace delay
+        self.sequence = itertools.count()
+        self.condition = threading.Condition()
+        self.closed = False
+
+        self.unverified = None
+        if metrics:
+            self.unverified = metrics.counter(
+                "uploader_unverified_total", "uploads kept because S3 did not match"
+            )
+            metrics.gauge(
+                "uploader_pending_deletes",
+                "verified files waiting out --delete-grace",
+                lambda: len(self.heap),
+            )
+
+        self.threads = [
+            threading.Thread(target=self._verify_batches, name="verify", daemon=True),
+            threading.Thread(target=self._delete_when_due, name="grace", daemon=True),
+        ]
+        for thread in self.threads:
+            thread.start()
+
+    def _log(self, message):
+        if self.logger:
+            self.logger.log(message)
+
+    def __call__(self, absolute_path, key, stat, response):
+        if self.journal:
+            self.journal.deleting(absolute_path, stat, response.get("ETag"))
+        self.queue.put((absolute_path, key, stat, response))
+
+    def _next_batch(self):
+        batch = [self.queue.get()]
+        deadline = time.monotonic() + self.batch_wait
+        while len(batch) < self.batch_size and batch[-1] is not _STOP:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _head(self, key):
+        try:
+            return self.s3_client.head_object(
+                Bucket=self.bucket, Key=key, ChecksumMode="ENABLED"
+            )
+        except Exception as e:
+            self._log(f"cannot verify s3://{self.bucket}/{key}: {e}")
+            return None
+
+    def _remote_problem(self, stat, response, remote):
+        """Why S3 does not hold what was uploaded, or None if it does."""
+
+        if remote is None:
+            return "no such object"
+        if response.get("ETag") and remote.get("ETag") != response["ETag"]:
+            return "it has been replaced"
+        if "Bundle" not in response:
+            metadata = remote.get("Metadata", {})
+            size = metadata.get(UNCOMPRESSED_SIZE_KEY, remote.get("ContentLength"))
+            if str(size) != str(stat.st_size):
+                return f"size is {size}, expected {stat.st_size}"
+        checksum = response.get("ChecksumSHA256")
+        if checksum and remote.get("ChecksumSHA256") not in (None, checksum):
+            return "checksum does not match"
+        return None
+
+    def _local_problem(self, absolute_path, stat):
+        """Why the local file is not the one uploaded, or None if it is."""
+
+        try:
+            current = os.stat(absolute_path)
+        except FileNotFoundError:
+            return "it is already gone"
+        if (current.st_size, current.st_mtime_ns) != (stat.st_size, stat.st_mtime_ns):
+            return "it was written again after the upload"
+        return None
+
+    def verify(self, batch):
+        """Check one batch against S3; returns the (path, stat) safe to delete."""
+
+        keys = {response.get("Bundle", key) for _, key, _, response in batch}
+        remotes = dict(zip(keys, self.executor.map(self._head, keys)))
+
+        verified = []
+        for absolute_path, key, stat, response in batch:
+            remote = remotes[response.get("Bundle", key)]
+            problem = self._remote_problem(stat, response, remote)
+            if problem:
+                self._log(f"keeping {absolute_path}: {problem}")
+                if self.unverified:
+                    self.unverified.inc()
+                if self.journal:
+                    self.journal.failed(absolute_path, stat)  # sent again next start
+                continue
+
+            problem = self._local_problem(absolute_path, stat)
+            if problem:
+                self._log(f"keeping {absolute_path}: {problem}")
+                if os.path.exists(absolute_path):
+                    if self.unverified:
+                        self.unverified.inc()
+                elif self.journal:
+                    self.journal.forget(absolute_path)
+                continue
+            verified.append((absolute_path, stat))
+        return verified
+
+    def _verify_batches(self):
+        while True:
+            batch = self._next_batch()
+            stop = batch[-1] is _STOP
+            if stop:
+                batch.pop()
+
+            try:
+                verified = self.verify(batch) if batch else []
+            except Exception as e:
+                self._log(f"verifying {len(batch)} uploads failed with exception {e}")
+                verified = []
+
+            if not self.grace:
+                for absolute_path, stat in verified:
+                    self.executor.submit(self._unlink, absolute_path, stat)
+            elif verified:
+                due = time.monotonic() + self.grace
+                with self.condition:
+                    for absolute_path, stat in verified:
+                        heapq.heappush(
+                            self.heap, (due, next(self.sequence), absolute_path, stat)
+                        )
+                    self.condition.notify()
+
+            if stop:
+                return
+
+    def _delete_when_due(self):
+        while True:
+            with self.condition:
+                while True:
+                    if self.closed:
+                        return
+                    if not self.heap:
+                        self.condition.wait()
+                        continue
+                    delay = self.heap[0][0] - time.monotonic()
+                    if delay > 0:
+                        self.condition.wait(delay)
+                        continue
+                    _, _, absolute_path, stat = heapq.heappop(self.heap)
+                    break
+            self.executor.submit(self._unlink, absolute_path, stat)
+
+    def _unlink(self, absolute_path, stat):
+        try:
+            current = os.stat(absolute_path)
+            if (current.st_size, current.st_mtime_ns) != (
+                stat.st_size,
+                stat.st_mtime_ns,
+            ):
+                self._log(
+                    f"keeping {absolute_path}: written again during the grace delay"
+                )
+                return
+            os.remove(absolute_path)
+        except FileNotFoundError:
+            return  # somebody beat us to it
+        except OSError as e:
+            self._log(f"deleting {absolute_path} failed with exception {e}")
+            return
+        self._log(f"deleted {absolute_path}")
+        if self.journal:
+            self.journal.forget(absolute_path)
+
+    def close(self):
+        """Verify and delete what is still queued, then wait for the unlinks.
+
+        Files still waiting out the grace delay are left in place, and in
+        the journal as deleting.
+        """
+
+        # the verify thread works through the queue up to _STOP first
+        self.queue.put(_STOP)
+        verify, grace = self.threads
+        verify.join()
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        grace.join()
+        self.executor.shutdown(wait=True)
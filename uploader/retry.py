@@ -0,0 +1,170 @@
+import heapq
+import itertools
+import random
+import threading
+import time
+
+try:
+    import botocore.exceptions
+
+    # dropped connections and timeouts never got a response from S3
+    NETWORK_ERRORS = (
+        botocore.exceptions.ConnectionError,
+        botocore.exceptions.HTTPClientError,
+        ConnectionError,
+        TimeoutError,
+    )
+except ImportError:  # only the S3 client itself needs botocore
+    NETWORK_ERRORS = (ConnectionError, TimeoutError)
+
+RETRYABLE = "retryable"
+FATAL = "fatal"
+BUCKET_MISSING = "bucket-missing"
+
+# https://docs.aws.amazon.com/AmazonS3/latest/API/ErrorResponses.html
+RETRYABLE_CODES = {
+    "SlowDown",
+    "ServiceUnavailable",
+    "InternalError",
+    "RequestTimeout",
+    "RequestTimeTooSkewed",
+    "Throttling",
+    "ThrottlingException",
+    "RequestLimitExceeded",
+    "OperationAborted",
+}
+
+
+def classify(exc):
+    """Sort an upload exception into RETRYABLE, FATAL or BUCKET_MISSING."""
+
+    response = getattr(exc, "response", None)
+    if isinstance(response, dict):
+        code = response.get("Error", {}).get("Code", "")
+        status = response.get("ResponseMetadata", {}).get("HTTPStatusCode") or 0
+        if code == "NoSuchBucket":
+            return BUCKET_MISSING
+        if code in RETRYABLE_CODES or status >= 500 or status == 429:
+            return RETRYABLE
+        return FATAL  # access denied, bad request, ...
+
+    if isinstance(exc, NETWORK_ERRORS):
+        return RETRYABLE
+
+    return FATAL  # e.g. the local file vanished or is unreadable
+
+
+def backoff(attempt, base=1.0, cap=300.0):
+    """Full-jitter exponential backoff, in seconds."""
+    return random.uniform(0, min(cap, base * 2**attempt))
+
+
+class RetryScheduler:
+    """Delayed-retry queue for failed uploads.
+
+    failed(item, exc) classifies the error and, if it is worth another go,
+    schedules retry(item) after a jittered exponential delay. Due retries
+    are run by max_concurrent threads of their own, so a wave of throttling
+    errors slows the retries down instead of flooding S3 or the upload
+    queue. A missing bucket is retried at the longest delay, in case it is
+    being recreated; fatal errors are given up on immediately. stop()
+    ends the threads and returns the items whose retry had not run yet.
+    """
+
+    def __init__(
+        self,
+        retry,
+        max_attempts=5,
+        base=1.0,
+        cap=300.0,
+        max_concurrent=2,
+        logger=None,
+    ):
+        self.retry = retry
+        self.max_attempts = max_attempts
+        self.base = base
+        self.cap = cap
+        self.logger = logger
+
+        self.attempts = {}  # item -> failures so far
+        self.heap = []  # (due, sequence, item)
+        self.sequence = itertools.count()  # tie-breaker, items need not sort
+        self.condition = threading.Condition()
+        self.stopped = False
+
+        self.threads = [
+            threading.Thread(target=self._run, name=f"retry-{n}", daemon=True)
+            for n in range(max(1, max_concurrent))
+        ]
+        for thread in self.threads:
+            thread.start()
+
+    def _log(self, message):
+        if self.logger:
+            self.logger.log(message)
+
+    def succeeded(self, item):
+        with self.condition:
+            self.attempts.pop(item, None)
+
+    def failed(self, item, exc):
+        """Record a failure; returns True if a retry was scheduled."""
+
+        kind = classify(exc)
+        with self.condition:
+            attempt = self.attempts.get(item, 0) + 1
+            if kind == FATAL or attempt > self.max_attempts:
+                self.attempts.pop(item, None)
+                self._log(f"giving up on {item} after {attempt} attempt(s): {exc}")
+                return False
+
+            self.attempts[item] = attempt
+            if kind == BUCKET_MISSING:
+                delay = self.cap
+            else:
+                delay = backoff(attempt, self.base, self.cap)
+
+            heapq.heappush(
+                self.heap, (time.monotonic() + delay, next(self.sequence), item)
+            )
+            self.condition.notify()
+
+        self._log(f"{kind} error on {item}, retry {attempt} in {delay:.1f}s: {exc}")
+        return True
+
+    def stop(self):
+        """Run no more retries; returns the items still waiting, soonest first.
+
+        Retries already running finish before stop returns; one that fails
+        again is among the items returned.
+        """
+
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+        for thread in self.threads:
+            if thread is not threading.current_thread():
+                thread.join()
+        with self.condition:
+            return [item for _, _, item in sorted(self.heap)]
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while True:
+                    if self.stopped:
+                        return
+                    if not self.heap:
+                        self.condition.wait()
+                        continue
+                    delay = self.heap[0][0] - time.monotonic()
+                    if delay > 0:
+                        self.condition.wait(delay)
+                        continue
+                    _, _, item = heapq.heappop(self.heap)
+                    break
+
+            try:
+                self.retry(item)
+            except Exception as e:
+                self._log(f"retry of {item} failed with exception {e}")
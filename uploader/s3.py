@@ -0,0 +1,134 @@
+import time
+import urllib.parse
+
+import os.path
+
+from uploader import compress, multipart
+from uploader.dedup import METADATA_KEY
+
+
+def make_client(max_pool_connections=10):
+    """An S3 client sized for max_pool_connections concurrent requests."""
+
+    import boto3
+    import botocore.config
+
+    # boto3 clients are thread safe; one is shared by every upload
+    return boto3.client(
+        "s3",
+        config=botocore.config.Config(
+            max_pool_connections=max(10, max_pool_connections),
+            # adaptive mode rate-limits the client itself when S3 says SlowDown
+            retries={"mode": "adaptive"},
+        ),
+    )
+
+
+class S3Uploader:
+    """The upload stage: sends one file to s3://bucket/key.
+
+    upload() returns the S3 response and raises if the upload failed.
+    """
+
+    def __init__(
+        self,
+        s3_client,
+        bucket,
+        threshold=multipart.DEFAULT_THRESHOLD,
+        part_size=multipart.DEFAULT_PART_SIZE,
+        max_concurrency=multipart.DEFAULT_MAX_CONCURRENCY,
+        deduplicator=None,
+        compression=None,
+        metrics=None,
+        logger=None,
+    ):
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.threshold = threshold
+        self.part_size = part_size
+        self.max_concurrency = max_concurrency
+        self.deduplicator = deduplicator
+        self.compression = compression  # uploader.compress.CompressionRules
+        self.metrics = metrics
+        self.logger = logger
+
+    def _log(self, message):
+        if self.logger:
+            self.logger.log(message)
+
+    def tagging(self, absolute_path, codec=None, size=None):
+        tags = {
+            "filename": absolute_path
+            # hostname?
+        }
+        if codec:
+            # so a restore can tell the object was compressed without a HEAD
+            tags["compression"] = codec
+            tags["uncompressed-size"] = str(size)
+        return urllib.parse.urlencode(tags)
+
+    def upload(self, absolute_path, key, stat):
+        self._log(f"uploading {absolute_path} to s3://{self.bucket}/{key}")
+
+        # https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/s3.html#S3.Client.put_object
+        #
+        # other params to think about:
+        #    StorageClass, ACL, encryption
+        #
+
+        metadata = None
+        if self.deduplicator:
+            # hashed on the upload thread; cached by path, size and mtime
+            digest, remote = self.deduplicator.check(key, absolute_path, stat)
+            if remote:
+                self._log(f"{absolute_path} is unchanged in s3://{self.bucket}/{key}")
+                if self.metrics:
+                    self.metrics.skipped(absolute_path)
+                return remote
+            metadata = {METADATA_KEY: digest}
+
+        codec = None
+        if self.compression:
+            codec = self.compression.codec_for(os.path.basename(absolute_path))
+
+        started = time.monotonic()
+        try:
+            if codec:
+                # compressed and checksummed on the way out, in one read
+                response = compress.upload_compressed(
+                    self.s3_client,
+                    self.bucket,
+                    key,
+                    absolute_path,
+                    codec,
+                    tagging=self.tagging(absolute_path, codec, stat.st_size),
+                    metadata=metadata,
+                    part_size=self.part_size,
+                    max_concurrency=self.max_concurrency,
+                    logger=self.logger,
+                )
+            else:
+                # large files go up as a parallel multipart upload
+                response = multipart.upload_file(
+                    self.s3_client,
+                    self.bucket,
+                    key,
+                    absolute_path,
+                    tagging=self.tagging(absolute_path),
+                    metadata=metadata,
+                    threshold=self.threshold,
+                    part_size=self.part_size,
+                    max_concurrency=self.max_concurrency,
+                    logger=self.logger,
+                )
+        except Exception as e:
+            error = getattr(e, "response", None) or {}
+            if error.get("Error", {}).get("Code") == "NoSuchBucket":
+                self._log(f"ignoring {absolute_path}, no bucket named {self.bucket}")
+            raise
+
+        if self.metrics:
+            self.metrics.uploaded(
+                absolute_path, stat.st_size, time.monotonic() - started
+            )
+        return response
@@ -0,0 +1,68 @@
+import os
+import queue
+import threading
+
+
+def existing_files(directory, watched=None):
+    """Yield the path of every regular file under directory.
+
+    watched, if given, maps directories to time.time_ns() from just before
+    each was watched (a directory not in it goes by its parent), and only
+    files last modified before then are yielded: they were closed unseen.
+    Anything newer may still be open, and its IN_CLOSE_WRITE reports it.
+    """
+
+    watched = watched or {}
+    stack = [(directory, watched.get(directory))]
+    while stack:
+        current, before_ns = stack.pop()
+        try:
+            with os.scandir(current) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append((entry.path, watched.get(entry.path, before_ns)))
+                    elif entry.is_file(follow_symlinks=False):
+                        if before_ns is not None:
+                            try:
+                                stat = entry.stat(follow_symlinks=False)
+                            except FileNotFoundError:
+                                continue
+                            if stat.st_mtime_ns >= before_ns:
+                                continue  # written since, still open or not
+                        yield entry.path
+        except OSError:
+            continue  # removed or unreadable while we were walking
+
+
+class DirectoryScanner:
+    """Picks up files that landed in a new directory before it was watched.
+
+    InotifyTree adds watches for a new directory before it yields the
+    IN_CREATE|IN_ISDIR event, but anything written and closed in between
+    never produces an IN_CLOSE_WRITE. Each new directory is scanned once on
+    a background thread and handle(path) is called for every file found, so
+    the event loop moves on straight away instead of sleeping. Only files
+    older than the watch are handled; the watch reports the rest.
+    """
+
+    def __init__(self, handle, logger=None):
+        self.handle = handle
+        self.logger = logger
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self._run, name="scanner", daemon=True)
+        self.thread.start()
+
+    def submit(self, directory, watched=None):
+        self.queue.put((directory, watched))
+
+    def _run(self):
+        while True:
+            directory, watched = self.queue.get()
+            for path in existing_files(directory, watched):
+                if self.logger:
+                    self.logger.log(f"found {path} in new directory {directory}")
+                try:
+                    self.handle(path)
+                except Exception as e:
+                    if self.logger:
+                        self.logger.log(f"handling {path} failed with exception {e}")
@@ -0,0 +1,88 @@
+import bisect
+import hashlib
+import os.path
+
+DEFAULT_REPLICAS = 128  # points per node on the ring; more evens out the shares
+
+
+def _point(value):
+    return int.from_bytes(
+        hashlib.blake2b(value.encode("utf-8"), digest_size=8).digest(), "big"
+    )
+
+
+class HashRing:
+    """Consistent hashing of usernames onto nodes.
+
+    Every node is placed on a ring at replicas pseudo-random points, and a
+    user belongs to the node at the first point after the user's own hash.
+    Adding or removing a node only moves the users between it and its
+    neighbours, about 1/len(nodes) of them, and every process that builds
+    the ring from the same node names agrees on every owner.
+    """
+
+    def __init__(self, nodes, replicas=DEFAULT_REPLICAS):
+        if not nodes:
+            raise ValueError("a ring needs at least one node")
+        ring = sorted(
+            (_point(f"{node}#{replica}"), node)
+            for node in nodes
+            for replica in range(replicas)
+        )
+        self.points = [point for point, _ in ring]
+        self.nodes = [node for _, node in ring]
+
+    def owner(self, username):
+        index = bisect.bisect(self.points, _point(username))
+        return self.nodes[index % len(self.nodes)]
+
+
+def shard_key(root_directory, absolute_path):
+    """The first path component under root_directory, i.e. the SFTP user.
+
+    A directory directly under the root is keyed by its own name, so a new
+    user's home directory belongs to the same node as the files in it.
+    """
+
+    relative = os.path.relpath(absolute_path, start=root_directory)
+    return relative.partition(os.sep)[0]
+
+
+class Shard:
+    """Which paths under root_directory belong to this node (--node-index).
+
+    Nodes are named by their index, 0 .. node_count-1, so the ring is the
+    same on every node; changing --node-count everywhere rebalances.
+    """
+
+    def __init__(
+        self, root_directory, node_index, node_count, replicas=DEFAULT_REPLICAS
+    ):
+        if not 0 <= node_index < node_count:
+            raise ValueError(f"--node-index must be between 0 and {node_count - 1}")
+        self.root_directory = os.path.normpath(root_directory)
+        self.node = str(node_index)
+        self.ring = HashRing([str(n) for n in range(node_count)], replicas)
+        self.owned = {}  # username -> bool, looked up once per user
+
+    def owns_user(self, username):
+        owned = self.owned.get(username)
+        if owned is None:
+            owned = self.owned[username] = self.ring.owner(username) == self.node
+        return owned
+
+    def __call__(self, absolute_path):
+        return self.owns_user(shard_key(self.root_directory, absolute_path))
+
+
+class ShardedWatcher:
+    """Passes on only the events of another watcher that this node owns."""
+
+    def __init__(self, watcher, shard):
+        self.watcher = watcher
+        self.shard = shard
+
+    def events(self):
+        for kind, absolute_path, watched in self.watcher.events():
+            if self.shard(absolute_path):
+                yield kind, absolute_path, watched
@@ -0,0 +1,260 @@
+import os
+import os.path
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from uploader.index import ScanIndex
+from uploader.native_inotify import (
+    IN_CLOSE_WRITE,
+    IN_CREATE,
+    IN_ISDIR,
+    IN_MOVED_TO,
+    IN_Q_OVERFLOW,
+    InotifyReader,
+)
+
+# what a watcher reports
+CLOSED = "closed"  # a file was written and closed
+NEW_DIRECTORY = "directory"  # a directory was created or moved in
+
+
+class InotifyTreeWatcher:
+    """The watcher stage, on top of inotify.adapters.InotifyTree.
+
+    events() yields (CLOSED, path, None) and (NEW_DIRECTORY, path, watched)
+    and skips every other kind of event. watched maps the new directory,
+    and any directories under it, to time.time_ns() from just before each
+    was watched: a file with an older mtime was closed unseen, anything
+    newer raises its own IN_CLOSE_WRITE.
+    """
+
+    def __init__(self, root_directory, metrics=None):
+        import inotify.adapters  # https://pypi.org/project/inotify/
+
+        # inotifywait --monitor --recursive --quiet --event close_write $PWD/out
+        self.listener = inotify.adapters.InotifyTree(root_directory)
+        self.metrics = metrics
+
+    def events(self):
+        for event in self.listener.event_gen(yield_nones=False):
+            (_, type_names, path, filename) = event
+            if self.metrics:
+                self.metrics.events.inc()
+
+            # print(f"PATH=[{path}] FILENAME=[{filename}] EVENT_TYPES={type_names}")
+            if "IN_ISDIR" in type_names:
+                # InotifyTree is already watching it by the time we see this,
+                # so this is a little late; a file closed in between is only
+                # uploaded twice
+                if "IN_CREATE" in type_names or "IN_MOVED_TO" in type_names:
+                    directory = os.path.join(path, filename)
+                    yield NEW_DIRECTORY, directory, {directory: time.time_ns()}
+                continue
+
+            if not ("IN_CLOSE_WRITE" in type_names):
+                continue  # we only care about IN_CLOSE_WRITE events
+
+            yield CLOSED, os.path.normpath(f"{path}/{filename}"), None
+
+
+class NativeTreeWatcher:
+    """The watcher stage for --watch-mode native: inotify without the library.
+
+    Reports the same events as InotifyTreeWatcher, but sleeps in epoll
+    instead of polling with a timeout and decodes each batch of events
+    from one read() with integer mask tests, so a storm of rewrites costs
+    the watcher thread far less.
+    """
+
+    def __init__(self, root_directory, metrics=None, logger=None):
+        self.reader = InotifyReader(root_directory)
+        self.metrics = metrics
+        self.logger = logger
+
+    def events(self):
+        reader = self.reader
+        new_directory = IN_CREATE | IN_MOVED_TO
+        while True:
+            reader.wait()
+            events = reader.read_events()
+            if self.metrics:
+                self.metrics.events.inc(len(events))
+
+            for event in events:
+                mask = event.mask
+                if mask & IN_CLOSE_WRITE:
+                    path = os.path.normpath(f"{event.directory}/{event.name}")
+                    yield CLOSED, path, None
+                elif mask & IN_ISDIR:
+                    if mask & new_directory:
+                        path = os.path.join(event.directory, event.name)
+                        yield NEW_DIRECTORY, path, reader.add_tree(path)
+                elif mask & IN_Q_OVERFLOW and self.logger:
+                    self.logger.log("inotify queue overflowed, events were lost")
+
+    def close(self):
+        self.reader.close()
+
+
+def _list_directory(directory):
+    """([(name, size, mtime_ns)], [subdirectory]) for one directory.
+
+    Runs on a walker thread. On NFS each call is a READDIRPLUS, which brings
+    the attributes back with the names, so the stat() calls are cheap.
+    """
+
+    files = []
+    subdirectories = []
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirectories.append(entry.path)
+                elif entry.is_file(follow_symlinks=False):
+                    stat = entry.stat(follow_symlinks=False)
+                    files.append((entry.name, stat.st_size, stat.st_mtime_ns))
+            except FileNotFoundError:
+                continue  # removed between readdir and stat
+    return files, subdirectories
+
+
+class ScanTreeWatcher:
+    """The watcher stage for --watch-mode scan: finds changes by rescanning.
+
+    inotify needs a watch per directory and only sees writes made through
+    this machine's mount. This watcher instead lists the whole tree every
+    interval seconds and compares each file's size and mtime against a
+    ScanIndex, so it also sees files written by other NFS clients. Every
+    directory is listed as a separate task on a pool of walker threads, so
+    a deep tree is walked in parallel and the coordinating thread only
+    compares and records.
+
+    A file is reported as CLOSED once its mtime is at least min_age seconds
+    old; younger files are probably still being written and are looked at
+    again on the next pass. With an empty index the first pass only
+    records the tree, the way inotify would not report files that were
+    already there; use --journal to upload those.
+
+    owns, if given, is asked about each entry directly under the root
+    (uploader.shard.Shard); other users' home directories are not walked.
+    A directory that becomes owned later is not in the index, so all of
+    its files are reported on the next pass.
+    """
+
+    def __init__(
+        self,
+        root_directory,
+        index=None,
+        interval=30.0,
+        walkers=8,
+        min_age=5.0,
+        owns=None,
+        metrics=None,
+        logger=None,
+    ):
+        self.root_directory = os.path.normpath(root_directory)
+        self.owns = owns
+        self.index = index or ScanIndex()
+        self.interval = interval
+        self.walkers = walkers
+        self.min_age = min_age
+        self.metrics = metrics
+        self.logger = logger
+
+        self.scan_pass = self.index.last_pass()
+        self.last_scan_seconds = 0.0
+        self.scanned_files = 0
+        if metrics:
+            metrics.gauge(
+                "uploader_scan_seconds",
+                "how long the last full scan took",
+                lambda: self.last_scan_seconds,
+            )
+            metrics.gauge(
+                "uploader_scanned_files",
+                "files seen by the last full scan",
+                lambda: self.scanned_files,
+            )
+
+    def _log(self, message):
+        if self.logger:
+            self.logger.log(message)
+
+    def scan(self, executor, report=True):
+        """One pass over the tree; yields the path of every changed file."""
+
+        self.scan_pass += 1
+        cutoff = time.time_ns() - int(self.min_age * 1e9)
+        scanned = 0
+
+        pending = {executor.submit(_list_directory, self.root_directory)}
+        directories = {next(iter(pending)): self.root_directory}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                directory = directories.pop(future)
+                try:
+                    files, subdirectories = future.result()
+                except FileNotFoundError:
+                    continue  # removed; its rows are pruned below
+                except OSError as e:
+                    # keep what we knew about it until it can be read again
+                    self._log(f"cannot scan {directory}: {e}")
+                    self.index.update(directory, self.scan_pass)
+                    continue
+
+                if self.owns and directory == self.root_directory:
+                    subdirectories = [d for d in subdirectories if self.owns(d)]
+                    files = [
+                        entry
+                        for entry in files
+                        if self.owns(os.path.join(directory, entry[0]))
+                    ]
+
+                for subdirectory in subdirectories:
+                    child = executor.submit(_list_directory, subdirectory)
+                    directories[child] = subdirectory
+                    pending.add(child)
+
+                scanned += len(files)
+                known = self.index.rows(directory)
+                changed = []
+                for name, size, mtime_ns in files:
+                    if known.pop(name, None) == (size, mtime_ns):
+                        continue  # unchanged since the last pass
+                    if mtime_ns > cutoff:
+                        continue  # probably still being written, next pass
+                    changed.append((name, size, mtime_ns))
+                    if report:
+                        if self.metrics:
+                            self.metrics.events.inc()
+                        yield os.path.join(directory, name)
+
+                # whatever is left in known has been deleted
+                self.index.update(directory, self.scan_pass, changed, known)
+
+        self.index.prune(self.scan_pass)
+        self.scanned_files = scanned
+
+    def events(self):
+        # nothing to compare against yet: record the tree without reporting it
+        baseline = self.index.empty()
+        if baseline:
+            self._log(f"indexing {self.root_directory}")
+
+        executor = ThreadPoolExecutor(self.walkers, thread_name_prefix="walker")
+        try:
+            while True:
+                started = time.monotonic()
+                for absolute_path in self.scan(executor, report=not baseline):
+                    yield CLOSED, absolute_path, None
+                baseline = False
+
+                self.last_scan_seconds = time.monotonic() - started
+                self._log(
+                    f"scanned {self.scanned_files} files"
+                    f" in {self.last_scan_seconds:.1f}s"
+                )
+                time.sleep(max(0.0, self.interval - self.last_scan_seconds))
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
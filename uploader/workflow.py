@@ -0,0 +1,99 @@
+"""The custom step of the Transfer post-upload workflow, run as a Lambda.
+
+Transfer calls the step once for every file a user finishes uploading;
+the Lambda has the file system mounted at MOUNT_PATH and copies the file
+to S3 with the same S3Uploader, key mapping, tagging and --compress rules
+as the watcher daemon, then reports back with SendWorkflowStepState.
+
+Configured through the environment:
+
+    BUCKET       destination bucket
+    PREFIX       key prefix, as --s3prefix
+    COMPRESS     comma-separated SUFFIX=CODEC rules, as --compress
+    MOUNT_PATH   where the file system is mounted (default /mnt/efs)
+"""
+
+import os
+import os.path
+
+from uploader.compress import CompressionRules
+from uploader.keys import KeyMapper
+from uploader.log import VerboseLogger
+from uploader.s3 import S3Uploader, make_client
+
+DEFAULT_MOUNT_PATH = "/mnt/efs"
+
+
+class WorkflowStep:
+    """Copies the file named in one workflow event to S3 and reports the outcome."""
+
+    def __init__(
+        self,
+        s3_client,
+        transfer_client,
+        bucket,
+        prefix="",
+        compress=(),
+        mount_path=DEFAULT_MOUNT_PATH,
+        logger=None,
+    ):
+        self.transfer_client = transfer_client
+        self.mount_path = mount_path
+        self.logger = logger
+        self.key_mapper = KeyMapper(mount_path, prefix)
+        self.uploader = S3Uploader(
+            s3_client,
+            bucket,
+            compression=CompressionRules(compress) if compress else None,
+            logger=logger,
+        )
+
+    def _log(self, message):
+        if self.logger:
+            self.logger.log(message)
+
+    def local_path(self, event):
+        # fileLocation.path is absolute within the file system, e.g. /alice/x.dat
+        location = event["fileLocation"]
+        return os.path.normpath(f"{self.mount_path}/{location['path']}")
+
+    def __call__(self, event):
+        execution = event["serviceMetadata"]["executionDetails"]
+        status = "SUCCESS"
+        response = None
+        try:
+            absolute_path = self.local_path(event)
+            key = self.key_mapper(absolute_path)
+            response = self.uploader.upload(absolute_path, key, os.stat(absolute_path))
+        except Exception as e:
+            self._log(f"copying {event.get('fileLocation')} failed with exception {e}")
+            status = "FAILURE"
+
+        self.transfer_client.send_workflow_step_state(
+            WorkflowId=execution["workflowId"],
+            ExecutionId=execution["executionId"],
+            Token=event["token"],
+            Status=status,
+        )
+        return {"status": status, "etag": (response or {}).get("ETag")}
+
+
+_step = None  # reused while the Lambda stays warm
+
+
+def handler(event, context):
+    global _step
+    if _step is None:
+        import boto3
+
+        compress = os.environ.get("COMPRESS", "")
+        _step = WorkflowStep(
+            make_client(),
+            boto3.client("transfer"),
+            os.environ["BUCKET"],
+            prefix=os.environ.get("PREFIX", ""),
+            compress=[spec for spec in compress.split(",") if spec],
+            mount_path=os.environ.get("MOUNT_PATH", DEFAULT_MOUNT_PATH),
+            logger=VerboseLogger(),
+        )
+    return _step(event)